@@ -18,14 +18,18 @@
 from cStringIO import StringIO
 from errno import (EACCES, EBADF, EINVAL, EISDIR, EIO, ENOENT, ENOTDIR,
                    ENOTEMPTY)
-from getpass import getuser
+from hashlib import new as new_hash
+from os.path import expanduser
 from stat import S_IFDIR, S_IFREG
 from sys import argv
+from tempfile import mkdtemp
+from threading import RLock
 from time import time
 
 
 from snf_django.lib.api.parsedate import parse_http_date
 
+from pithos.tools.lib.blockcache import DiskBlockCache
 from pithos.tools.lib.client import OOS_Client, Fault
 from pithos.tools.lib.fuse import FUSE, FuseOSError, Operations
 from pithos.tools.lib.util import get_user, get_auth, get_url
@@ -33,11 +37,46 @@ from pithos.tools.lib.util import get_user, get_auth, get_url
 
 epoch = int(time())
 
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+CACHE_DIR = expanduser('~/.pithos/fs-cache')
+
+
+class WriteBuffer(object):
+    """Consecutive writes to an object, to be sent as a single update."""
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.length = 0
+        self._chunks = []
+
+    @property
+    def end(self):
+        return self.offset + self.length
+
+    def append(self, data):
+        self._chunks.append(data)
+        self.length += len(data)
+
+    def getvalue(self):
+        return ''.join(self._chunks)
+
 
 class StoreFS(Operations):
-    def __init__(self, verbose=False):
+    """Reads fetch only the blocks they cover, through a disk cache of
+    blocks keyed by hash. Writes are buffered per object and sent in block
+    sized updates, or on flush, fsync and release.
+    """
+
+    def __init__(self, verbose=False, cache_path=None,
+                 cache_size=DEFAULT_CACHE_SIZE):
         self.verbose = verbose
         self.client = OOS_Client(get_url(), get_auth(), get_user())
+        self.cache = DiskBlockCache(cache_path or mkdtemp(prefix='pithos-fs-'),
+                                    cache_size)
+        self._hashmaps = {}
+        self._writes = {}
+        self._block_sizes = {}
+        self._lock = RLock()
 
     def __call__(self, op, path, *args):
         container, sep, object = path[1:].partition('/')
@@ -84,7 +123,74 @@ class StoreFS(Operations):
         except Fault:
             raise FuseOSError(ENOENT)
 
+    def _get_block_size(self, container):
+        block_size = self._block_sizes.get(container)
+        if block_size is None:
+            meta = self._get_container_meta(container)
+            block_size = int(meta['x-container-block-size'])
+            self._block_sizes[container] = block_size
+        return block_size
+
+    def _get_hashmap(self, container, object):
+        key = (container, object)
+        hashmap = self._hashmaps.get(key)
+        if hashmap is None:
+            try:
+                hashmap = self.client.retrieve_object(
+                    container, object, format='json',
+                    params={'hashmap': None})
+            except Fault:
+                raise FuseOSError(ENOENT)
+            self._hashmaps[key] = hashmap
+        return hashmap
+
+    def _forget(self, container, object):
+        self._hashmaps.pop((container, object), None)
+
+    def _read_block(self, container, object, hashmap, index, lo, hi):
+        """Return the bytes from lo to hi of a block."""
+
+        block_size = int(hashmap['block_size'])
+        start = index * block_size
+        length = min(block_size, hashmap['bytes'] - start)
+        hash = hashmap['hashes'][index]
+        data = self.cache.get(hash, hashmap['block_hash'], lo, hi - lo)
+        if data is None:
+            data = self.client.retrieve_object(
+                container, object,
+                range='bytes=%d-%d' % (start, start + length - 1))
+            h = new_hash(hashmap['block_hash'])
+            h.update(data.rstrip('\x00'))
+            if h.hexdigest() == hash:
+                self.cache.put(hash, data)
+            else:
+                # The object changed since the hashmap was retrieved.
+                self._forget(container, object)
+            data = data[lo:hi]
+        # Blocks are hashed without their trailing zeros.
+        return data + '\x00' * (hi - lo - len(data))
+
+    def _flush(self, container, object):
+        with self._lock:
+            buf = self._writes.get((container, object))
+            if buf is None:
+                return
+            self._forget(container, object)
+            # Keep the writes buffered until they are sent.
+            self.client.update_object(container, object,
+                                      StringIO(buf.getvalue()),
+                                      offset=buf.offset)
+            del self._writes[(container, object)]
+
+    def _flush_all(self):
+        with self._lock:
+            for container, object in self._writes.keys():
+                self._flush(container, object)
+
     # Global
+    def destroy(self, path):
+        self._flush_all()
+
     def statfs(self, path):
         return dict(f_bsize=1024, f_blocks=1024 ** 2, f_bfree=1024 ** 2,
                     f_bavail=1024 ** 2)
@@ -221,6 +327,9 @@ class StoreFS(Operations):
         uid = int(meta.get('x-account-meta-uid', 0))
         gid = int(meta.get('x-account-meta-gid', 0))
         size = int(meta.get('content-length', 0))
+        buf = self._writes.get((container, object))
+        if buf is not None:
+            size = max(size, buf.end)
 
         if meta['content-type'].split(';', 1)[0].strip() == 'application/directory':
             mode = int(meta.get('x-object-meta-mode', 0755))
@@ -255,9 +364,33 @@ class StoreFS(Operations):
         self.client.create_directory_marker(container, object)
         self.client.update_object_metadata(container, object, mode=mode)
 
+    def object_flush(self, container, object, fh):
+        self._flush(container, object)
+        return 0
+
+    def object_fsync(self, container, object, datasync, fh):
+        self._flush(container, object)
+        return 0
+
+    def object_open(self, container, object, flags):
+        # See the changes made since the object was last opened.
+        self._forget(container, object)
+        return 0
+
     def object_read(self, container, object, nbyte, offset, fh):
-        data = self.client.retrieve_object(container, object)
-        return data[offset:offset + nbyte]
+        self._flush(container, object)
+        hashmap = self._get_hashmap(container, object)
+        block_size = int(hashmap['block_size'])
+        end = min(offset + nbyte, hashmap['bytes'])
+        if offset >= end:
+            return ''
+        data = []
+        for index in xrange(offset // block_size, (end - 1) // block_size + 1):
+            start = index * block_size
+            data.append(self._read_block(container, object, hashmap, index,
+                                         max(offset - start, 0),
+                                         min(end - start, block_size)))
+        return ''.join(data)
 
     def object_readdir(self, container, object, fh):
         objects = self.client.list_objects(container, delimiter='/',
@@ -265,6 +398,10 @@ class StoreFS(Operations):
         files = [o.rpartition('/')[2] for o in objects if not o.endswith('/')]
         return ['.', '..'] + files
 
+    def object_release(self, container, object, fh):
+        self._flush(container, object)
+        return 0
+
     def object_removexattr(self, container, object, name):
         attr = 'xattr-' + name
         self.client.delete_object_metadata(container, object, [attr])
@@ -273,7 +410,9 @@ class StoreFS(Operations):
         new_container, sep, new_object = path[1:].partition('/')
         if not new_container or not new_object:
             raise FuseOSError(EINVAL)
+        self._flush(container, object)
         self.client.move_object(container, object, new_container, new_object)
+        self._forget(new_container, new_object)
 
     def object_rmdir(self, container, object):
         self.client.delete_object(container, object)
@@ -285,16 +424,30 @@ class StoreFS(Operations):
         self.client.update_object_metadata(container, object, **meta)
 
     def object_truncate(self, container, object, length, fh=None):
+        self._flush(container, object)
+        self._forget(container, object)
         data = self.client.retrieve_object(container, object)
         f = StringIO(data[:length])
         self.client.update_object(container, object, f)
 
     def object_unlink(self, container, object):
+        with self._lock:
+            self._writes.pop((container, object), None)
+        self._forget(container, object)
         self.client.delete_object(container, object)
 
     def object_write(self, container, object, data, offset, fh):
-        f = StringIO(data)
-        self.client.update_object(container, object, f, offset=offset)
+        key = (container, object)
+        with self._lock:
+            buf = self._writes.get(key)
+            if buf is not None and buf.end != offset:
+                self._flush(container, object)
+                buf = None
+            if buf is None:
+                buf = self._writes[key] = WriteBuffer(offset)
+            buf.append(data)
+            if buf.length >= self._get_block_size(container):
+                self._flush(container, object)
         return len(data)
 
 
@@ -303,8 +456,7 @@ def main():
         print 'usage: %s <mountpoint>' % argv[0]
         exit(1)
 
-    user = getuser()
-    fs = StoreFS(verbose=True)
+    fs = StoreFS(verbose=True, cache_path=CACHE_DIR)
     fuse = FUSE(fs, argv[1], foreground=True)
 
 
@@ -0,0 +1,132 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from collections import OrderedDict
+from hashlib import new as new_hash
+from threading import Lock
+
+
+class DiskBlockCache(object):
+    """A cache of blocks in a directory, keyed by their hash.
+
+    Blocks never change for a given hash, so entries need no invalidation.
+    The least recently used blocks are removed once the cache grows over
+    size bytes. Blocks left in the directory by a previous run are reused,
+    so the directory must be private: it is created with mode 0700 and a
+    directory owned by another user is refused. Blocks found there are
+    hashed again when first read and discarded if they do not match. Blocks
+    put by the caller are taken to be verified.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.used = 0
+        self._blocks = OrderedDict()  # hash -> length
+        self._verified = set()
+        self._lock = Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path, 0700)
+        st = os.stat(path)
+        if st.st_uid != os.getuid():
+            raise OSError("Cache directory %s is not owned by the user" %
+                          path)
+        if st.st_mode & 0077:
+            os.chmod(path, 0700)
+        entries = []
+        for name in os.listdir(path):
+            st = os.stat(os.path.join(path, name))
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(path, name))
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        for mtime, name, length in sorted(entries):
+            self._blocks[name] = length
+            self.used += length
+        self._evict()
+
+    def _path(self, hash):
+        return os.path.join(self.path, hash)
+
+    def _evict(self):
+        while self.used > self.size and self._blocks:
+            hash, length = self._blocks.popitem(last=False)
+            self._verified.discard(hash)
+            self.used -= length
+            try:
+                os.remove(self._path(hash))
+            except OSError:
+                pass
+
+    def _discard(self, hash, length):
+        with self._lock:
+            if self._blocks.pop(hash, None) is not None:
+                self.used -= length
+            self._verified.discard(hash)
+        try:
+            os.remove(self._path(hash))
+        except OSError:
+            pass
+
+    def get(self, hash, blockhash, offset=0, size=-1):
+        """Return size bytes from offset of the block with the given hash,
+        or None if not cached.
+
+        A block not verified yet is read whole and hashed with the
+        blockhash algorithm, without its trailing zeros.
+        """
+
+        with self._lock:
+            length = self._blocks.pop(hash, None)
+            if length is None:
+                return None
+            self._blocks[hash] = length
+            verified = hash in self._verified
+        try:
+            with open(self._path(hash), 'rb') as fp:
+                if verified:
+                    fp.seek(offset)
+                    return fp.read(size)
+                data = fp.read()
+        except IOError:
+            self._discard(hash, length)
+            return None
+        h = new_hash(blockhash)
+        h.update(data.rstrip('\x00'))
+        if h.hexdigest() != hash:
+            self._discard(hash, length)
+            return None
+        with self._lock:
+            if hash in self._blocks:
+                self._verified.add(hash)
+        return data[offset:] if size < 0 else data[offset:offset + size]
+
+    def put(self, hash, data):
+        if len(data) > self.size:
+            return
+        tmp = '%s.%d.tmp' % (self._path(hash), id(data))
+        with open(tmp, 'wb') as fp:
+            fp.write(data)
+        os.rename(tmp, self._path(hash))
+        with self._lock:
+            old = self._blocks.pop(hash, None)
+            if old is not None:
+                self.used -= old
+            self._blocks[hash] = len(data)
+            self._verified.add(hash)
+            self.used += len(data)
+            self._evict()
@@ -15,8 +15,10 @@
 
 import hashlib
 import os
+import sys
 
 from binascii import hexlify
+from threading import Thread
 
 from progress.bar import IncrementalBar
 
@@ -69,6 +71,36 @@ class HashMap(list):
             self.append(self._hash_block(block))
             self.size += len(block)
 
+    def load_parallel(self, path, workers=4):
+        """Compute the block hashes of the file at path, with each of the
+        worker threads hashing a contiguous range of blocks."""
+
+        size = os.path.getsize(path)
+        nblocks = (size + self.blocksize - 1) // self.blocksize
+        hashes = [None] * nblocks
+        errors = []
+
+        def work(first, last):
+            try:
+                with open(path, 'rb') as fp:
+                    fp.seek(first * self.blocksize)
+                    for i in xrange(first, last):
+                        hashes[i] = self._hash_block(fp.read(self.blocksize))
+            except:
+                errors.append(sys.exc_info())
+
+        step = max(1, -(-nblocks // workers))
+        threads = [Thread(target=work, args=(i, min(i + step, nblocks)))
+                   for i in xrange(0, nblocks, step)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        self[:] = hashes
+        self.size = size
+
 
 def merkle(path, blocksize=4194304, blockhash='sha256'):
     hashes = HashMap(blocksize, blockhash)
@@ -14,26 +14,150 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import sys
 import types
 import json
+import hashlib
 
 from hashmap import HashMap
-from binascii import hexlify, unhexlify
+from binascii import hexlify
 from cStringIO import StringIO
 from client import Fault
+from threading import Thread, Lock
+from Queue import Queue, Empty
+from time import time
 
 from progress.bar import IncrementalBar
 
 
-def upload(client, path, container, prefix, name=None, mimetype=None):
+DEFAULT_WORKERS = 4
+STATE_SAVE_INTERVAL = 5  # seconds
+
+
+class TransferBar(IncrementalBar):
+    """A progress bar that also reports the transfer rate."""
+
+    suffix = '%(percent).1f%% - %(rate)s - %(eta)ds'
+
+    def __init__(self, *args, **kwargs):
+        super(TransferBar, self).__init__(*args, **kwargs)
+        self.transferred = 0
+        self.started = time()
+
+    @property
+    def rate(self):
+        elapsed = time() - self.started
+        if elapsed <= 0:
+            return '-'
+        return '%.1f MB/s' % (self.transferred / elapsed / (1024 * 1024))
+
+
+class TransferState(object):
+    """The blocks of a download written so far, saved next to the file.
+
+    The state is tied to the hashmap of the object and is ignored if the
+    object has changed since it was saved. The file being written is synced
+    before each save, so that the state never records blocks that did not
+    reach the disk.
+    """
+
+    def __init__(self, path, hashmap):
+        self.path = path + '.pithos-transfer'
+        h = hashlib.sha256()
+        h.update(json.dumps([hashmap['bytes'], hashmap['block_size'],
+                             hashmap['block_hash'], hashmap['hashes']]))
+        self.key = h.hexdigest()
+        self.done = set()
+        self.saved = time()
+        try:
+            with open(self.path) as fp:
+                state = json.load(fp)
+        except (IOError, ValueError):
+            return
+        if state.get('key') == self.key:
+            self.done = set(state['done'])
+
+    def add(self, index, fp):
+        self.done.add(index)
+        if time() - self.saved > STATE_SAVE_INTERVAL:
+            self.save(fp)
+
+    def save(self, fp):
+        fp.flush()
+        os.fsync(fp.fileno())
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as state:
+            json.dump({'key': self.key, 'done': sorted(self.done)}, state)
+            state.flush()
+            os.fsync(state.fileno())
+        os.rename(tmp, self.path)
+        self.saved = time()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _transfer(func, items, workers, bar):
+    """Call func on each item from a pool of worker threads.
+
+    func returns the number of bytes transferred, which are reported to bar.
+    The first exception raised by func stops the transfer and is re-raised.
+    """
+
+    pending = Queue()
+    for item in items:
+        pending.put(item)
+    lock = Lock()
+    errors = []
+
+    def work():
+        while not errors:
+            try:
+                item = pending.get_nowait()
+            except Empty:
+                return
+            try:
+                transferred = func(item)
+            except:
+                errors.append(sys.exc_info())
+                return
+            with lock:
+                bar.transferred += transferred
+                bar.next()
+
+    threads = [Thread(target=work)
+               for i in xrange(min(workers, pending.qsize()))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        # Join with a timeout, to stay responsive to interrupts.
+        while t.is_alive():
+            t.join(0.5)
+    bar.finish()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+
+def upload(client, path, container, prefix, name=None, mimetype=None,
+           workers=DEFAULT_WORKERS, hashes=None):
+    """Upload a file, sending only the blocks missing from the container.
+
+    An interrupted upload is resumed by uploading again, as the blocks
+    sent already are no longer missing. The file is not hashed if its
+    HashMap is given, with the block size and hash of the container.
+    """
 
     meta = client.retrieve_container_metadata(container)
     blocksize = int(meta['x-container-block-size'])
     blockhash = meta['x-container-block-hash']
 
     size = os.path.getsize(path)
-    hashes = HashMap(blocksize, blockhash)
-    hashes.load(open(path))
+    if (hashes is None or hashes.blocksize != blocksize or
+            hashes.blockhash != blockhash):
+        hashes = HashMap(blocksize, blockhash)
+        hashes.load(open(path))
     map = {'bytes': size, 'hashes': [hexlify(x) for x in hashes]}
 
     objectname = name if name else os.path.split(path)[-1]
@@ -56,21 +180,33 @@ def upload(client, path, container, prefix, name=None, mimetype=None):
     if '' in missing:
         del missing[missing.index(''):]
 
-    bar = IncrementalBar('Uploading', max=len(missing))
-    bar.suffix = '%(percent).1f%% - %(eta)ds'
-    with open(path) as fp:
-        for hash in missing:
-            offset = hashes.index(unhexlify(hash)) * blocksize
-            fp.seek(offset)
-            block = fp.read(blocksize)
+    # Map each hash to the first block having it.
+    offsets = {}
+    for i, h in enumerate(map['hashes']):
+        offsets.setdefault(h, i * blocksize)
+
+    bar = TransferBar('Uploading', max=len(missing))
+    lock = Lock()
+    with open(path, 'rb') as fp:
+        def upload_block(hash):
+            with lock:
+                fp.seek(offsets[hash])
+                block = fp.read(blocksize)
             client.update_container_data(container, StringIO(block))
-            bar.next()
-    bar.finish()
+            return len(block)
+
+        _transfer(upload_block, set(missing), workers, bar)
 
     return client.create_object_by_hashmap(container, object, map, **kwargs)
 
 
-def download(client, container, object, path):
+def download(client, container, object, path, workers=DEFAULT_WORKERS,
+             resume=False):
+    """Download an object, fetching only the blocks that differ locally.
+
+    With resume, the blocks written are recorded, so that an interrupted
+    download continues where it stopped.
+    """
 
     res = client.retrieve_object_hashmap(container, object)
     blocksize = int(res['block_size'])
@@ -78,7 +214,12 @@ def download(client, container, object, path):
     bytes = res['bytes']
     map = res['hashes']
 
-    if os.path.exists(path):
+    state = TransferState(path, res) if resume else None
+    if state is not None and state.done and os.path.exists(path):
+        hashes = [h if i in state.done else None for i, h in enumerate(map)]
+    elif os.path.exists(path):
+        if state is not None:
+            state.done.clear()
         h = HashMap(blocksize, blockhash)
         h.load(open(path))
         hashes = [hexlify(x) for x in h]
@@ -86,17 +227,40 @@ def download(client, container, object, path):
         open(path, 'w').close()     # Create an empty file
         hashes = []
 
-    with open(path, 'a+') as fp:
-        if bytes != 0:
-            for i, h in enumerate(map):
-                if i < len(hashes) and h == hashes[i]:
-                    continue
-                start = i * blocksize
-                end = '' if i == len(map) - 1 else ((i + 1) * blocksize) - 1
-                data = client.retrieve_object(
-                    container, object, range='bytes=%s-%s' % (start, end))
-                if i != len(map) - 1:
-                    data += (blocksize - len(data)) * '\x00'
-                fp.seek(start)
-                fp.write(data)
+    # Fetch each hash once and write it to all the blocks having it.
+    blocks = {}
+    if bytes != 0:
+        for i, h in enumerate(map):
+            if i < len(hashes) and h == hashes[i]:
+                continue
+            blocks.setdefault(h, []).append(i)
+
+    lock = Lock()
+    with open(path, 'r+b') as fp:
+        def download_block(hash):
+            indices = blocks[hash]
+            start = indices[0] * blocksize
+            end = '' if indices[0] == len(map) - 1 else start + blocksize - 1
+            data = client.retrieve_object(
+                container, object, range='bytes=%s-%s' % (start, end))
+            transferred = len(data)
+            data += (blocksize - transferred) * '\x00'
+            with lock:
+                for i in indices:
+                    fp.seek(i * blocksize)
+                    fp.write(data)
+                    if state is not None:
+                        state.add(i, fp)
+            return transferred
+
+        bar = TransferBar('Downloading', max=len(blocks))
+        try:
+            _transfer(download_block, blocks.keys(), workers, bar)
+        except:
+            if state is not None:
+                with lock:
+                    state.save(fp)
+            raise
         fp.truncate(bytes)
+    if state is not None:
+        state.remove()
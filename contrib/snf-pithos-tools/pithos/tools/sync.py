@@ -19,25 +19,38 @@ import os
 import sqlite3
 import sys
 
-from os.path import exists, expanduser, isdir, isfile, join, split
+from binascii import hexlify, unhexlify
+from os.path import dirname, exists, expanduser, isdir, isfile, join, split
 from shutil import copyfile
 from time import time
 
 from pithos.tools.lib.transfer import download, upload
 from pithos.tools.lib.client import Pithos_Client, Fault
-from pithos.tools.lib.hashmap import merkle
+from pithos.tools.lib.hashmap import HashMap
 from pithos.tools.lib.util import get_user, get_auth, get_url
 
 
 DEFAULT_CONTAINER = 'pithos'
 SETTINGS_DIR = expanduser('~/.pithos')
 TRASH_DIR = '.pithos_trash'
+BLOCK_SIZE = 4194304
+BLOCK_HASH = 'sha256'
+HASH_WORKERS = 4
 
 SQL_CREATE_FILES_TABLE = '''CREATE TABLE IF NOT EXISTS files (
                                 path TEXT PRIMARY KEY,
                                 hash TEXT,
                                 timestamp INTEGER)'''
 
+# The hashes of local files, valid while their size, mtime and inode match.
+SQL_CREATE_LOCAL_TABLE = '''CREATE TABLE IF NOT EXISTS local (
+                                path TEXT PRIMARY KEY,
+                                size INTEGER,
+                                mtime REAL,
+                                inode INTEGER,
+                                hash TEXT,
+                                hashes TEXT)'''
+
 
 client = Pithos_Client(get_url(), get_auth(), get_user())
 
@@ -55,12 +68,14 @@ class State(object):
         self.container = container
         self.trashdir = join(syncdir, TRASH_DIR)
         self.deleted_dirs = set()
+        self.remote = None
 
         _makedirs(self.trashdir)
 
         dbpath = join(SETTINGS_DIR, 'sync.db')
         self.conn = sqlite3.connect(dbpath)
         self.conn.execute(SQL_CREATE_FILES_TABLE)
+        self.conn.execute(SQL_CREATE_LOCAL_TABLE)
         self.conn.commit()
 
     def current_hash(self, path):
@@ -73,7 +88,7 @@ class State(object):
             return 'DEL'
         if isdir(fullpath):
             return 'DIR'
-        return merkle(fullpath)
+        return self.file_hash(fullpath)[0]
 
     def delete_inactive(self, timestamp):
         sql = 'DELETE FROM files WHERE timestamp != ?'
@@ -104,17 +119,57 @@ class State(object):
             path = join(self.trashdir, filename)
             os.remove(path)
 
+    def file_hash(self, fullpath):
+        """Return the top hash and the hashmap of a local file.
+
+        The file is hashed again only if its size, mtime or inode changed
+        since it was last hashed.
+        """
+
+        st = os.stat(fullpath)
+        sql = ('SELECT size, mtime, inode, hash, hashes FROM local '
+               'WHERE path = ?')
+        ret = self.conn.execute(sql, (fullpath,)).fetchone()
+        hashmap = HashMap(BLOCK_SIZE, BLOCK_HASH)
+        if ret and tuple(ret[:3]) == (st.st_size, st.st_mtime, st.st_ino):
+            hashmap.extend(unhexlify(h) for h in ret[4].split(',') if h)
+            return ret[3], hashmap
+
+        hashmap.load_parallel(fullpath, HASH_WORKERS)
+        hash = hexlify(hashmap.hash())
+        # A file changed within the mtime resolution could change again
+        # without its mtime changing, so it is not indexed yet.
+        if time() - st.st_mtime > 1:
+            sql = ('INSERT OR REPLACE INTO local '
+                   '(path, size, mtime, inode, hash, hashes) '
+                   'VALUES (?, ?, ?, ?, ?, ?)')
+            hashes = ','.join(hexlify(h) for h in hashmap)
+            self.conn.execute(sql, (fullpath, st.st_size, st.st_mtime,
+                                    st.st_ino, hash, hashes))
+            self.conn.commit()
+        return hash, hashmap
+
     def find_hash(self, hash):
         sql = 'SELECT path FROM files WHERE hash = ?'
         ret = self.conn.execute(sql, (hash,)).fetchone()
         if ret:
             return join(self.syncdir, ret[0])
 
-        if hash in os.listdir(self.trashdir):
-            return join(self.trashdir, hash)
+        trashpath = join(self.trashdir, hash)
+        if exists(trashpath):
+            return trashpath
 
         return None
 
+    def prune_index(self):
+        """Forget the hashes of the files that no longer exist."""
+
+        sql = 'SELECT path FROM local'
+        gone = [(path,) for (path,) in self.conn.execute(sql)
+                if not isfile(path)]
+        self.conn.executemany('DELETE FROM local WHERE path = ?', gone)
+        self.conn.commit()
+
     def previous_hash(self, path):
         """Return the hash of the file according to the previous sync with
            the server. Return DEL if not such entry exists."""
@@ -124,6 +179,14 @@ class State(object):
         return ret[0] if ret else 'DEL'
 
     def remote_hash(self, path):
+        """Return the hash of the file according to the server, as listed
+           while walking the container if it was listed."""
+
+        if self.remote is not None:
+            return self.remote.get(path, 'DEL')
+        return self.retrieve_remote_hash(path)
+
+    def retrieve_remote_hash(self, path):
         """Return the hash of the file according to the server"""
 
         try:
@@ -200,7 +263,7 @@ class State(object):
             return
 
         if isfile(fullpath):
-            hash = merkle(fullpath)
+            hash = self.file_hash(fullpath)[0]
             trashpath = join(self.trashdir, hash)
             os.rename(fullpath, trashpath)
         else:
@@ -217,10 +280,13 @@ class State(object):
             if prefix:
                 prefix += '/'
             print 'Uploading %s...' % path
-            upload(client, fullpath, self.container, prefix, name)
+            upload(client, fullpath, self.container, prefix, name,
+                   hashes=self.file_hash(fullpath)[1])
 
-        remote = self.remote_hash(path)
+        remote = self.retrieve_remote_hash(path)
         assert remote == hash, "Uploaded file does not match hash"
+        if self.remote is not None:
+            self.remote[path] = remote
         self.save(path, hash)
 
 
@@ -245,9 +311,10 @@ def sync(path, state):
             state.resolve_conflict(path, remote)
 
 
-def walk(dir, container):
+def walk(dir, container, remote=None):
     """Iterates on the files of the hierarchy created by merging the files
-       in `dir` and the objects in `container`."""
+       in `dir` and the objects in `container`. If `remote` is given, the
+       hashes of the listed objects are stored in it, keyed by path."""
 
     pending = ['']
 
@@ -276,8 +343,12 @@ def walk(dir, container):
             name = object['name']
             if object['content_type'].split(';', 1)[0].strip() == 'application/directory':
                 dirs.add(name)
+                hash = 'DIR'
             else:
                 files.add(name)
+                hash = object['x_object_hash']
+            if remote is not None:
+                remote[name] = hash
 
         pending += sorted(dirs)
         for path in files:
@@ -297,8 +368,10 @@ def main():
 
     state = State(syncdir, container)
 
+    state.remote = {}
+
     now = int(time())
-    for path in walk(syncdir, container):
+    for path in walk(syncdir, container, state.remote):
         print 'Syncing', path
         sync(path, state)
         state.touch(path, now)
@@ -306,6 +379,7 @@ def main():
     state.delete_inactive(now)
     state.empty_trash()
     state.remove_deleted_dirs()
+    state.prune_index()
 
 
 if __name__ == '__main__':
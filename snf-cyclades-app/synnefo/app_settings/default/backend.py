@@ -37,10 +37,31 @@ GANETI_USE_HOTPLUG = True
 # not already locked. This might result in slightly unbalanced clusters.
 GANETI_USE_OPPORTUNISTIC_LOCKING = True
 
+# Timeout, in seconds, of the requests to the Ganeti RAPI. Connections to each
+# cluster are kept alive and reused by the pooled RAPI clients.
+GANETI_RAPI_TIMEOUT = 60
+
+# Number of times to retry a RAPI GET request that failed to connect or timed
+# out, and the seconds to wait before the first retry, doubled for each
+# following one. Requests that submit jobs to Ganeti are never retried.
+GANETI_RAPI_RETRIES = 2
+GANETI_RAPI_BACKOFF = 0.5
+
 # This module implements the strategy for allocating a vm to a backend
 BACKEND_ALLOCATOR_MODULE = "synnefo.logic.allocators.default_allocator"
+# Placement policy of the "synnefo.logic.allocators.binpack_allocator" module.
+# 'best_fit' fills the backends one after the other, while 'spread' balances
+# the load between them.
+BACKEND_ALLOCATOR_POLICY = "spread"
 # Refresh backend statistics timeout, in minutes, used in backend allocation
 BACKEND_REFRESH_MIN = 15
+# Whether allocation refreshes the statistics of the backends that are older
+# than BACKEND_REFRESH_MIN. Set it to False if the statistics are kept fresh
+# by running 'snf-manage backend-poll-stats'.
+BACKEND_REFRESH_ON_ALLOCATION = True
+# Number of times to retry the allocation of a vm, when the stats of the chosen
+# backend change concurrently, before locking the backend
+BACKEND_ALLOCATION_RETRIES = 3
 
 # Maximum number of NICs per Ganeti instance. This value must be less or equal
 # than 'max:nic-count' option of Ganeti's ipolicy.
@@ -0,0 +1,162 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bin-packing allocation strategy.
+
+Each backend is a bin with a capacity of memory, disk and virtual CPUs. The
+virtual CPUs of a backend are its physical CPUs times CPU_RATIO, and the
+used ones are the CPUs of the flavors of its vms.
+
+The placement policy is selected with the BACKEND_ALLOCATOR_POLICY setting:
+ * 'best_fit' places a vm in the backend with the least free resources left
+   after hosting it, keeping the other backends free for larger vms.
+ * 'spread' places a vm in the backend with the most free resources left
+   after hosting it, balancing the load between the backends.
+
+The scores of all backends are computed at once, from per resource columns
+of their free and total capacity, and allocate_many places a batch of vms
+in one call.
+"""
+
+from __future__ import division
+import logging
+
+from django.conf import settings
+from django.db.models import Sum
+
+
+log = logging.getLogger(__name__)
+
+POLICIES = ("best_fit", "spread")
+RESOURCES = ("ram", "disk", "cpu")
+# Maximum ratio of virtual to physical CPUs of a backend
+CPU_RATIO = 3
+
+
+def get_used_vcpus(backends):
+    """Return the virtual CPUs of the vms of each backend, by backend id."""
+
+    from synnefo.db.models import VirtualMachine
+    vms = VirtualMachine.objects.filter(deleted=False,
+                                        backend__in=[b.id for b in backends])
+    vcpus = vms.order_by().values_list("backend")\
+               .annotate(Sum("flavor__cpu"))
+    return dict(vcpus)
+
+
+class Bins(object):
+    """The free and total capacity of some bins, as per resource columns."""
+
+    def __init__(self, free, total):
+        self.free = free
+        self.total = total
+        self.size = len(free[0]) if free else 0
+
+    @classmethod
+    def from_backends(cls, backends, used_vcpus):
+        free = [[b.mfree for b in backends],
+                [b.dfree for b in backends],
+                [b.ctotal * CPU_RATIO - used_vcpus.get(b.id, 0)
+                 for b in backends]]
+        total = [[b.mtotal for b in backends],
+                 [b.dtotal for b in backends],
+                 [b.ctotal * CPU_RATIO for b in backends]]
+        return cls(free, total)
+
+    def scores(self, demand):
+        """Return the score of each bin for a vm, None if it does not fit.
+
+        The score is the sum of the ratios of each resource that remain free
+        after placing the vm in the bin.
+
+        """
+        scores = [0] * self.size
+        for free, total, d in zip(self.free, self.total, demand):
+            for i, (f, t) in enumerate(zip(free, total)):
+                if scores[i] is None:
+                    continue
+                if f < d:
+                    scores[i] = None
+                elif t:
+                    scores[i] += (f - d) / t
+        return scores
+
+    def place(self, index, demand):
+        for free, d in zip(self.free, demand):
+            free[index] -= d
+
+
+def choose(scores, policy):
+    """Return the index of the best score for the policy, or None."""
+
+    candidates = [(s, i) for i, s in enumerate(scores) if s is not None]
+    if not candidates:
+        return None
+    if policy == "best_fit":
+        return min(candidates)[1]
+    elif policy == "spread":
+        return max(candidates)[1]
+    raise ValueError("Unknown allocation policy '%s'" % policy)
+
+
+def pack(bins, demands, policy):
+    """Place vms in bins, returning the index of the bin of each vm.
+
+    The vms are placed in order of decreasing size, which packs tighter than
+    placing them in the given order. Vms that do not fit anywhere get None.
+
+    """
+    placements = [None] * len(demands)
+    order = sorted(range(len(demands)), key=lambda i: demands[i],
+                   reverse=True)
+    for i in order:
+        index = choose(bins.scores(demands[i]), policy)
+        if index is not None:
+            bins.place(index, demands[i])
+        placements[i] = index
+    return placements
+
+
+def vm_demand(vm):
+    return tuple(vm[r] for r in RESOURCES)
+
+
+def allocate_many(backends, vms, policy=None, used_vcpus=None):
+    """Allocate a batch of vms, returning the backend of each vm.
+
+    Vms that do not fit in any backend get None.
+
+    """
+    if policy is None:
+        policy = settings.BACKEND_ALLOCATOR_POLICY
+    if used_vcpus is None:
+        used_vcpus = get_used_vcpus(backends)
+    bins = Bins.from_backends(backends, used_vcpus)
+    placements = pack(bins, [vm_demand(vm) for vm in vms], policy)
+    log.debug("Placed VMs %s in backends %s", vms, placements)
+    return [backends[i] if i is not None else None for i in placements]
+
+
+def allocate(backends, vm):
+    if len(backends) == 1:
+        return backends[0]
+
+    backend = allocate_many(backends, [vm])[0]
+    if backend is None:
+        # Since we are conservatively updating backend resources on each
+        # allocation, a backend may actually be able to host a vm (despite
+        # the state of the backend in db)
+        backend = max(backends, key=lambda b: (b.mfree, b.dfree))
+    return backend
@@ -0,0 +1,151 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Offline simulation of the backend allocation strategies.
+
+Replays a log of vm creations and deletions on simulated backends, which
+start empty, and reports how well each strategy packs the vms and how long
+it takes to allocate them.
+"""
+
+from __future__ import division
+import csv
+import time
+from collections import namedtuple
+
+from synnefo.logic.allocators import default_allocator, binpack_allocator
+
+Event = namedtuple("Event", ["time", "action", "vm", "ram", "disk", "cpu"])
+
+
+class SimBackend(object):
+    """A backend with the attributes that the allocation strategies use."""
+
+    def __init__(self, id, clustername, mtotal, dtotal, ctotal):
+        self.id = id
+        self.clustername = clustername
+        self.mtotal = self.mfree = mtotal
+        self.dtotal = self.dfree = dtotal
+        self.ctotal = ctotal
+        self.pinst_cnt = 0
+        self.vcpus = 0
+
+    def __repr__(self):
+        return "<SimBackend %s>" % self.clustername
+
+    def fits(self, vm):
+        return (self.mfree >= vm["ram"] and self.dfree >= vm["disk"] and
+                self.vcpus + vm["cpu"] <= self.ctotal *
+                binpack_allocator.CPU_RATIO)
+
+    def add(self, vm):
+        self.mfree -= vm["ram"]
+        self.dfree -= vm["disk"]
+        self.vcpus += vm["cpu"]
+        self.pinst_cnt += 1
+
+    def remove(self, vm):
+        self.mfree += vm["ram"]
+        self.dfree += vm["disk"]
+        self.vcpus -= vm["cpu"]
+        self.pinst_cnt -= 1
+
+
+def binpack_strategy(policy):
+    def allocate(backends, vm):
+        used_vcpus = dict((b.id, b.vcpus) for b in backends)
+        return binpack_allocator.allocate_many(backends, [vm], policy=policy,
+                                               used_vcpus=used_vcpus)[0]
+    return allocate
+
+
+STRATEGIES = [("default", default_allocator.allocate)] + \
+    [(policy, binpack_strategy(policy))
+     for policy in binpack_allocator.POLICIES]
+
+
+def read_log(f):
+    """Read events from a CSV file.
+
+    Each line has the time, the action ('create' or 'delete'), the id of the
+    vm and, for creations, its ram and disk in MB and its number of CPUs.
+
+    """
+    events = []
+    for row in csv.reader(f):
+        if not row or row[0].startswith("#"):
+            continue
+        sizes = [int(x) for x in row[3:6]] or [0, 0, 0]
+        events.append(Event(float(row[0]), row[1], row[2], *sizes))
+    events.sort(key=lambda e: e.time)
+    return events
+
+
+def replay(allocate, backends, events):
+    """Replay the events, allocating the vms with the given strategy.
+
+    A creation fails when the strategy returns no backend or a backend that
+    cannot host the vm. Return a dictionary with the results.
+
+    """
+    placements = {}
+    created = failed = peak = 0
+    utilization = 0.0
+    latencies = []
+    for event in events:
+        if event.action == "delete":
+            entry = placements.pop(event.vm, None)
+            if entry is not None:
+                entry[0].remove(entry[1])
+            continue
+
+        vm = {"ram": event.ram, "disk": event.disk, "cpu": event.cpu}
+        start = time.time()
+        backend = allocate(backends, vm)
+        latencies.append(time.time() - start)
+        if backend is None or not backend.fits(vm):
+            failed += 1
+            continue
+        backend.add(vm)
+        placements[event.vm] = (backend, vm)
+        created += 1
+
+        # Memory utilization of the backends in use after each creation
+        used = [b for b in backends if b.pinst_cnt]
+        peak = max(peak, len(used))
+        utilization += sum(1 - b.mfree / b.mtotal for b in used
+                           if b.mtotal) / len(used)
+
+    return {"created": created,
+            "failed": failed,
+            "peak_backends": peak,
+            "utilization": utilization / created if created else 0,
+            "mean_latency": sum(latencies) / len(latencies)
+            if latencies else 0,
+            "max_latency": max(latencies) if latencies else 0}
+
+
+def simulate(backends, events, strategies=STRATEGIES):
+    """Replay the events with each strategy, on copies of the backends.
+
+    Return a list of (strategy name, results) pairs.
+
+    """
+    results = []
+    for name, allocate in strategies:
+        copies = [SimBackend(b.id, b.clustername, b.mtotal, b.dtotal,
+                             b.ctotal) for b in backends]
+        results.append((name, replay(allocate, copies, events)))
+    return results
@@ -16,11 +16,12 @@ from django.conf import settings
 from django.db import transaction
 from django.utils import simplejson as json
 from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 
 from synnefo.db.models import (VirtualMachine, Network, Volume,
                                BackendNetwork, BACKEND_STATUSES,
                                pooled_rapi_client, VirtualMachineDiagnostic,
-                               Flavor, IPAddress, IPAddressLog)
+                               Flavor, IPAddress, IPAddressLog, Backend)
 from synnefo.logic import utils, ips
 from synnefo import quotas
 from synnefo.api.util import release_resource
@@ -42,6 +43,9 @@ SIMPLE_NIC_FIELDS = ["state", "mac", "network", "firewall_profile", "index"]
 COMPLEX_NIC_FIELDS = ["ipv4_address", "ipv6_address"]
 NIC_FIELDS = SIMPLE_NIC_FIELDS + COMPLEX_NIC_FIELDS
 DISK_FIELDS = ["status", "size", "index"]
+NODE_RESOURCES = ["mfree", "mtotal", "dfree", "dtotal", "pinst_cnt", "ctotal"]
+NODE_FIELDS = ["name", "group", "vm_capable", "drained", "offline",
+               "cnodes"] + NODE_RESOURCES
 UNKNOWN_NIC_PREFIX = "unknown-nic-"
 UNKNOWN_DISK_PREFIX = "unknown-disk-"
 
@@ -1265,20 +1269,72 @@ def get_physical_resources(backend):
 
     """
     nodes = get_nodes(backend, bulk=True)
-    attr = ['mfree', 'mtotal', 'dfree', 'dtotal', 'pinst_cnt', 'ctotal']
+    return sum_node_resources(nodes)
+
+
+def sum_node_resources(nodes):
+    """ Sum the resources of the nodes that can host vms. """
+
     res = {}
-    for a in attr:
+    for a in NODE_RESOURCES:
         res[a] = 0
     for n in nodes:
         # Filter out drained, offline and not vm_capable nodes since they will
         # not take part in the vm allocation process
         can_host_vms = n['vm_capable'] and not (n['drained'] or n['offline'])
         if can_host_vms and n['cnodes']:
-            for a in attr:
+            for a in NODE_RESOURCES:
                 res[a] += int(n[a] or 0)
     return res
 
 
+def get_node_stats(backend):
+    """ Get the stats of the nodes of a backend.
+
+    Unlike get_nodes, only the fields needed to compute the resources of the
+    backend are queried. Fields that are not available, e.g. for an offline
+    node, are None.
+
+    """
+    with pooled_rapi_client(backend) as c:
+        result = c.Query("node", NODE_FIELDS)
+    # Each field is a (status, value) pair, with status 0 for normal values
+    return [dict((f, v if status == 0 else None)
+                 for f, (status, v) in zip(NODE_FIELDS, row))
+            for row in result["data"]]
+
+
+def poll_backends_resources(backends, workers=None):
+    """ Update the resources of the backends, querying them in parallel.
+
+    Return a list of (backend, nodes, error) tuples, with the node stats of
+    each backend or the error that occurred while querying it.
+
+    """
+
+    def query(backend):
+        try:
+            return backend, get_node_stats(backend), None
+        except Exception as e:
+            log.error("Failed to get node stats of backend %s: %s", backend, e)
+            return backend, None, e
+
+    if not backends:
+        return []
+    pool = ThreadPool(workers or len(backends))
+    try:
+        results = pool.map(query, backends)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Update the db from the calling thread only
+    for backend, nodes, error in results:
+        if error is None:
+            update_backend_resources(backend, sum_node_resources(nodes))
+    return results
+
+
 def update_backend_resources(backend, resources=None):
     """ Update the state of the backend resources in db.
 
@@ -1287,14 +1343,18 @@ def update_backend_resources(backend, resources=None):
     if not resources:
         resources = get_physical_resources(backend)
 
-    backend.mfree = resources['mfree']
-    backend.mtotal = resources['mtotal']
-    backend.dfree = resources['dfree']
-    backend.dtotal = resources['dtotal']
-    backend.pinst_cnt = resources['pinst_cnt']
-    backend.ctotal = resources['ctotal']
-    backend.updated = datetime.now()
-    backend.save()
+    # Update only the resources, since the backend may be concurrently
+    # updated, e.g. drained or allocated a vm.
+    fields = {'mfree': resources['mfree'],
+              'mtotal': resources['mtotal'],
+              'dfree': resources['dfree'],
+              'dtotal': resources['dtotal'],
+              'pinst_cnt': resources['pinst_cnt'],
+              'ctotal': resources['ctotal'],
+              'updated': datetime.now()}
+    Backend.objects.filter(id=backend.id).update(**fields)
+    for field, value in fields.items():
+        setattr(backend, field, value)
 
 
 def get_memory_from_instances(backend):
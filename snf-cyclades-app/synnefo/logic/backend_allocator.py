@@ -15,9 +15,11 @@
 
 import logging
 import datetime
+import threading
 from django.utils import importlib
 
 from django.conf import settings
+from django.db import close_connection
 from synnefo.db.models import Backend
 from synnefo.logic import backend as backend_mod
 
@@ -35,9 +37,14 @@ class BackendAllocator():
     def allocate(self, userid, flavor):
         """Allocate a vm of the specified flavor to a backend.
 
+        The backends are scored from their stats as read from the db, without
+        locking them. The resources of the vm are then reserved in the chosen
+        backend, only if its stats have not changed in the meantime. If they
+        have, the backend is read again and the allocation is retried. After
+        BACKEND_ALLOCATION_RETRIES conflicts, the chosen backend is locked.
+
         Warning!!: An explicit commit is required after calling this function,
-        in order to release the locks acquired by the get_available_backends
-        function.
+        in order to release the lock of the updated backend.
 
         """
 
@@ -57,20 +64,41 @@ class BackendAllocator():
         # Get available backends
         available_backends = get_available_backends(flavor)
 
-        if not available_backends:
-            return None
-
-        # Find the best backend to host the vm, based on the allocation
-        # strategy
-        backend = self.strategy_mod.allocate(available_backends, vm)
-
-        log.info("Allocated VM %r, in backend %s", vm, backend)
+        retries = settings.BACKEND_ALLOCATION_RETRIES
+        while available_backends:
+            # Find the best backend to host the vm, based on the allocation
+            # strategy
+            backend = self.strategy_mod.allocate(available_backends, vm)
+
+            if retries <= 0:
+                try:
+                    backend = Backend.objects.select_for_update()\
+                                             .get(id=backend.id,
+                                                  offline=False,
+                                                  drained=False)
+                except Backend.DoesNotExist:
+                    available_backends = [b for b in available_backends
+                                          if b.id != backend.id]
+                    continue
+
+            # Reduce the free resources of the selected backend by the size
+            # of the vm
+            if reduce_backend_resources(backend, vm):
+                log.info("Allocated VM %r, in backend %s", vm, backend)
+                return backend
+
+            log.debug("Stats of backend %s changed while allocating VM %r",
+                      backend, vm)
+            retries -= 1
+            others = [b for b in available_backends if b.id != backend.id]
+            try:
+                backend = Backend.objects.get(id=backend.id, offline=False,
+                                              drained=False)
+                available_backends = others + [backend]
+            except Backend.DoesNotExist:
+                available_backends = others
 
-        # Reduce the free resources of the selected backend by the size of
-        # the vm
-        reduce_backend_resources(backend, vm)
-
-        return backend
+        return None
 
 
 def get_available_backends(flavor):
@@ -90,8 +118,7 @@ def get_available_backends(flavor):
     if disk_template.startswith("ext_"):
         disk_template = "ext"
 
-    backends = Backend.objects.select_for_update().filter(offline=False,
-                                                          drained=False)
+    backends = Backend.objects.filter(offline=False, drained=False)
     # Update the disk_templates if there are empty.
     [backend_mod.update_backend_disk_templates(b)
      for b in backends if not b.disk_templates]
@@ -99,7 +126,8 @@ def get_available_backends(flavor):
                       list(backends))
 
     # Update the backend stats if it is needed
-    refresh_backends_stats(backends)
+    if settings.BACKEND_REFRESH_ON_ALLOCATION:
+        refresh_backends_stats(backends)
 
     return backends
 
@@ -120,22 +148,41 @@ def reduce_backend_resources(backend, vm):
     Reduce the free resources of the backend by the size of the of the vm that
     will host. This is an underestimation of the backend capabilities.
 
+    The backend is updated in db only if its resources are still the ones of
+    the given backend object. Return whether the backend was updated.
+
     """
 
-    new_mfree = backend.mfree - vm['ram']
-    new_dfree = backend.dfree - vm['disk']
-    backend.mfree = 0 if new_mfree < 0 else new_mfree
-    backend.dfree = 0 if new_dfree < 0 else new_dfree
-    backend.pinst_cnt += 1
+    new_mfree = max(backend.mfree - vm['ram'], 0)
+    new_dfree = max(backend.dfree - vm['disk'], 0)
+    new_pinst_cnt = backend.pinst_cnt + 1
 
-    backend.save()
+    updated = Backend.objects.filter(id=backend.id,
+                                     mfree=backend.mfree,
+                                     dfree=backend.dfree,
+                                     pinst_cnt=backend.pinst_cnt)\
+                             .update(mfree=new_mfree, dfree=new_dfree,
+                                     pinst_cnt=new_pinst_cnt)
+    if not updated:
+        return False
+
+    backend.mfree = new_mfree
+    backend.dfree = new_dfree
+    backend.pinst_cnt = new_pinst_cnt
+    return True
+
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
 
 
 def refresh_backends_stats(backends):
     """ Refresh the statistics of the backends.
 
     Set db backend state to the actual state of the backend, if
-    BACKEND_REFRESH_MIN time has passed.
+    BACKEND_REFRESH_MIN time has passed. The backends are queried in
+    background threads, one per backend of the process, so that the
+    allocation does not wait for them.
 
     """
 
@@ -143,9 +190,27 @@ def refresh_backends_stats(backends):
     delta = datetime.timedelta(minutes=settings.BACKEND_REFRESH_MIN)
     for b in backends:
         if now > b.updated + delta:
+            with _refreshing_lock:
+                if b.id in _refreshing:
+                    continue
+                _refreshing.add(b.id)
             log.debug("Updating resources of backend %r. Last Updated %r",
                       b, b.updated)
-            backend_mod.update_backend_resources(b)
+            t = threading.Thread(target=refresh_backend_stats, args=(b.id,))
+            t.daemon = True
+            t.start()
+
+
+def refresh_backend_stats(backend_id):
+    try:
+        backend = Backend.objects.get(id=backend_id)
+        backend_mod.update_backend_resources(backend)
+    except Exception:
+        log.exception("Failed to update resources of backend %s", backend_id)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(backend_id)
+        close_connection()
 
 
 def get_backend_for_user(userid):
@@ -52,6 +52,7 @@ import setproctitle
 from synnefo.lib.amqp import AMQPClient
 from synnefo.logic import callbacks
 from synnefo.logic import queues
+from synnefo.logic.dispatcher_workers import WorkerPool
 from synnefo.db.models import Backend, pooled_rapi_client
 
 import logging
@@ -67,6 +68,12 @@ LOGGERS = [log, log_amqp, log_logic]
 # Seconds for which snf-dispatcher will wait on a queue with no messages.
 # After this timeout the snf-dispatcher will reconnect to the AMQP broker.
 DISPATCHER_RECONNECT_TIMEOUT = 600
+# Seconds between two deliveries of the acknowledgments of the workers.
+ACK_INTERVAL = 0.1
+# Messages that each worker may have outstanding per queue.
+PREFETCH_PER_WORKER = 5
+# Seconds to wait for the workers to process their queued messages on exit.
+WORKERS_STOP_TIMEOUT = 30
 
 
 # Time out after S Seconds while waiting messages from Ganeti clusters to
@@ -92,25 +99,32 @@ class Dispatcher:
 
     def __init__(self, debug=False):
         self.debug = debug
+        self.workers = WorkerPool(settings.DISPATCHER_WORKERS)
         self._init()
 
     def wait(self):
         log.info("Waiting for messages..")
+        self.workers.start()
         timeout = DISPATCHER_RECONNECT_TIMEOUT
+        last_msg = last_stats = time.time()
         while True:
             try:
-                # Close the Django DB connection before processing
-                # every incoming message. This plays nicely with
-                # DB connection pooling, if enabled and allows
-                # the dispatcher to recover from broken connections
-                # gracefully.
-                close_connection()
-                msg = self.client.basic_wait(timeout=timeout)
-                if not msg:
+                # Messages are processed by the workers, so wait only for
+                # short periods, in order to send their acknowledgments.
+                self.workers.send_acks(self.client, self._connection())
+                msg = self.client.basic_wait(timeout=ACK_INTERVAL)
+                now = time.time()
+                if msg:
+                    last_msg = now
+                elif now - last_msg > timeout:
                     log.warning("Idle connection for %d seconds. Will connect"
                                 " to a different host. Verify that"
                                 " snf-ganeti-eventd is running!!", timeout)
                     self.client.reconnect(timeout=1)
+                    last_msg = now
+                if now - last_stats > settings.DISPATCHER_STATS_INTERVAL:
+                    self.log_stats()
+                    last_stats = now
             except select.error as e:
                 if e[0] != errno.EINTR:
                     log.exception("Caught unexpected exception: %s", e)
@@ -123,8 +137,30 @@ class Dispatcher:
 
         log.info("Clean up AMQP connection before exit")
         self.client.basic_cancel(timeout=1)
+        self.workers.stop(timeout=WORKERS_STOP_TIMEOUT)
+        self.workers.send_acks(self.client, self._connection())
         self.client.close(timeout=1)
 
+    def _connection(self):
+        # The underlying connection of the AMQP client, which is replaced
+        # each time the client reconnects.
+        return getattr(self.client, "client", None)
+
+    def _dispatch(self, callback):
+        def dispatch(client, message):
+            self.workers.put(callback, message, self._connection())
+        return dispatch
+
+    def log_stats(self):
+        stats = self.workers.stats.report()
+        count, lag, max_lag = stats["lag"]
+        log.info("Processed %d messages in %d seconds. Backlog: %d messages,"
+                 " lag: %.3f s (max %.3f s)", count, stats["period"],
+                 self.workers.backlog, lag, max_lag)
+        for name, (count, avg, maximum) in sorted(stats["callbacks"].items()):
+            log.info("Callback '%s': %d messages, %.3f s (max %.3f s)",
+                     name, count, avg, maximum)
+
     def _init(self):
         log.info("Initializing")
 
@@ -162,9 +198,10 @@ class Dispatcher:
             self.client.queue_bind(queue=queue, exchange=exchange,
                                    routing_key=routing_key)
 
+            prefetch_count = PREFETCH_PER_WORKER * self.workers.size
             self.client.basic_consume(queue=binding[0],
-                                      callback=callback,
-                                      prefetch_count=5)
+                                      callback=self._dispatch(callback),
+                                      prefetch_count=prefetch_count)
 
             queue_dl = queues.convert_queue_to_dead(queue)
             exchange_dl = queues.convert_exchange_to_dead(exchange)
@@ -194,6 +231,9 @@ def handle_request(client, msg):
     """
 
     client.basic_ack(msg)
+    # The workers close their DB connections when idle, while the dispatcher
+    # thread uses the DB only for requests.
+    close_connection()
     log.debug("Received request message: %s", msg)
     body = json.loads(msg["body"])
     reply_to = None
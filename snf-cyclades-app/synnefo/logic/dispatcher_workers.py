@@ -0,0 +1,220 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Concurrent processing of the messages consumed by snf-dispatcher.
+
+Messages are processed by a fixed number of worker threads. Each message is
+assigned to a worker by the object it is about, e.g. the Ganeti instance, so
+the messages of an object are processed in the order they were received,
+while messages of different objects are processed concurrently.
+
+The AMQP client is not thread-safe, so the workers do not use it. Their
+acknowledgments are queued, for the dispatcher thread to send them.
+
+"""
+
+import json
+import logging
+import threading
+import time
+import Queue
+
+from django.db import close_connection
+
+log = logging.getLogger(__name__)
+
+# Message fields that identify the object a message is about
+KEY_FIELDS = ("instance", "network", "cluster")
+
+
+def message_body(message):
+    try:
+        body = json.loads(message["body"])
+    except (ValueError, KeyError, TypeError):
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+def message_key(body):
+    """Return the object a message is about, or None."""
+    for field in KEY_FIELDS:
+        if body.get(field):
+            return body[field]
+    return None
+
+
+def message_time(body):
+    """Return the time of the event of a message in seconds, or None."""
+    try:
+        seconds, microseconds = body["event_time"]
+        return seconds + microseconds / 1000000.0
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class WorkerClient(object):
+    """Stand-in for the AMQP client, for the callbacks run by the workers."""
+
+    def __init__(self, acks, connection):
+        self._acks = acks
+        self._connection = connection
+
+    def _put(self, method, message, **kwargs):
+        self._acks.put((self._connection, method, message, kwargs))
+
+    def basic_ack(self, message):
+        self._put("basic_ack", message)
+
+    def basic_nack(self, message):
+        self._put("basic_nack", message)
+
+    def basic_reject(self, message, requeue=False):
+        self._put("basic_reject", message, requeue=requeue)
+
+
+class DispatcherStats(object):
+    """Count, total and maximum of the processing time of each callback and
+    of the lag of the messages, i.e. the time from their event in Ganeti
+    until they are processed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._lag = [0, 0.0, 0.0]
+        self._callbacks = {}
+        self._since = time.time()
+
+    @staticmethod
+    def _add(entry, value):
+        entry[0] += 1
+        entry[1] += value
+        entry[2] = max(entry[2], value)
+
+    def add(self, callback, elapsed, lag):
+        with self._lock:
+            self._add(self._lag, lag)
+            self._add(self._callbacks.setdefault(callback, [0, 0.0, 0.0]),
+                      elapsed)
+
+    def report(self):
+        """Return the statistics since the previous report and reset them.
+
+        Each of 'lag' and the entries of 'callbacks' is a (count, average,
+        maximum) tuple.
+
+        """
+        def summary(entry):
+            count, total, maximum = entry
+            return (count, total / count if count else 0.0, maximum)
+
+        with self._lock:
+            report = {"period": time.time() - self._since,
+                      "lag": summary(self._lag),
+                      "callbacks": dict((name, summary(entry)) for name, entry
+                                        in self._callbacks.items())}
+            self._reset()
+        return report
+
+
+class WorkerPool(object):
+    """Process messages in worker threads, in order per object."""
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("At least one worker is needed")
+        self.size = size
+        self.acks = Queue.Queue()
+        self.stats = DispatcherStats()
+        self._queues = [Queue.Queue() for i in range(size)]
+        self._threads = []
+
+    @property
+    def backlog(self):
+        """Number of messages waiting to be processed."""
+        return sum(q.qsize() for q in self._queues)
+
+    def start(self):
+        for index, queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._work, args=(queue,),
+                                      name="dispatcher-worker-%d" % index)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stop the workers, after processing the queued messages."""
+        for queue in self._queues:
+            queue.put(None)
+        deadline = time.time() + timeout if timeout is not None else None
+        for thread in self._threads:
+            if deadline is None:
+                thread.join()
+            else:
+                thread.join(max(deadline - time.time(), 0))
+        self._threads = []
+
+    def put(self, callback, message, connection=None):
+        """Queue a message, to be processed by the callback.
+
+        The connection identifies the AMQP connection the message was
+        received from, and is returned with the acknowledgment of the message.
+
+        """
+        body = message_body(message)
+        index = hash(message_key(body)) % self.size
+        received = time.time()
+        event_time = message_time(body) or received
+        self._queues[index].put((callback, message, connection, event_time))
+
+    def send_acks(self, client, connection=None):
+        """Send the queued acknowledgments through the AMQP client.
+
+        Acknowledgments of messages received from a previous connection are
+        dropped, since the broker delivers these messages again.
+
+        """
+        while True:
+            try:
+                conn, method, message, kwargs = self.acks.get_nowait()
+            except Queue.Empty:
+                return
+            if conn is not connection:
+                log.debug("Dropping %s of message from closed connection",
+                          method)
+                continue
+            getattr(client, method)(message, **kwargs)
+
+    def _work(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                close_connection()
+                break
+            callback, message, connection, event_time = item
+            start = time.time()
+            try:
+                callback(WorkerClient(self.acks, connection), message)
+            except Exception:
+                log.exception("Unexpected error while processing message %s",
+                              message)
+            name = getattr(callback, "__name__", repr(callback))
+            self.stats.add(name, time.time() - start, start - event_time)
+            if queue.empty():
+                # Keep the DB connection of the worker only while there are
+                # messages to process. This plays nicely with DB connection
+                # pooling and recovers from broken connections.
+                close_connection()
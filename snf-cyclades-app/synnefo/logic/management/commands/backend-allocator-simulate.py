@@ -0,0 +1,105 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from optparse import make_option
+
+from snf_django.management.commands import SynnefoCommand, CommandError
+from snf_django.management.utils import pprint_table
+from synnefo.db.models import Backend, VirtualMachine
+from synnefo.logic import backend as backend_mod
+from synnefo.logic.allocators import simulator
+from synnefo.logic.backend_allocator import flavor_disk
+
+
+HELP_MSG = """Compare the backend allocation strategies offline.
+
+Replays the creations and deletions of vms on empty backends with the
+capacity of the online backends and reports, for each allocation strategy,
+the number of vms that could not be allocated, the peak number of backends
+in use, the mean memory utilization of the backends in use and the latency
+of the allocator.
+
+By default, the history of the vms in DB is replayed. Alternatively,
+'--log' reads the events from a CSV file, with one 'time,action,vm,ram,disk,
+cpu' line per event, where action is 'create' or 'delete'.
+"""
+
+
+def db_events():
+    events = []
+    vms = VirtualMachine.objects.select_related("flavor__volume_type")
+    for vm in vms.order_by("created"):
+        events.append(simulator.Event(
+            time.mktime(vm.created.timetuple()), "create", vm.id,
+            vm.flavor.ram, flavor_disk(vm.flavor), vm.flavor.cpu))
+        if vm.deleted:
+            events.append(simulator.Event(
+                time.mktime(vm.updated.timetuple()), "delete", vm.id,
+                0, 0, 0))
+    events.sort(key=lambda e: e.time)
+    return events
+
+
+class Command(SynnefoCommand):
+    help = HELP_MSG
+
+    option_list = SynnefoCommand.option_list + (
+        make_option("--log", dest="log", default=None,
+                    help="CSV file with the events to replay"),
+        make_option("--per-node", dest="per_node", action="store_true",
+                    default=False,
+                    help="Simulate each Ganeti node as a separate backend,"
+                         " querying the capacity of the nodes"),
+    )
+
+    def handle(self, **options):
+        backends = list(Backend.objects.filter(offline=False))
+        if options["per_node"]:
+            backends = self.get_nodes(backends)
+        if not backends:
+            raise CommandError("No backends to simulate")
+
+        if options["log"]:
+            try:
+                with open(options["log"]) as f:
+                    events = simulator.read_log(f)
+            except (IOError, ValueError, TypeError) as e:
+                raise CommandError("Invalid log file: %s" % e)
+        else:
+            events = db_events()
+
+        headers = ["strategy", "created", "failed", "peak_backends",
+                   "utilization", "mean_latency(ms)", "max_latency(ms)"]
+        table = []
+        for name, res in simulator.simulate(backends, events):
+            table.append((name, res["created"], res["failed"],
+                          res["peak_backends"],
+                          "%.2f" % res["utilization"],
+                          "%.3f" % (res["mean_latency"] * 1000),
+                          "%.3f" % (res["max_latency"] * 1000)))
+        pprint_table(self.stdout, table, headers)
+
+    def get_nodes(self, backends):
+        nodes = []
+        for backend in backends:
+            for node in backend_mod.get_node_stats(backend):
+                if not node["vm_capable"] or node["offline"]:
+                    continue
+                nodes.append(simulator.SimBackend(
+                    len(nodes), "%s/%s" % (backend.clustername, node["name"]),
+                    node["mtotal"] or 0, node["dtotal"] or 0,
+                    node["ctotal"] or 0))
+        return nodes
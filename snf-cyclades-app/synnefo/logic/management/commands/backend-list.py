@@ -54,6 +54,7 @@ class Command(ListCommand):
         "disk": (get_mem, "free/total disk (GB)"),
         "hypervisor": ("hypervisor", "The hypervisor the backend is using"),
         "disk_templates": ("disk_templates", "Enabled disk-templates"),
+        "updated": ("updated", "Last update of the backend resources"),
     }
 
     fields = ["id", "clustername", "port", "username", "drained", "offline",
@@ -0,0 +1,101 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from datetime import datetime
+from optparse import make_option
+
+from django.conf import settings
+from snf_django.management.commands import SynnefoCommand, CommandError
+from snf_django.management.utils import pprint_table
+from synnefo.db.models import Backend
+from synnefo.logic import backend as backend_mod
+
+
+HELP_MSG = """Poll the Ganeti backends and update their resources in DB.
+
+The node statistics of all online backends are queried in parallel and the
+available resources (disk, memory, CPUs) of each backend are updated in DB.
+Unless '--once' is given, the backends are polled every '--interval'
+seconds, until the command is interrupted.
+
+For each backend, the command reports the age of its resources in DB, i.e.
+the time since they were last updated. When the command runs periodically,
+set BACKEND_REFRESH_ON_ALLOCATION to False, so that allocating a server
+never queries the backends.
+"""
+
+
+class Command(SynnefoCommand):
+    help = HELP_MSG
+
+    option_list = SynnefoCommand.option_list + (
+        make_option("--interval", dest="interval", type="int", default=60,
+                    help="Seconds between two polls of the backends"
+                         " (default: 60)"),
+        make_option("--once", dest="once", action="store_true",
+                    default=False, help="Poll the backends once and exit"),
+        make_option("--workers", dest="workers", type="int", default=None,
+                    help="Number of backends to query in parallel"
+                         " (default: all)"),
+        make_option("--groups", dest="groups", action="store_true",
+                    default=False,
+                    help="Also report the resources of each node group"),
+    )
+
+    def handle(self, **options):
+        interval = options["interval"]
+        if interval <= 0:
+            raise CommandError("Interval must be positive")
+
+        while True:
+            start = time.time()
+            self.poll(options["workers"], options["groups"])
+            if options["once"]:
+                return
+            time.sleep(max(interval - (time.time() - start), 0))
+
+    def poll(self, workers, groups):
+        backends = list(Backend.objects.filter(offline=False))
+        results = backend_mod.poll_backends_resources(backends,
+                                                      workers=workers)
+        now = datetime.now()
+        stale = settings.BACKEND_REFRESH_MIN * 60
+
+        headers = ["backend", "status", "age", "mfree", "dfree",
+                   "pinst_cnt"]
+        table = []
+        group_table = []
+        for backend, nodes, error in results:
+            age = int((now - backend.updated).total_seconds())
+            status = "OK" if error is None else "ERROR"
+            if age > stale:
+                status = "STALE"
+            table.append((backend.clustername, status, age, backend.mfree,
+                          backend.dfree, backend.pinst_cnt))
+            if groups and nodes:
+                for group in sorted(set(n["group"] for n in nodes)):
+                    res = backend_mod.sum_node_resources(
+                        [n for n in nodes if n["group"] == group])
+                    group_table.append(
+                        (backend.clustername, group) +
+                        tuple(res[a] for a in backend_mod.NODE_RESOURCES))
+
+        self.stdout.write("%s\n" % now.strftime("%Y-%m-%d %H:%M:%S"))
+        pprint_table(self.stdout, table, headers)
+        if groups:
+            pprint_table(self.stdout, group_table,
+                         ["backend", "group"] + backend_mod.NODE_RESOURCES)
+        self.stdout.flush()
@@ -29,6 +29,8 @@ import requests
 import logging
 import simplejson
 import time
+import threading
+from bisect import bisect_left
 
 GANETI_RAPI_PORT = 5080
 GANETI_RAPI_VERSION = 2
@@ -159,6 +161,56 @@ def _SetItemIf(container, condition, item, value):
   return condition
 
 
+class LatencyHistogram(object):
+  """Histogram of request latencies.
+
+  Counts the latencies falling in each bucket, given by its upper bound in
+  seconds. It is safe to share between the clients of a pool.
+
+  """
+  BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+  def __init__(self, buckets=BUCKETS):
+    self.buckets = tuple(sorted(buckets))
+    self._counts = [0] * (len(self.buckets) + 1)
+    self._count = 0
+    self._sum = 0.0
+    self._lock = threading.Lock()
+
+  def Observe(self, seconds):
+    """Records the latency of a request.
+
+    @type seconds: float
+    @param seconds: the latency of the request
+
+    """
+    index = bisect_left(self.buckets, seconds)
+    with self._lock:
+      self._counts[index] += 1
+      self._count += 1
+      self._sum += seconds
+
+  def GetStats(self):
+    """Returns the recorded latencies.
+
+    @rtype: dict
+    @return: the number of requests, the sum of their latencies and the
+        cumulative count of requests per bucket upper bound, the last one
+        being C{None} for requests slower than all buckets
+
+    """
+    with self._lock:
+      counts = list(self._counts)
+      stats = {"count": self._count, "sum": self._sum}
+    cumulative = 0
+    buckets = []
+    for bound, count in zip(self.buckets + (None,), counts):
+      cumulative += count
+      buckets.append((bound, cumulative))
+    stats["buckets"] = buckets
+    return stats
+
+
 class GanetiRapiClient(object): # pylint: disable=R0904
   """Ganeti RAPI client.
 
@@ -167,7 +219,8 @@ class GanetiRapiClient(object): # pylint: disable=R0904
   _json_encoder = simplejson.JSONEncoder(sort_keys=True)
 
   def __init__(self, host, port=GANETI_RAPI_PORT,
-               username=None, password=None, logger=logging):
+               username=None, password=None, logger=logging,
+               timeout=None, retries=0, retry_backoff=0.5, latency=None):
     """Initializes this class.
 
     @type host: string
@@ -179,10 +232,28 @@ class GanetiRapiClient(object): # pylint: disable=R0904
     @type password: string
     @param password: the password to connect with
     @param logger: Logging object
+    @type timeout: float
+    @param timeout: timeout of each request in seconds (default is none)
+    @type retries: int
+    @param retries: number of times to retry a GET request that failed
+        to connect or timed out
+    @type retry_backoff: float
+    @param retry_backoff: seconds to wait before the first retry, doubled
+        for each following one
+    @type latency: L{LatencyHistogram}
+    @param latency: histogram to record the latency of the requests in
 
     """
     self._logger = logger
     self._base_url = "https://%s:%s" % (host, port)
+    self._timeout = timeout
+    self._retries = retries
+    self._retry_backoff = retry_backoff
+    self._latency = latency
+
+    # The session keeps the connections to the cluster master alive, so
+    # consecutive requests do not pay for a new TCP and SSL handshake.
+    self._session = requests.session()
 
     if username is not None:
       if password is None:
@@ -231,10 +302,30 @@ class GanetiRapiClient(object): # pylint: disable=R0904
     self._logger.debug("Sending request %s %s (query=%r) (content=%r)",
                        method, url, query, encoded_content)
 
-    req_method = getattr(requests, method.lower())
-    r = req_method(url, auth=self._auth, headers=headers, params=query,
-                   data=encoded_content, verify=False)
-
+    req_method = getattr(self._session, method.lower())
+    attempt = 0
+    while True:
+      start = time.time()
+      try:
+        r = req_method(url, auth=self._auth, headers=headers, params=query,
+                       data=encoded_content, verify=False,
+                       timeout=self._timeout)
+        break
+      except (requests.exceptions.ConnectionError,
+              requests.exceptions.Timeout), err:
+        # Only GET requests are safe to repeat. Other requests submit jobs
+        # to Ganeti, which may have been accepted before the failure.
+        if method != HTTP_GET or attempt >= self._retries:
+          raise
+        delay = self._retry_backoff * 2 ** attempt
+        attempt += 1
+        self._logger.warning("Request %s %s failed: %s. Retrying in %.1f"
+                             " seconds (%d/%d)", method, url, err, delay,
+                             attempt, self._retries)
+        time.sleep(delay)
+
+    if self._latency is not None:
+      self._latency.Observe(time.time() - start)
 
     http_code = r.status_code
     if r.content is not None:
@@ -13,8 +13,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from time import time
+
+from django.conf import settings
 from objpool import ObjectPool
-from synnefo.logic.rapi import GanetiRapiClient
+from synnefo.logic.rapi import GanetiRapiClient, LatencyHistogram
 
 from logging import getLogger
 log = getLogger(__name__)
@@ -22,6 +25,9 @@ log = getLogger(__name__)
 _pools = {}
 _hashes = {}
 pool_size = 8
+# The latency of the requests of each pool is logged at most once per
+# this many seconds, by the processes that make them.
+latency_log_interval = 300
 
 
 class GanetiRapiClientPool(ObjectPool):
@@ -35,10 +41,16 @@ class GanetiRapiClientPool(ObjectPool):
         self.port = port
         self.user = user
         self.passwd = passwd
+        self.latency = LatencyHistogram()
+        self.latency_logged = time()
 
     def _pool_create(self):
         log.debug("CREATE: Creating new client from pool %r", self)
-        client = GanetiRapiClient(self.host, self.port, self.user, self.passwd)
+        client = GanetiRapiClient(self.host, self.port, self.user, self.passwd,
+                                  timeout=settings.GANETI_RAPI_TIMEOUT,
+                                  retries=settings.GANETI_RAPI_RETRIES,
+                                  retry_backoff=settings.GANETI_RAPI_BACKOFF,
+                                  latency=self.latency)
         client._pool = self
         return client
 
@@ -80,3 +92,20 @@ def put_rapi_client(client):
         log.debug("PUT: client %r does not have a pool", client)
         return
     pool.pool_put(client)
+    now = time()
+    if now - pool.latency_logged >= latency_log_interval:
+        pool.latency_logged = now
+        log_rapi_latency(pool)
+
+
+def log_rapi_latency(pool):
+    """Log the latency histogram of the RAPI requests of a pool."""
+    stats = pool.latency.GetStats()
+    if not stats["count"]:
+        return
+    buckets = ", ".join("<=%ss: %d" % (bound, count) if bound is not None
+                        else "all: %d" % count
+                        for bound, count in stats["buckets"])
+    log.info("RAPI latency of %s: %d requests, average %.3fs (%s)",
+             pool.host, stats["count"], stats["sum"] / stats["count"],
+             buckets)
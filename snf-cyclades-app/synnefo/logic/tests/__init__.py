@@ -3,6 +3,8 @@ from .networks import *
 from .ips import *
 from .servers import *
 from .utils_tests import *
+from .backend_allocator import *
 from .rapi_pool_tests import *
 from .reconciliation import *
 from .callbacks import *
+from .dispatcher_workers import *
@@ -0,0 +1,210 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+from StringIO import StringIO
+
+from django.conf import settings
+from django.test import TestCase
+from mock import patch
+
+from snf_django.utils.testing import override_settings
+from synnefo.db import models_factory as mfactory
+from synnefo.db.models import Backend
+from synnefo.logic import backend as backend_mod, backend_allocator
+from synnefo.logic.backend_allocator import BackendAllocator
+from synnefo.logic.allocators import binpack_allocator, simulator
+
+
+class BackendAllocatorTest(TestCase):
+    def setUp(self):
+        self.backend = mfactory.BackendFactory()
+        self.flavor = mfactory.FlavorFactory(
+            ram=1024, disk=10, volume_type__disk_template="plain")
+
+    def assertReserved(self, pinst_cnt):
+        backend = Backend.objects.get(id=self.backend.id)
+        self.assertEqual(backend.pinst_cnt, pinst_cnt)
+        self.assertEqual(backend.mfree, 8192 - 1024)
+        self.assertEqual(backend.dfree, 132423 - 10 * 1024)
+
+    def test_allocate(self):
+        backend = BackendAllocator().allocate("user", self.flavor)
+        self.assertEqual(backend, self.backend)
+        self.assertEqual(backend.pinst_cnt, 3)
+        self.assertReserved(3)
+
+    def test_no_backends(self):
+        Backend.objects.update(drained=True)
+        self.assertEqual(BackendAllocator().allocate("user", self.flavor),
+                         None)
+
+    @patch("synnefo.logic.backend_allocator.get_available_backends")
+    def test_conflict(self, available):
+        # The backend allocates a vm after it was read
+        available.return_value = [Backend.objects.get(id=self.backend.id)]
+        Backend.objects.filter(id=self.backend.id).update(pinst_cnt=5)
+        backend = BackendAllocator().allocate("user", self.flavor)
+        self.assertEqual(backend, self.backend)
+        self.assertReserved(6)
+
+        # Or goes offline
+        available.return_value = [Backend.objects.get(id=self.backend.id)]
+        Backend.objects.filter(id=self.backend.id).update(pinst_cnt=5,
+                                                          offline=True)
+        self.assertEqual(BackendAllocator().allocate("user", self.flavor),
+                         None)
+
+    @patch("synnefo.logic.backend_allocator.get_available_backends")
+    def test_lock_after_retries(self, available):
+        available.return_value = [Backend.objects.get(id=self.backend.id)]
+        Backend.objects.filter(id=self.backend.id).update(pinst_cnt=5)
+        with override_settings(settings, BACKEND_ALLOCATION_RETRIES=0):
+            backend = BackendAllocator().allocate("user", self.flavor)
+        self.assertEqual(backend, self.backend)
+        self.assertReserved(6)
+
+    @patch("synnefo.logic.backend_allocator.get_available_backends")
+    def test_lock_skips_drained(self, available):
+        available.return_value = [Backend.objects.get(id=self.backend.id)]
+        Backend.objects.filter(id=self.backend.id).update(drained=True)
+        with override_settings(settings, BACKEND_ALLOCATION_RETRIES=0):
+            backend = BackendAllocator().allocate("user", self.flavor)
+        self.assertEqual(backend, None)
+
+    @patch("synnefo.logic.backend_allocator.close_connection")
+    @patch("synnefo.logic.backend_allocator.threading.Thread")
+    @patch("synnefo.logic.backend.get_physical_resources")
+    def test_refresh_stats(self, resources, thread, close):
+        stale = mfactory.BackendFactory()
+        updated = datetime.datetime.now() - datetime.timedelta(days=1)
+        Backend.objects.filter(id=stale.id).update(updated=updated)
+        backends = backend_allocator.get_available_backends(self.flavor)
+        self.assertEqual(set(backends), set([self.backend, stale]))
+        thread.assert_called_once_with(
+            target=backend_allocator.refresh_backend_stats, args=(stale.id,))
+        self.assertTrue(thread.return_value.start.called)
+
+        resources.return_value = {"mfree": 1, "mtotal": 2, "dfree": 3,
+                                  "dtotal": 4, "pinst_cnt": 5, "ctotal": 6}
+        backend_allocator.refresh_backend_stats(stale.id)
+        stale = Backend.objects.get(id=stale.id)
+        self.assertEqual((stale.mfree, stale.pinst_cnt), (1, 5))
+        self.assertTrue(stale.updated > updated)
+        self.assertFalse(backend_allocator._refreshing)
+
+
+def node(name, group, mfree, offline=False):
+    values = {"name": name, "group": group, "vm_capable": True,
+              "drained": False, "offline": offline, "cnodes": 1,
+              "mfree": mfree, "mtotal": 1024, "dfree": 100, "dtotal": 200,
+              "pinst_cnt": 1, "ctotal": 4}
+    if offline:
+        # Ganeti does not report the resources of offline nodes
+        return [(0, values[f]) if f not in backend_mod.NODE_RESOURCES
+                else (4, None) for f in backend_mod.NODE_FIELDS]
+    return [(0, values[f]) for f in backend_mod.NODE_FIELDS]
+
+
+@patch("synnefo.logic.rapi_pool.GanetiRapiClient")
+class BackendStatsTest(TestCase):
+    def test_node_stats(self, client):
+        backend = mfactory.BackendFactory()
+        client().Query.return_value = {
+            "fields": [], "data": [node("node1", "default", 512),
+                                   node("node2", "default", 0, True)]}
+        nodes = backend_mod.get_node_stats(backend)
+        client().Query.assert_called_once_with("node",
+                                               backend_mod.NODE_FIELDS)
+        self.assertEqual(nodes[0]["mfree"], 512)
+        self.assertEqual(nodes[1]["mfree"], None)
+        self.assertEqual(nodes[1]["offline"], True)
+        res = backend_mod.sum_node_resources(nodes)
+        self.assertEqual(res["mfree"], 512)
+        self.assertEqual(res["ctotal"], 4)
+
+    def test_poll(self, client):
+        backends = [mfactory.BackendFactory() for i in range(3)]
+        client().Query.return_value = {
+            "fields": [], "data": [node("node1", "group1", 256),
+                                   node("node2", "group2", 512)]}
+        results = backend_mod.poll_backends_resources(backends, workers=2)
+        self.assertEqual([r[0] for r in results], backends)
+        for backend in backends:
+            backend = Backend.objects.get(id=backend.id)
+            self.assertEqual(backend.mfree, 768)
+            self.assertEqual(backend.pinst_cnt, 2)
+
+        client().Query.side_effect = Exception("unreachable")
+        results = backend_mod.poll_backends_resources(backends[:1])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0][1], None)
+        self.assertEqual(str(results[0][2]), "unreachable")
+
+
+class BinPackAllocatorTest(TestCase):
+    def setUp(self):
+        self.backends = [simulator.SimBackend(1, "small", 4096, 100000, 4),
+                         simulator.SimBackend(2, "large", 16384, 100000, 4)]
+        self.vm = {"ram": 2048, "disk": 1000, "cpu": 2}
+
+    def allocate(self, vms, policy):
+        return binpack_allocator.allocate_many(self.backends, vms,
+                                               policy=policy, used_vcpus={})
+
+    def test_policies(self):
+        small, large = self.backends
+        self.assertEqual(self.allocate([self.vm], "best_fit"), [small])
+        self.assertEqual(self.allocate([self.vm], "spread"), [large])
+        self.assertRaises(ValueError, self.allocate, [self.vm], "foo")
+
+    def test_allocate_many(self):
+        small, large = self.backends
+        huge = {"ram": 16384, "disk": 1000, "cpu": 2}
+        vms = [self.vm, self.vm, huge, self.vm]
+        # The huge vm is placed first, so that the others fill the small one
+        self.assertEqual(self.allocate(vms, "best_fit"),
+                         [small, small, large, None])
+        self.assertEqual(self.allocate([{"ram": 1, "disk": 1, "cpu": 13}],
+                                       "spread"), [None])
+
+    def test_used_vcpus(self):
+        backend = mfactory.BackendFactory(ctotal=1)
+        flavor = mfactory.FlavorFactory(cpu=2)
+        mfactory.VirtualMachineFactory(backend=backend, flavor=flavor)
+        mfactory.VirtualMachineFactory(backend=backend, flavor=flavor,
+                                       deleted=True)
+        self.assertEqual(binpack_allocator.get_used_vcpus([backend]),
+                         {backend.id: 2})
+        vm = {"ram": 1, "disk": 1, "cpu": 2}
+        self.assertEqual(binpack_allocator.allocate_many([backend], [vm]),
+                         [None])
+        vm["cpu"] = 1
+        self.assertEqual(binpack_allocator.allocate_many([backend], [vm]),
+                         [backend])
+
+    def test_simulate(self):
+        log = StringIO("# time,action,vm,ram,disk,cpu\n"
+                       "4,delete,vm1\n"
+                       "1,create,vm1,2048,1000,2\n"
+                       "2,create,vm2,2048,1000,2\n"
+                       "3,create,vm3,16384,1000,2\n")
+        events = simulator.read_log(log)
+        self.assertEqual([e.vm for e in events], ["vm1", "vm2", "vm3", "vm1"])
+        results = dict(simulator.simulate(self.backends, events))
+        self.assertEqual(results["best_fit"]["created"], 3)
+        self.assertEqual(results["best_fit"]["peak_backends"], 2)
+        self.assertEqual(results["spread"]["created"], 2)
+        self.assertEqual(results["spread"]["failed"], 1)
@@ -0,0 +1,91 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import threading
+import time
+
+from django.test import TestCase
+from mock import Mock, patch
+
+from synnefo.logic.dispatcher_workers import WorkerPool
+
+
+def message(tag, **body):
+    return {"body": json.dumps(body), "tag": tag}
+
+
+@patch("synnefo.logic.dispatcher_workers.close_connection")
+class WorkerPoolTest(TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(4)
+        self.processed = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.pool.stop(timeout=5)
+
+    def callback(self, client, msg):
+        time.sleep(0.001)
+        with self.lock:
+            self.processed.append(msg["tag"])
+        client.basic_ack(msg)
+
+    def test_order(self, close):
+        self.pool.start()
+        conn = object()
+        for i in range(50):
+            for instance in ("snf-1", "snf-2", "snf-3"):
+                self.pool.put(self.callback,
+                              message((instance, i), instance=instance,
+                                      event_time=[time.time(), 0]), conn)
+        self.pool.put(self.callback, message(("net", 0), network="snf-net-1"),
+                      conn)
+        self.pool.stop(timeout=5)
+        self.assertEqual(len(self.processed), 151)
+        for instance in ("snf-1", "snf-2", "snf-3"):
+            self.assertEqual([i for name, i in self.processed
+                              if name == instance], range(50))
+        self.assertTrue(close.called)
+
+        client = Mock()
+        self.pool.send_acks(client, conn)
+        self.assertEqual(client.basic_ack.call_count, 151)
+
+        stats = self.pool.stats.report()
+        self.assertEqual(stats["lag"][0], 151)
+        self.assertEqual(stats["callbacks"]["callback"][0], 151)
+        self.assertEqual(self.pool.stats.report()["lag"][0], 0)
+
+    def test_acks(self, close):
+        self.pool.start()
+        old, new = object(), object()
+
+        def reject(client, msg):
+            client.basic_reject(msg, requeue=True)
+
+        self.pool.put(self.callback, message(1, instance="snf-1"), old)
+        self.pool.put(reject, message(2, instance="snf-1"), new)
+        self.pool.put(self.callback, "invalid", new)
+        self.pool.stop(timeout=5)
+
+        # The ack of the message from the old connection is dropped
+        client = Mock()
+        self.pool.send_acks(client, new)
+        client.basic_reject.assert_called_once_with(message(2,
+                                                            instance="snf-1"),
+                                                    requeue=True)
+        self.assertFalse(client.basic_ack.called)
+        self.assertEqual(self.processed, [1])
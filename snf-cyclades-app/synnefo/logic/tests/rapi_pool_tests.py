@@ -13,11 +13,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import requests
+
+from django.conf import settings
 from django.test import TestCase
 
 from synnefo.logic import rapi_pool
+from synnefo.logic.rapi import GanetiRapiClient, LatencyHistogram
+
+from mock import patch, Mock, ANY
 
-from mock import patch
+
+def client_kwargs():
+    return {"timeout": settings.GANETI_RAPI_TIMEOUT,
+            "retries": settings.GANETI_RAPI_RETRIES,
+            "retry_backoff": settings.GANETI_RAPI_BACKOFF,
+            "latency": ANY}
 
 
 @patch('synnefo.logic.rapi_pool.GanetiRapiClient', spec=True)
@@ -25,7 +36,8 @@ class GanetiRapiPoolTest(TestCase):
     def test_new_client(self, rclient):
         cl = rapi_pool.get_rapi_client(1, 'amxixa', 'cluster0', '5080', 'user',
                                        'pass')
-        rclient.assert_called_once_with("cluster0", "5080", "user", "pass")
+        rclient.assert_called_once_with("cluster0", "5080", "user", "pass",
+                                         **client_kwargs())
         self.assertTrue('amxixa' in rapi_pool._pools)
         self.assertTrue(cl._pool is rapi_pool._pools[rapi_pool._hashes[1]])
 
@@ -38,7 +50,8 @@ class GanetiRapiPoolTest(TestCase):
     def test_get_from_pool(self, rclient):
         cl = rapi_pool.get_rapi_client(1, 'dummyhash', 'cluster1', '5080',
                                        'user', 'pass')
-        rclient.assert_called_once_with("cluster1", "5080", "user", "pass")
+        rclient.assert_called_once_with("cluster1", "5080", "user", "pass",
+                                         **client_kwargs())
         rapi_pool.put_rapi_client(cl)
         rclient.reset_mock()
         cl2 = rapi_pool.get_rapi_client(1, 'dummyhash', 'cluster1', '5080',
@@ -49,12 +62,14 @@ class GanetiRapiPoolTest(TestCase):
     def test_changed_credentials(self, rclient):
         cl = rapi_pool.get_rapi_client(1, 'dummyhash2', 'cluster2', '5080',
                                        'user', 'pass')
-        rclient.assert_called_once_with("cluster2", "5080", "user", "pass")
+        rclient.assert_called_once_with("cluster2", "5080", "user", "pass",
+                                         **client_kwargs())
         rapi_pool.put_rapi_client(cl)
         rclient.reset_mock()
         rapi_pool.get_rapi_client(1, 'dummyhash3', 'cluster2', '5080',
                                   'user', 'new_pass')
-        rclient.assert_called_once_with("cluster2", "5080", "user", "new_pass")
+        rclient.assert_called_once_with("cluster2", "5080", "user", "new_pass",
+                                         **client_kwargs())
         self.assertFalse('dummyhash2' in rapi_pool._pools)
 
     def test_no_pool(self, rclient):
@@ -63,3 +78,73 @@ class GanetiRapiPoolTest(TestCase):
         cl._pool = None
         rapi_pool.put_rapi_client(cl)
         self.assertTrue(cl not in rapi_pool._pools.values())
+
+    def test_latency(self, rclient):
+        rapi_pool.get_rapi_client(1, 'dummyhash4', 'cluster4', '5080',
+                                  'user', 'pass')
+        pool = rapi_pool._pools['dummyhash4']
+        self.assertTrue(rclient.call_args[1]["latency"] is pool.latency)
+        pool.latency.Observe(0.2)
+        cl = rapi_pool.get_rapi_client(1, 'dummyhash4', 'cluster4', '5080',
+                                       'user', 'pass')
+        with patch("synnefo.logic.rapi_pool.log") as log:
+            rapi_pool.put_rapi_client(cl)
+            self.assertFalse(log.info.called)
+            pool.latency_logged -= rapi_pool.latency_log_interval
+            cl = rapi_pool.get_rapi_client(1, 'dummyhash4', 'cluster4',
+                                           '5080', 'user', 'pass')
+            rapi_pool.put_rapi_client(cl)
+        self.assertEqual(log.info.call_args[0][1:4], ("cluster4", 1, 0.2))
+
+
+class GanetiRapiClientTest(TestCase):
+    def setUp(self):
+        self.latency = LatencyHistogram()
+        self.client = GanetiRapiClient("cluster", 5080, "user", "pass",
+                                       timeout=10, retries=2, retry_backoff=0,
+                                       latency=self.latency)
+        self.session = Mock()
+        self.client._session = self.session
+
+    def response(self, content):
+        return Mock(status_code=200, content=content)
+
+    def test_session(self):
+        self.session.get.return_value = self.response("2")
+        self.assertEqual(self.client.GetVersion(), 2)
+        self.assertEqual(self.client.GetVersion(), 2)
+        self.assertEqual(self.session.get.call_count, 2)
+        self.session.get.assert_called_with(
+            "https://cluster:5080/version", auth=("user", "pass"), headers={},
+            params=None, data="", verify=False, timeout=10)
+        self.assertEqual(self.latency.GetStats()["count"], 2)
+
+    def test_retry_get(self):
+        error = requests.exceptions.ConnectionError("refused")
+        self.session.get.side_effect = [error, error, self.response("2")]
+        self.assertEqual(self.client.GetVersion(), 2)
+        self.assertEqual(self.session.get.call_count, 3)
+
+        self.session.get.reset_mock()
+        self.session.get.side_effect = error
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          self.client.GetVersion)
+        self.assertEqual(self.session.get.call_count, 3)
+        self.assertEqual(self.latency.GetStats()["count"], 1)
+
+    def test_no_retry_post(self):
+        self.session.put.side_effect = requests.exceptions.Timeout("slow")
+        self.assertRaises(requests.exceptions.Timeout,
+                          self.client.RedistributeConfig)
+        self.assertEqual(self.session.put.call_count, 1)
+
+
+class LatencyHistogramTest(TestCase):
+    def test_buckets(self):
+        histogram = LatencyHistogram(buckets=(0.1, 1))
+        for seconds in (0.05, 0.1, 0.5, 2, 3):
+            histogram.Observe(seconds)
+        stats = histogram.GetStats()
+        self.assertEqual(stats["count"], 5)
+        self.assertAlmostEqual(stats["sum"], 5.65)
+        self.assertEqual(stats["buckets"], [(0.1, 2), (1, 3), (None, 5)])
@@ -33,10 +33,11 @@ from pithos.api.util import (
     update_public_meta, validate_modification_preconditions,
     validate_matching_preconditions, split_container_object_string,
     copy_or_move_object, get_int_parameter, get_content_length,
-    get_content_range, socket_read_iterator, SaveToBackendHandler,
-    object_data_response, put_object_block, hashmap_md5, simple_list_response,
-    api_method, is_uuid, retrieve_uuid, retrieve_uuids,
-    retrieve_displaynames, Checksum, NoChecksum
+    get_content_range, socket_read_iterator, put_block_iterator,
+    SaveToBackendHandler, object_data_response, put_object_block,
+    hashmap_md5, cached_hashmap_md5, remember_hashmap_md5,
+    update_hashmap_md5_async, simple_list_response, api_method, is_uuid,
+    retrieve_uuid, retrieve_uuids, retrieve_displaynames, Checksum, NoChecksum
 )
 
 from pithos.api.settings import (UPDATE_MD5, TRANSLATE_UUIDS,
@@ -50,7 +51,9 @@ from pithos.backends.base import (
     InconsistentContentSize)
 
 from pithos.backends.filter import parse_filters
+from pithos.backends.hashmap import TreeHash
 
+import binascii
 import logging
 logger = logging.getLogger(__name__)
 
@@ -118,6 +121,8 @@ def container_demux(request, v_account, v_container):
     elif request.method == 'PUT':
         return container_create(request, v_account, v_container)
     elif request.method == 'POST':
+        if 'object_meta' in request.GET:
+            return object_meta_bulk(request, v_account, v_container)
         return container_update(request, v_account, v_container)
     elif request.method == 'DELETE':
         return container_delete(request, v_account, v_container)
@@ -552,12 +557,13 @@ def container_update(request, v_account, v_container):
         except NotAllowedError:
             raise faults.Forbidden('Not allowed')
 
-        for data in socket_read_iterator(request, content_length,
-                                         request.backend.block_size):
+        blocks = socket_read_iterator(request, content_length,
+                                      request.backend.block_size)
+        for data, block_hash in put_block_iterator(request, blocks):
             # TODO: Raise 408 (Request Timeout) if this takes too long.
             # TODO: Raise 499 (Client Disconnect) if a length is defined
             #       and we stop before getting this much data.
-            hashmap.append(request.backend.put_block(data))
+            hashmap.append(block_hash)
 
     response = HttpResponse(status=202)
     if hashmap:
@@ -595,6 +601,88 @@ def container_delete(request, v_account, v_container):
     return HttpResponse(status=204)
 
 
+def get_object_sharing(request, v_account, v_container, prefix='',
+                       names=None):
+    """Return the permissions and the public URLs of the container objects.
+
+    Both are dictionaries keyed by object name. If names is not None,
+    look up only the objects with these names.
+    """
+
+    object_permissions = {}
+    object_public = {}
+    name = '/'.join((v_account, v_container, ''))
+    name_idx = len(name)
+    objects_bulk = []
+    for x in request.backend.list_object_permissions(
+            request.user_uniq, v_account, v_container, prefix, names):
+
+        # filter out objects which are not under the container
+        if name != x[:name_idx]:
+            continue
+        objects_bulk.append(x[name_idx:])
+
+    if len(objects_bulk) > 0:
+        object_permissions = \
+            request.backend.get_object_permissions_bulk(
+                request.user_uniq, v_account, v_container,
+                objects_bulk)
+
+    if request.user_uniq == v_account:
+        # Bring public information only if the request user
+        # is the object owner
+        for k, v in request.backend.list_object_public(
+                request.user_uniq, v_account,
+                v_container, prefix, names).iteritems():
+            object_public[k[name_idx:]] = v
+    return object_permissions, object_public
+
+
+def format_object_meta(request, v_account, v_container, objects,
+                       object_permissions, object_public, until=None):
+    """Return the object metadata, as reported in object listings."""
+
+    object_meta = []
+    for meta in objects:
+        if TRANSLATE_UUIDS:
+            modified_by = meta.get('modified_by')
+            if modified_by:
+                l = retrieve_displaynames(
+                    getattr(request, 'token', None), [meta['modified_by']])
+                if l is not None and len(l) == 1:
+                    meta['modified_by'] = l[0]
+
+        if len(meta) == 1:
+            # Virtual objects/directories.
+            object_meta.append(meta)
+        else:
+            rename_meta_key(
+                meta, 'hash', 'x_object_hash')  # Will be replaced by checksum.
+            rename_meta_key(meta, 'checksum', 'hash')
+            rename_meta_key(meta, 'type', 'content_type')
+            rename_meta_key(meta, 'uuid', 'x_object_uuid')
+            if until is not None and 'modified' in meta:
+                del(meta['modified'])
+            else:
+                rename_meta_key(meta, 'modified', 'last_modified')
+            rename_meta_key(meta, 'modified_by', 'x_object_modified_by')
+            rename_meta_key(meta, 'version', 'x_object_version')
+            rename_meta_key(
+                meta, 'version_timestamp', 'x_object_version_timestamp')
+            permissions = object_permissions.get(meta['name'], None)
+            if permissions:
+                update_sharing_meta(request, permissions, v_account,
+                                    v_container, meta['name'], meta)
+            public_url = object_public.get(meta['name'], None)
+            if request.user_uniq == v_account:
+                # Return public information only if the request user
+                # is the object owner
+                update_public_meta(public_url, meta)
+            object_meta.append(printable_header_dict(meta))
+
+    return object_meta
+
+
 @api_method('GET', format_allowed=True, user_required=True, logger=logger,
             serializations=["text", "xml", "json"])
 def object_list(request, v_account, v_container):
@@ -701,73 +789,16 @@ def object_list(request, v_account, v_container):
         object_permissions = {}
         object_public = {}
         if until is None:
-            name = '/'.join((v_account, v_container, ''))
-            name_idx = len(name)
-            objects_bulk = []
-            for x in request.backend.list_object_permissions(
-                    request.user_uniq, v_account, v_container, prefix):
-
-                # filter out objects which are not under the container
-                if name != x[:name_idx]:
-                    continue
-                objects_bulk.append(x[name_idx:])
-
-            if len(objects_bulk) > 0:
-                object_permissions = \
-                    request.backend.get_object_permissions_bulk(
-                        request.user_uniq, v_account, v_container,
-                        objects_bulk)
-
-            if request.user_uniq == v_account:
-                # Bring public information only if the request user
-                # is the object owner
-                for k, v in request.backend.list_object_public(
-                        request.user_uniq, v_account,
-                        v_container, prefix).iteritems():
-                    object_public[k[name_idx:]] = v
+            object_permissions, object_public = get_object_sharing(
+                request, v_account, v_container, prefix)
     except NotAllowedError:
         raise faults.Forbidden('Not allowed')
     except ItemNotExists:
         raise faults.ItemNotFound('Container does not exist')
 
-    object_meta = []
-    for meta in objects:
-        if TRANSLATE_UUIDS:
-            modified_by = meta.get('modified_by')
-            if modified_by:
-                l = retrieve_displaynames(
-                    getattr(request, 'token', None), [meta['modified_by']])
-                if l is not None and len(l) == 1:
-                    meta['modified_by'] = l[0]
-
-        if len(meta) == 1:
-            # Virtual objects/directories.
-            object_meta.append(meta)
-        else:
-            rename_meta_key(
-                meta, 'hash', 'x_object_hash')  # Will be replaced by checksum.
-            rename_meta_key(meta, 'checksum', 'hash')
-            rename_meta_key(meta, 'type', 'content_type')
-            rename_meta_key(meta, 'uuid', 'x_object_uuid')
-            if until is not None and 'modified' in meta:
-                del(meta['modified'])
-            else:
-                rename_meta_key(meta, 'modified', 'last_modified')
-            rename_meta_key(meta, 'modified_by', 'x_object_modified_by')
-            rename_meta_key(meta, 'version', 'x_object_version')
-            rename_meta_key(
-                meta, 'version_timestamp', 'x_object_version_timestamp')
-            permissions = object_permissions.get(meta['name'], None)
-            if permissions:
-                update_sharing_meta(request, permissions, v_account,
-                                    v_container, meta['name'], meta)
-            public_url = object_public.get(meta['name'], None)
-            if request.user_uniq == v_account:
-                # Return public information only if the request user
-                # is the object owner
-                update_public_meta(public_url, meta)
-            object_meta.append(printable_header_dict(meta))
-
+    object_meta = format_object_meta(request, v_account, v_container,
+                                     objects, object_permissions,
+                                     object_public, until)
     if request.serialization == 'xml':
         data = render_to_string(
             'objects.xml', {'container': v_container, 'objects': object_meta})
@@ -778,6 +809,55 @@ def object_list(request, v_account, v_container):
     return response
 
 
+@api_method('POST', format_allowed=True, user_required=True, logger=logger)
+def object_meta_bulk(request, v_account, v_container):
+    # Normal Response Codes: 200
+    # Error Response Codes: internalServerError (500),
+    #                       itemNotFound (404),
+    #                       forbidden (403),
+    #                       badRequest (400)
+
+    content_length = -1
+    if request.META.get('HTTP_TRANSFER_ENCODING') != 'chunked':
+        content_length = get_content_length(request)
+    data = ''.join(socket_read_iterator(request, content_length,
+                                        request.backend.block_size))
+    try:
+        names = json.loads(data)
+        if (not isinstance(names, list) or
+                not all(isinstance(x, basestring) for x in names)):
+            raise ValueError
+    except ValueError:
+        raise faults.BadRequest('Invalid data formatting')
+    if len(names) > settings.API_LIST_LIMIT:
+        raise faults.BadRequest('Too many objects requested')
+
+    try:
+        objects = request.backend.get_object_meta_bulk(
+            request.user_uniq, v_account, v_container, names, 'pithos')
+        object_permissions, object_public = get_object_sharing(
+            request, v_account, v_container,
+            names=[meta['name'] for meta in objects])
+    except NotAllowedError:
+        raise faults.Forbidden('Not allowed')
+    except ItemNotExists:
+        raise faults.ItemNotFound('Container does not exist')
+
+    for meta in objects:
+        del(meta['mapfile'])
+        del(meta['is_snapshot'])
+    object_meta = format_object_meta(request, v_account, v_container,
+                                     objects, object_permissions,
+                                     object_public)
+
+    if request.serialization == 'xml':
+        data = render_to_string(
+            'objects.xml', {'container': v_container, 'objects': object_meta})
+    else:
+        data = json.dumps(object_meta, default=json_encode_decimal)
+    return HttpResponse(data, status=200)
+
+
 @api_method('HEAD', user_required=True, logger=logger)
 def object_meta(request, v_account, v_container, v_object):
     # Normal Response Codes: 204
@@ -1060,10 +1140,8 @@ def object_write(request, v_account, v_container, v_object):
         raise faults.LengthRequired('Missing Content-Type header')
 
     if 'hashmap' in request.GET:
-        data = ''
-        for block in socket_read_iterator(request, content_length,
-                                          request.backend.block_size):
-            data = ''.join([data, block])
+        data = ''.join(socket_read_iterator(request, content_length,
+                                            request.backend.block_size))
 
         try:
             d = json.loads(data)
@@ -1072,28 +1150,33 @@ def object_write(request, v_account, v_container, v_object):
         except:
             raise faults.BadRequest('Invalid data formatting')
         checksum = ''  # Do not set to None (will copy previous value).
+        top_hash = None
     else:
         etag = request.META.get('HTTP_ETAG')
         checksum_compute = Checksum() if etag or UPDATE_MD5 else NoChecksum()
         size = 0
         hashmap = []
-        for data in socket_read_iterator(request, content_length,
-                                         request.backend.block_size):
+        tree = TreeHash(request.backend.hash_algorithm)
+        blocks = socket_read_iterator(request, content_length,
+                                      request.backend.block_size)
+        for data, block_hash in put_block_iterator(request, blocks, tree):
             # TODO: Raise 408 (Request Timeout) if this takes too long.
             # TODO: Raise 499 (Client Disconnect) if a length is defined
             #       and we stop before getting this much data.
             size += len(data)
-            hashmap.append(request.backend.put_block(data))
+            hashmap.append(block_hash)
             checksum_compute.update(data)
 
         checksum = checksum_compute.hexdigest()
         if etag and parse_etags(etag)[0].lower() != checksum:
             raise faults.UnprocessableEntity('Object ETag does not match')
+        top_hash = binascii.hexlify(tree.hash())
 
     try:
         version_id, merkle = request.backend.update_object_hashmap(
             request.user_uniq, v_account, v_container, v_object, size,
-            content_type, hashmap, checksum, 'pithos', meta, True, permissions
+            content_type, hashmap, checksum, 'pithos', meta, True, permissions,
+            top_hash=top_hash
         )
     except IllegalOperationError, e:
         raise faults.Forbidden(e[0])
@@ -1114,16 +1197,28 @@ def object_write(request, v_account, v_container, v_object):
         raise faults.RequestEntityTooLarge('Quota error: %s' % e)
     except InvalidHash, e:
         raise faults.BadRequest('Invalid hash: %s' % e)
-    if not checksum and UPDATE_MD5:
+    if checksum and UPDATE_MD5:
+        remember_hashmap_md5(merkle, size, checksum)
+    elif UPDATE_MD5:
         # Update the MD5 after the hashmap, as there may be missing hashes.
-        checksum = hashmap_md5(request.backend, hashmap, size)
-        try:
-            request.backend.update_object_checksum(request.user_uniq,
-                                                   v_account, v_container,
-                                                   v_object, version_id,
-                                                   checksum)
-        except NotAllowedError:
-            raise faults.Forbidden('Not allowed')
+        checksum = cached_hashmap_md5(request.backend, hashmap, size,
+                                      top_hash=merkle)
+        if checksum is None and settings.UPDATE_MD5_ASYNC:
+            checksum = ''
+            update_hashmap_md5_async(request, v_account, v_container,
+                                     v_object, version_id, hashmap, size,
+                                     merkle)
+        else:
+            if checksum is None:
+                checksum = hashmap_md5(request.backend, hashmap, size,
+                                       top_hash=merkle)
+            try:
+                request.backend.update_object_checksum(request.user_uniq,
+                                                       v_account, v_container,
+                                                       v_object, version_id,
+                                                       checksum)
+            except NotAllowedError:
+                raise faults.Forbidden('Not allowed')
     if public is not None:
         try:
             request.backend.update_object_public(request.user_uniq, v_account,
@@ -1158,7 +1253,8 @@ def object_write_form(request, v_account, v_container, v_object):
     try:
         version_id, merkle = request.backend.update_object_hashmap(
             request.user_uniq, v_account, v_container, v_object, file.size,
-            file.content_type, file.hashmap, checksum, 'pithos', {}, True
+            file.content_type, file.hashmap, checksum, 'pithos', {}, True,
+            top_hash=file.top_hash
         )
     except IllegalOperationError, e:
         faults.Forbidden(e[0])
@@ -1171,6 +1267,9 @@ def object_write_form(request, v_account, v_container, v_object):
     except QuotaError, e:
         raise faults.RequestEntityTooLarge('Quota error: %s' % e)
 
+    if UPDATE_MD5:
+        remember_hashmap_md5(merkle, file.size, checksum)
+
     response = HttpResponse(status=201)
     response['ETag'] = merkle if not UPDATE_MD5 else checksum
     response['X-Object-Version'] = version_id
@@ -1479,13 +1578,16 @@ def object_update(request, v_account, v_container, v_object):
     if dest_bytes is not None and dest_bytes < size:
         size = dest_bytes
         hashmap = hashmap[:(int((size - 1) / request.backend.block_size) + 1)]
-    checksum = hashmap_md5(
-        request.backend, hashmap, size) if UPDATE_MD5 else ''
+    checksum = ''
+    if UPDATE_MD5 and settings.UPDATE_MD5_ASYNC:
+        checksum = cached_hashmap_md5(request.backend, hashmap, size)
+    elif UPDATE_MD5:
+        checksum = hashmap_md5(request.backend, hashmap, size)
     try:
         version_id, merkle = request.backend.update_object_hashmap(
             request.user_uniq, v_account, v_container, v_object, size,
-            prev_meta['type'], hashmap, checksum, 'pithos', meta, replace,
-            permissions
+            prev_meta['type'], hashmap, checksum or '', 'pithos', meta,
+            replace, permissions
         )
     except IllegalOperationError, e:
         raise faults.Forbidden(e[0])
@@ -1499,6 +1601,10 @@ def object_update(request, v_account, v_container, v_object):
         raise faults.BadRequest('Invalid sharing header')
     except QuotaError, e:
         raise faults.RequestEntityTooLarge('Quota error: %s' % e)
+    if checksum is None:
+        checksum = ''
+        update_hashmap_md5_async(request, v_account, v_container, v_object,
+                                 version_id, hashmap, size, merkle)
     if public is not None:
         try:
             request.backend.update_object_public(request.user_uniq, v_account,
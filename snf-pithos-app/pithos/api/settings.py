@@ -112,6 +112,22 @@ BACKEND_DB_MODULE = getattr(
 BACKEND_DB_CONNECTION = getattr(settings, 'PITHOS_BACKEND_DB_CONNECTION',
                                 'sqlite:////tmp/pithos-backend.db')
 
+# The size of the database connection pool shared by the backends of a server
+# process (0 keeps one dedicated connection per backend)
+BACKEND_DB_POOL_SIZE = getattr(settings, 'PITHOS_BACKEND_DB_POOL_SIZE', 0)
+
+# The number of connections that may be opened beyond the pool size
+BACKEND_DB_POOL_MAX_OVERFLOW = getattr(
+    settings, 'PITHOS_BACKEND_DB_POOL_MAX_OVERFLOW', 10)
+
+# The number of seconds to wait for a pooled connection
+BACKEND_DB_POOL_TIMEOUT = getattr(settings, 'PITHOS_BACKEND_DB_POOL_TIMEOUT',
+                                  30)
+
+# Check that pooled connections are alive before using them
+BACKEND_DB_POOL_PRE_PING = getattr(settings, 'PITHOS_BACKEND_DB_POOL_PRE_PING',
+                                   True)
+
 # Block storage.
 BACKEND_BLOCK_MODULE = getattr(
     settings, 'PITHOS_BACKEND_BLOCK_MODULE', 'pithos.backends.lib.hashfiler')
@@ -129,6 +145,9 @@ BACKEND_QUEUE_HOSTS = getattr(settings, 'PITHOS_BACKEND_QUEUE_HOSTS', None)
 BACKEND_QUEUE_EXCHANGE = getattr(settings, 'PITHOS_BACKEND_QUEUE_EXCHANGE',
                                  'pithos')
 
+# Publish queue messages in batches from a background thread
+BACKEND_QUEUE_ASYNC = getattr(settings, 'PITHOS_BACKEND_QUEUE_ASYNC', False)
+
 # Default setting for new accounts.
 BACKEND_ACCOUNT_QUOTA = getattr(
     settings, 'PITHOS_BACKEND_ACCOUNT_QUOTA', 50 * 1024 * 1024 * 1024)
@@ -138,6 +157,10 @@ BACKEND_VERSIONING = getattr(settings, 'PITHOS_BACKEND_VERSIONING', 'auto')
 BACKEND_FREE_VERSIONING = getattr(settings, 'PITHOS_BACKEND_FREE_VERSIONING',
                                   True)
 
+# Issue the quota commissions of a request as one, when the request commits
+BACKEND_BATCH_COMMISSIONS = getattr(
+    settings, 'PITHOS_BACKEND_BATCH_COMMISSIONS', False)
+
 # Enable backend pooling
 BACKEND_POOL_ENABLED = getattr(settings, 'PITHOS_BACKEND_POOL_ENABLED', True)
 
@@ -147,6 +170,16 @@ BACKEND_POOL_SIZE = getattr(settings, 'PITHOS_BACKEND_POOL_SIZE', 5)
 # Update object checksums.
 UPDATE_MD5 = getattr(settings, 'PITHOS_UPDATE_MD5', False)
 
+# The number of object checksums (per server process) cached by hashmap
+UPDATE_MD5_CACHE_SIZE = getattr(settings, 'PITHOS_UPDATE_MD5_CACHE_SIZE',
+                                10000)
+
+# Compute checksums missing from the cache in the background
+UPDATE_MD5_ASYNC = getattr(settings, 'PITHOS_UPDATE_MD5_ASYNC', False)
+
+# The number of workers (per server process) computing background checksums
+UPDATE_MD5_WORKERS = getattr(settings, 'PITHOS_UPDATE_MD5_WORKERS', 2)
+
 RADOS_STORAGE = getattr(settings, 'PITHOS_RADOS_STORAGE', False)
 RADOS_POOL_BLOCKS = getattr(settings, 'PITHOS_RADOS_POOL_BLOCKS', 'blocks')
 RADOS_POOL_MAPS = getattr(settings, 'PITHOS_RADOS_POOL_MAPS', 'maps')
@@ -201,3 +234,37 @@ BACKEND_MAP_CHECK_INTERVAL = getattr(settings,
 # Once set it should not be changed
 BACKEND_MAPFILE_PREFIX = getattr(settings,
                                  'PITHOS_BACKEND_MAPFILE_PREFIX', 'snf_file_')
+
+# The number of object blocks to fetch ahead of the one being served, when
+# streaming object data (0 disables read-ahead)
+BACKEND_BLOCK_READAHEAD = getattr(settings, 'PITHOS_BACKEND_BLOCK_READAHEAD',
+                                  0)
+
+# The maximum amount of memory (in bytes) a single response may hold in
+# read-ahead blocks. It further limits the read-ahead window.
+BACKEND_BLOCK_READAHEAD_MAX_MEMORY = getattr(
+    settings, 'PITHOS_BACKEND_BLOCK_READAHEAD_MAX_MEMORY', 64 * 1024 * 1024)
+
+# The number of workers (per server process) fetching read-ahead blocks
+BACKEND_BLOCK_READAHEAD_WORKERS = getattr(
+    settings, 'PITHOS_BACKEND_BLOCK_READAHEAD_WORKERS', 8)
+
+# The size (in bytes) of the in-memory cache of blocks read from the storage,
+# shared by all the backends of a server process (0 disables the cache)
+BACKEND_BLOCK_CACHE_SIZE = getattr(settings, 'PITHOS_BACKEND_BLOCK_CACHE_SIZE',
+                                   0)
+
+# The directory and the size (in bytes) of the memory mapped file holding
+# blocks evicted from the in-memory block cache (None disables the disk tier)
+BACKEND_BLOCK_CACHE_DISK_PATH = getattr(
+    settings, 'PITHOS_BACKEND_BLOCK_CACHE_DISK_PATH', None)
+BACKEND_BLOCK_CACHE_DISK_SIZE = getattr(
+    settings, 'PITHOS_BACKEND_BLOCK_CACHE_DISK_SIZE', 1024 * 1024 * 1024)
+
+# The number of uploaded blocks that may be hashed and stored concurrently,
+# while the next blocks of the request are being read (0 disables pipelining)
+BACKEND_UPLOAD_PIPELINE = getattr(
+    settings, 'PITHOS_BACKEND_UPLOAD_PIPELINE', 0)
+
+# The number of workers (per server process) storing pipelined upload blocks
+BACKEND_UPLOAD_WORKERS = getattr(settings, 'PITHOS_BACKEND_UPLOAD_WORKERS', 8)
@@ -954,6 +954,76 @@ class ContainerPost(PithosAPITest):
         r = self.post(url, data=get_random_data())
         self.assertEqual(r.status_code, 403)
 
+    def test_object_meta_bulk(self):
+        cname = self.create_container()[0]
+        onames = [self.upload_object(cname, quality='good')[0]
+                  for _ in range(3)]
+
+        url = join_urls(self.pithos_path, self.user, cname)
+        names = [onames[2], 'missing', onames[0]]
+        r = self.post('%s?object_meta&format=json' % url,
+                      data=json.dumps(names), content_type='application/json')
+        self.assertEqual(r.status_code, 200)
+        objects = json.loads(r.content)
+        self.assertEqual([o['name'] for o in objects],
+                         [onames[2], onames[0]])
+        for o in objects:
+            info = self.get_object_info(cname, o['name'])
+            self.assertEqual(o['x_object_uuid'], info['X-Object-UUID'])
+            self.assertEqual(o['bytes'], int(info['Content-Length']))
+            self.assertEqual(o['x_object_meta_quality'], 'good')
+
+        # The container metadata is left intact.
+        self.assertTrue('x-container-meta-quality' not in
+                        self.get_container_info(cname))
+
+        r = self.post('%s?object_meta&format=xml' % url,
+                      data=json.dumps(names), content_type='application/json')
+        self.assertEqual(r.status_code, 200)
+        xml = minidom.parseString(r.content)
+        self.assertEqual(
+            [n.childNodes[0].data for n in xml.getElementsByTagName('name')],
+            [onames[2], onames[0]])
+
+        # Only shared objects are reported to others.
+        url = join_urls(self.pithos_path, self.user, cname, onames[0])
+        self.post(url, content_type='', HTTP_CONTENT_RANGE='bytes */*',
+                  HTTP_X_OBJECT_SHARING='read=chuck')
+        url = join_urls(self.pithos_path, self.user, cname)
+        r = self.post('%s?object_meta&format=json' % url, user='chuck',
+                      data=json.dumps(onames), content_type='application/json')
+        self.assertEqual(r.status_code, 200)
+        objects = json.loads(r.content)
+        self.assertEqual([o['name'] for o in objects], [onames[0]])
+        self.assertTrue('x_object_sharing' in objects[0])
+
+        # The sharing of the objects that were not requested is ignored.
+        r = self.post('%s?object_meta&format=json' % url,
+                      data=json.dumps(onames[1:]),
+                      content_type='application/json')
+        self.assertEqual(r.status_code, 200)
+        for o in json.loads(r.content):
+            self.assertTrue('x_object_sharing' not in o)
+
+    @pithos_test_settings(API_LIST_LIMIT=2)
+    def test_object_meta_bulk_invalid(self):
+        cname = self.create_container()[0]
+        url = join_urls(self.pithos_path, self.user, cname)
+
+        r = self.post('%s?object_meta' % url, data='{"a": 1}',
+                      content_type='application/json')
+        self.assertEqual(r.status_code, 400)
+
+        r = self.post('%s?object_meta' % url,
+                      data=json.dumps(['a', 'b', 'c']),
+                      content_type='application/json')
+        self.assertEqual(r.status_code, 400)
+
+        url = join_urls(self.pithos_path, self.user, 'missing')
+        r = self.post('%s?object_meta' % url, data=json.dumps(['a']),
+                      content_type='application/json')
+        self.assertEqual(r.status_code, 404)
+
 
 class ContainerDelete(PithosAPITest):
     def setUp(self):
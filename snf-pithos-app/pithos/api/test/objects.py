@@ -21,6 +21,7 @@ from collections import defaultdict
 from urllib import quote, unquote
 from functools import partial
 from unittest import skipIf
+from mock import patch
 
 from pithos.api.test import (PithosAPITest, pithos_settings,
                              AssertMappingInvariant, AssertUUidInvariant,
@@ -28,6 +29,9 @@ from pithos.api.test import (PithosAPITest, pithos_settings,
                              DATE_FORMATS, pithos_test_settings)
 from pithos.api.test.util import (md5_hash, merkle, strnextling,
                                   get_random_data, get_random_name, HashMap)
+from pithos.backends.modular import ModularBackend
+from pithos.api.util import (get_backend, hashmap_md5, hashmap_top_hash,
+                             MD5Cache)
 
 from synnefo.lib import join_urls
 
@@ -410,6 +414,72 @@ class ObjectGet(PithosAPITest):
             self.assertEquals(fdata, sdata)
             i += 1
 
+    def test_multiple_range_shared_blocks(self):
+        cname = self.containers[0]
+        oname, odata = self.upload_object(
+            cname, length=4 * TEST_BLOCK_SIZE + 100)[:-1]
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+
+        bs = TEST_BLOCK_SIZE
+        l = [(bs + 10, bs + 20), (0, 50), (bs, 2 * bs + 10),
+             (bs + 15, bs + 15)]
+        ranges = 'bytes=%s' % ','.join('%d-%d' % r for r in l)
+        get_block = ModularBackend.get_block
+        with patch.object(ModularBackend, 'get_block', autospec=True,
+                          side_effect=get_block) as m:
+            r = self.get(url, HTTP_RANGE=ranges)
+            self.assertEqual(r.status_code, 206)
+            content = r.content
+            # Each of the three blocks is fetched once.
+            self.assertEqual(m.call_count, 3)
+
+        boundary = r['content-type'].split('boundary=')[1]
+        cparts = content.split('--%s' % boundary)[1:-1]
+        self.assertEqual(len(cparts), len(l))
+        for cpart, (start, end) in zip(cparts, l):
+            sdata = '\r\n'.join(cpart.split('\r\n')[4:-1])
+            self.assertEqual(sdata, odata[start:end + 1])
+
+    @pithos_test_settings(BACKEND_BLOCK_READAHEAD=3)
+    def test_get_readahead(self):
+        cname = self.containers[0]
+        oname, odata = self.upload_object(
+            cname, length=10 * TEST_BLOCK_SIZE + 100)[:-1]
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+        r = self.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, odata)
+
+        r = self.get(url, HTTP_RANGE='bytes=1500-7000')
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.content, odata[1500:7001])
+
+        r = self.get(url, HTTP_RANGE='bytes=0-99,3000-5999,-2000')
+        self.assertEqual(r.status_code, 206)
+        p = re.compile(
+            'multipart/byteranges; boundary=(?P<boundary>[0-9a-f]{32}\Z)',
+            re.I)
+        boundary = p.match(r['content-type']).groupdict()['boundary']
+        cparts = r.content.split('--%s' % boundary)[1:-1]
+        self.assertEqual(len(cparts), 3)
+        expected = [odata[:100], odata[3000:6000], odata[-2000:]]
+        for cpart, fdata in zip(cparts, expected):
+            sdata = '\r\n'.join(cpart.split('\r\n')[4:-1])
+            self.assertEqual(sdata, fdata)
+
+    @pithos_test_settings(BACKEND_BLOCK_READAHEAD=3,
+                          BACKEND_BLOCK_READAHEAD_MAX_MEMORY=0)
+    def test_get_readahead_memory_limit(self):
+        cname = self.containers[0]
+        oname, odata = self.upload_object(
+            cname, length=4 * TEST_BLOCK_SIZE)[:-1]
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+        with patch('pithos.api.util.get_readahead_pool') as pool:
+            r = self.get(url)
+            self.assertFalse(pool.called)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, odata)
+
     def test_multiple_range_not_satisfiable(self):
         # perform get with multiple range
         cname = self.containers[0]
@@ -704,6 +774,63 @@ class ObjectPut(PithosAPITest):
         self.assertEqual(r.status_code, 200)
         self.assertEqual(r.content, data)
 
+    @pithos_test_settings(BACKEND_UPLOAD_PIPELINE=2)
+    def test_upload_pipelined(self):
+        cname = self.container
+        oname = get_random_name()
+        data = get_random_data(length=5 * TEST_BLOCK_SIZE + 10)
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+        r = self.put(url, data=data)
+        self.assertEqual(r.status_code, 201)
+
+        info = self.get_object_info(cname, oname)
+        self.assertEqual(info['X-Object-Hash'], merkle(data))
+
+        r = self.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, data)
+
+    def test_hashmap_md5_cache(self):
+        cname = self.container
+        oname, data = self.upload_object(
+            cname, length=3 * TEST_BLOCK_SIZE + 10)[:-1]
+        url = join_urls(self.pithos_path, self.user, cname, oname)
+        r = self.get('%s?hashmap=&format=json' % url)
+        self.assertEqual(r.status_code, 200)
+        d = json.loads(r.content)
+
+        backend = get_backend()
+        try:
+            self.assertEqual(hashmap_top_hash(backend, d['hashes']),
+                             merkle(data))
+            with patch('pithos.api.util.get_md5_cache',
+                       return_value=MD5Cache(10)):
+                with patch.object(backend, 'get_block',
+                                  wraps=backend.get_block) as get_block:
+                    self.assertEqual(
+                        hashmap_md5(backend, d['hashes'], d['bytes']),
+                        md5_hash(data))
+                    self.assertEqual(get_block.call_count, len(d['hashes']))
+
+                    # The same hashmap and size is never read again.
+                    get_block.reset_mock()
+                    self.assertEqual(
+                        hashmap_md5(backend, d['hashes'], d['bytes']),
+                        md5_hash(data))
+                    self.assertFalse(get_block.called)
+        finally:
+            backend.close()
+
+    def test_md5_cache_eviction(self):
+        cache = MD5Cache(2)
+        cache.put(('a', 1), 'x')
+        cache.put(('b', 1), 'y')
+        self.assertEqual(cache.get(('a', 1)), 'x')
+        cache.put(('c', 1), 'z')
+        self.assertEqual(cache.get(('b', 1)), None)
+        self.assertEqual(cache.get(('a', 1)), 'x')
+        self.assertEqual(cache.get(('c', 1)), 'z')
+
     def test_maximum_upload_size_exceeds(self):
         cname = self.container
         oname = get_random_name()
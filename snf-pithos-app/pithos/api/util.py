@@ -15,6 +15,8 @@
 
 from functools import wraps
 from datetime import datetime
+from collections import defaultdict, deque, OrderedDict
+from threading import Lock
 from urllib import quote, unquote, urlencode
 from urlparse import urlunsplit, urlsplit, parse_qsl
 
@@ -34,9 +36,14 @@ from snf_django.lib import api
 from snf_django.lib.api import faults, utils
 
 from pithos.api.settings import (BACKEND_DB_MODULE, BACKEND_DB_CONNECTION,
+                                 BACKEND_DB_POOL_SIZE,
+                                 BACKEND_DB_POOL_MAX_OVERFLOW,
+                                 BACKEND_DB_POOL_TIMEOUT,
+                                 BACKEND_DB_POOL_PRE_PING,
+                                 BACKEND_BATCH_COMMISSIONS,
                                  BACKEND_BLOCK_MODULE,
                                  BACKEND_QUEUE_MODULE, BACKEND_QUEUE_HOSTS,
-                                 BACKEND_QUEUE_EXCHANGE,
+                                 BACKEND_QUEUE_EXCHANGE, BACKEND_QUEUE_ASYNC,
                                  ASTAKOSCLIENT_POOLSIZE,
                                  SERVICE_TOKEN,
                                  ASTAKOS_AUTH_URL,
@@ -49,14 +56,19 @@ from pithos.api.settings import (BACKEND_DB_MODULE, BACKEND_DB_CONNECTION,
                                  BACKEND_XSEG_POOL_SIZE,
                                  BACKEND_MAP_CHECK_INTERVAL,
                                  BACKEND_MAPFILE_PREFIX,
+                                 BACKEND_BLOCK_CACHE_SIZE,
+                                 BACKEND_BLOCK_CACHE_DISK_PATH,
+                                 BACKEND_BLOCK_CACHE_DISK_SIZE,
                                  RADOS_STORAGE, RADOS_POOL_BLOCKS,
                                  RADOS_POOL_MAPS, TRANSLATE_UUIDS,
                                  PUBLIC_URL_SECURITY, PUBLIC_URL_ALPHABET,
                                  BASE_HOST, UPDATE_MD5, VIEW_PREFIX,
                                  OAUTH2_CLIENT_CREDENTIALS, UNSAFE_DOMAIN)
 
+from pithos.api import settings
 from pithos.api.resources import resources
 from pithos.backends import connect_backend
+from pithos.backends.hashmap import TreeHash
 from pithos.backends.base import (NotAllowedError, QuotaError, ItemNotExists,
                                   VersionNotExists, IllegalOperationError)
 
@@ -68,6 +80,7 @@ from astakosclient.errors import NoUserName, NoUUID, AstakosClientException
 import logging
 import re
 import hashlib
+import binascii
 import uuid
 import decimal
 
@@ -712,27 +725,37 @@ def raw_input_socket(request):
 MAX_UPLOAD_SIZE = 5 * (1024 * 1024 * 1024)  # 5GB
 
 
-def socket_read_iterator(request, length=0, blocksize=4096):
-    """Return maximum of blocksize data read from the socket in each iteration
+def socket_read_iterator(request, length=0, blocksize=None):
+    """Return blocksize data read from the socket in each iteration
 
     Read up to 'length'. If 'length' is negative, will attempt a chunked read.
     The maximum ammount of data read is controlled by MAX_UPLOAD_SIZE.
+    All blocks but the last are exactly blocksize long, which defaults to
+    the backend block size.
     """
 
+    # Reads never cross block boundaries, so blocks are never sliced.
+    # Data is accumulated with '+=' on a local, which CPython resizes in place.
     sock = raw_input_socket(request)
+    blocksize = blocksize or request.backend.block_size
+    data = ''
     if length < 0:  # Chunked transfers
         # Small version (server does the dechunking).
         if (request.environ.get('mod_wsgi.input_chunked', None)
                 or request.META['SERVER_SOFTWARE'].startswith('gunicorn')):
             while length < MAX_UPLOAD_SIZE:
-                data = sock.read(blocksize)
-                if data == '':
+                chunk = sock.read(blocksize - len(data))
+                if chunk == '':
+                    if len(data) > 0:
+                        yield data
                     return
-                yield data
+                data += chunk
+                if len(data) == blocksize:
+                    yield data
+                    data = ''
             raise faults.BadRequest('Maximum size is reached')
 
         # Long version (do the dechunking).
-        data = ''
         while length < MAX_UPLOAD_SIZE:
             # Get chunk size.
             if hasattr(sock, 'readline'):
@@ -757,26 +780,66 @@ def socket_read_iterator(request, length=0, blocksize=4096):
                 return
             # Get the actual data.
             while chunk_length > 0:
-                chunk = sock.read(min(chunk_length, blocksize))
+                chunk = sock.read(min(chunk_length, blocksize - len(data)))
+                if not chunk:
+                    raise faults.BadRequest()
                 chunk_length -= len(chunk)
                 if length > 0:
                     length += len(chunk)
                 data += chunk
-                if len(data) >= blocksize:
-                    ret = data[:blocksize]
-                    data = data[blocksize:]
-                    yield ret
+                if len(data) == blocksize:
+                    yield data
+                    data = ''
             sock.read(2)  # CRLF
         raise faults.BadRequest('Maximum size is reached')
     else:
         if length > MAX_UPLOAD_SIZE:
             raise faults.BadRequest('Maximum size is reached')
         while length > 0:
-            data = sock.read(min(length, blocksize))
-            if not data:
+            chunk = sock.read(min(length, blocksize - len(data)))
+            if not chunk:
                 raise faults.BadRequest()
-            length -= len(data)
-            yield data
+            length -= len(chunk)
+            data += chunk
+            if len(data) == blocksize or length == 0:
+                yield data
+                data = ''
+
+
+def put_block_iterator(request, blocks, tree=None):
+    """Store each of the given blocks and yield (data, hash) in order.
+
+    If BACKEND_UPLOAD_PIPELINE is set, up to that many blocks are hashed
+    and stored concurrently by the upload pool, while the next ones are
+    being read.
+
+    If a TreeHash is given, the hashes are also added to it, so that
+    the top hash is computed as the blocks arrive.
+    """
+
+    for data, block_hash in _put_blocks(request.backend, blocks):
+        if tree is not None:
+            tree.update(binascii.unhexlify(block_hash))
+        yield data, block_hash
+
+
+def _put_blocks(backend, blocks):
+    depth = settings.BACKEND_UPLOAD_PIPELINE
+    if depth <= 0:
+        for data in blocks:
+            yield data, backend.put_block(data)
+        return
+
+    pool = get_upload_pool()
+    pending = deque()
+    for data in blocks:
+        if len(pending) >= depth:
+            done, result = pending.popleft()
+            yield done, result.get()
+        pending.append((data, pool.submit(backend.put_block, data)))
+    while pending:
+        done, result = pending.popleft()
+        yield done, result.get()
 
 
 class SaveToBackendHandler(FileUploadHandler):
@@ -789,7 +852,9 @@ class SaveToBackendHandler(FileUploadHandler):
     def put_data(self, length):
         if len(self.data) >= length:
             block = self.data[:length]
-            self.file.hashmap.append(self.backend.put_block(block))
+            block_hash = self.backend.put_block(block)
+            self.file.hashmap.append(block_hash)
+            self.tree.update(binascii.unhexlify(block_hash))
             self.checksum_compute.update(block)
             self.data = self.data[length:]
 
@@ -801,6 +866,7 @@ class SaveToBackendHandler(FileUploadHandler):
             name=file_name, content_type=content_type, charset=charset)
         self.file.size = 0
         self.file.hashmap = []
+        self.tree = TreeHash(self.backend.hash_algorithm)
 
     def receive_data_chunk(self, raw_data, start):
         self.data += raw_data
@@ -813,6 +879,7 @@ class SaveToBackendHandler(FileUploadHandler):
         if l > 0:
             self.put_data(l)
         self.file.etag = self.checksum_compute.hexdigest()
+        self.file.top_hash = binascii.hexlify(self.tree.hash())
         return self.file
 
 
@@ -821,9 +888,19 @@ class ObjectWrapper(object):
 
     Read from the object using the offset and length provided
     in each entry of the range list.
+
+    The blocks covering all the ranges are planned in advance, so that
+    a block needed by more than one range (or more than once in a range)
+    is fetched only once and kept until its last use, as long as no more
+    than max_kept blocks are kept at a time.
+
+    If readahead is set, up to that many of the planned blocks following
+    the one being served are fetched concurrently, through the readahead
+    pool.
     """
 
-    def __init__(self, backend, ranges, sizes, hashmaps, boundary, meta):
+    def __init__(self, backend, ranges, sizes, hashmaps, boundary, meta,
+                 readahead=0, readahead_pool=None, max_kept=0):
         self.backend = backend
         self.ranges = ranges
         self.sizes = sizes
@@ -840,9 +917,91 @@ class ObjectWrapper(object):
         self.range_index = -1
         self.offset, self.length = self.ranges[0]
 
+        self.readahead = readahead if readahead_pool is not None else 0
+        self.readahead_pool = readahead_pool
+        self.prefetched = {}
+
+        self.max_kept = max_kept
+        self.kept = {}
+        self.plan, self.uses = self._plan()
+        self.plan_index = 0
+
     def __iter__(self):
         return self
 
+    def close(self):
+        self.prefetched.clear()
+        self.kept.clear()
+
+    def _plan(self):
+        """Return the hashes of the blocks in the order they are served,
+        and the number of times each block is served.
+        """
+
+        bs = self.backend.block_size
+        plan = []
+        uses = defaultdict(int)
+        last_hash = self.block_hash
+        for offset, length in self.ranges:
+            file_index = 0
+            while length > 0:
+                file_size = self.sizes[file_index]
+                if offset >= file_size:
+                    offset -= file_size
+                    file_index += 1
+                    continue
+                block_hash = self.hashmaps[file_index][int(offset / bs)]
+                if block_hash != last_hash:
+                    plan.append(block_hash)
+                    uses[block_hash] += 1
+                    last_hash = block_hash
+                bl = min(length, bs - offset % bs, file_size - offset)
+                offset += bl
+                length -= bl
+        return plan, uses
+
+    def _get_block(self, block_hash):
+        result = self.prefetched.pop(block_hash, None)
+        try:
+            if result is not None:
+                return result.get()
+            return self.backend.get_block(block_hash)
+        except ItemNotExists:
+            raise faults.ItemNotFound('Block does not exist')
+
+    def _fetch(self, block_hash):
+        """Return the data of the block, fetching it if not kept."""
+
+        if (self.plan_index < len(self.plan) and
+                self.plan[self.plan_index] == block_hash):
+            self.plan_index += 1
+        data = self.kept.pop(block_hash, None)
+        if data is None:
+            data = self._get_block(block_hash)
+            if self.readahead:
+                self._prefetch()
+
+        uses = self.uses.pop(block_hash, 1) - 1
+        if uses > 0 and len(self.kept) < self.max_kept:
+            self.kept[block_hash] = data
+            self.uses[block_hash] = uses
+        return data
+
+    def _prefetch(self):
+        """Schedule fetching the next planned blocks."""
+
+        hashes = self.plan[self.plan_index:self.plan_index + self.readahead]
+        # Forget about blocks that fell out of the window.
+        for block_hash in self.prefetched.keys():
+            if block_hash not in hashes:
+                del(self.prefetched[block_hash])
+        for block_hash in hashes:
+            if (block_hash in self.prefetched or block_hash in self.kept or
+                    block_hash == self.block_hash):
+                continue
+            self.prefetched[block_hash] = self.readahead_pool.submit(
+                self.backend.get_block, block_hash)
+
     def part_iterator(self):
         if self.length > 0:
             # Get the file for the current offset.
@@ -858,10 +1017,7 @@ class ObjectWrapper(object):
                     self.hashmaps[self.file_index][self.block_index]:
                 self.block_hash = self.hashmaps[
                     self.file_index][self.block_index]
-                try:
-                    self.block = self.backend.get_block(self.block_hash)
-                except ItemNotExists:
-                    raise faults.ItemNotFound('Block does not exist')
+                self.block = self._fetch(self.block_hash)
 
             # Get the data from the block.
             bo = self.offset % self.backend.block_size
@@ -945,8 +1101,20 @@ def object_data_response(request, sizes, hashmaps, meta, public=False):
         boundary = uuid.uuid4().hex
     else:
         boundary = ''
+    readahead = min(settings.BACKEND_BLOCK_READAHEAD,
+                    settings.BACKEND_BLOCK_READAHEAD_MAX_MEMORY /
+                    request.backend.block_size)
+    if readahead > 0:
+        readahead_pool = get_readahead_pool()
+    else:
+        readahead_pool = None
+    # Blocks shared by the ranges are kept within the read-ahead memory limit.
+    max_kept = (settings.BACKEND_BLOCK_READAHEAD_MAX_MEMORY /
+                request.backend.block_size) if len(ranges) > 1 else 0
     wrapper = ObjectWrapper(request.backend, ranges, sizes, hashmaps,
-                            boundary, meta)
+                            boundary, meta, readahead=readahead,
+                            readahead_pool=readahead_pool,
+                            max_kept=max_kept)
     response = HttpResponse(wrapper, status=ret)
     put_object_headers(
         response, meta, restricted=public,
@@ -985,11 +1153,77 @@ def put_object_block(request, hashmap, data, offset, is_snapshot):
         hashmap.append(request.backend.put_block(('\x00' * bo) + data[:bl]))
     return bl  # Return ammount of data written.
 
-def hashmap_md5(backend, hashmap, size):
+class MD5Cache(object):
+    """A bounded cache of object MD5 sums, keyed by (top hash, size).
+
+    Objects with the same hashmap and size have the same data, so entries
+    never need to be invalidated. The least recently used are evicted.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._sums = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            checksum = self._sums.pop(key, None)
+            if checksum is not None:
+                self._sums[key] = checksum
+            return checksum
+
+    def put(self, key, checksum):
+        if self.size <= 0 or not checksum:
+            return
+        with self._lock:
+            self._sums.pop(key, None)
+            self._sums[key] = checksum
+            while len(self._sums) > self.size:
+                self._sums.popitem(last=False)
+
+
+_md5_cache = None
+
+
+def get_md5_cache():
+    global _md5_cache
+    if _md5_cache is None:
+        _md5_cache = MD5Cache(settings.UPDATE_MD5_CACHE_SIZE)
+    return _md5_cache
+
+
+def hashmap_top_hash(backend, hashmap):
+    """Return the (hex) top hash of the hashmap."""
+
+    tree = TreeHash(backend.hash_algorithm)
+    tree.extend(binascii.unhexlify(x) for x in hashmap)
+    return binascii.hexlify(tree.hash())
+
+
+def remember_hashmap_md5(top_hash, size, checksum):
+    """Cache the MD5 sum of an object computed while uploading it."""
+
+    get_md5_cache().put((top_hash, size), checksum)
+
+
+def cached_hashmap_md5(backend, hashmap, size, top_hash=None):
+    """Return the cached MD5 sum of the data in the hashmap, or None."""
+
+    if top_hash is None:
+        top_hash = hashmap_top_hash(backend, hashmap)
+    return get_md5_cache().get((top_hash, size))
+
+
+def hashmap_md5(backend, hashmap, size, top_hash=None):
     """Produce the MD5 sum from the data in the hashmap."""
 
-    # TODO: Search backend for the MD5 of another object
-    #       with the same hashmap and size...
+    if top_hash is None:
+        top_hash = hashmap_top_hash(backend, hashmap)
+    cache = get_md5_cache()
+    checksum = cache.get((top_hash, size))
+    if checksum is not None:
+        return checksum
+
     md5 = hashlib.md5()
     bs = backend.block_size
     for bi, hash in enumerate(hashmap):
@@ -997,7 +1231,38 @@ def hashmap_md5(backend, hashmap, size):
         if bi == len(hashmap) - 1:
             data = data[:size % bs]
         md5.update(data)
-    return md5.hexdigest().lower()
+    checksum = md5.hexdigest().lower()
+    cache.put((top_hash, size), checksum)
+    return checksum
+
+
+def _update_hashmap_md5(user, account, container, name, version, hashmap,
+                        size, top_hash):
+    backend = get_backend()
+    try:
+        checksum = hashmap_md5(backend, hashmap, size, top_hash)
+        backend.update_object_checksum(user, account, container, name,
+                                       version, checksum)
+    except:
+        logger.exception("Failed to update the checksum of %s/%s/%s",
+                         account, container, name)
+    finally:
+        backend.close()
+
+
+def update_hashmap_md5_async(request, account, container, name, version,
+                             hashmap, size, top_hash):
+    """Compute the MD5 sum of an object version in the background.
+
+    The checksum is set once the request has been committed, by a worker
+    with a backend of its own.
+    """
+
+    def task():
+        get_md5_pool().submit(_update_hashmap_md5, request.user_uniq,
+                              account, container, name, version,
+                              list(hashmap), size, top_hash)
+    request.deferred_tasks.append(task)
 
 
 def simple_list_response(request, l):
@@ -1009,7 +1274,7 @@ def simple_list_response(request, l):
         return json.dumps(l)
 
 
-from pithos.backends.util import PithosBackendPool
+from pithos.backends.util import PithosBackendPool, WorkerPool
 
 if RADOS_STORAGE:
     BLOCK_PARAMS = {'mappool': RADOS_POOL_MAPS,
@@ -1027,6 +1292,7 @@ BACKEND_KWARGS = dict(
     queue_module=BACKEND_QUEUE_MODULE,
     queue_hosts=BACKEND_QUEUE_HOSTS,
     queue_exchange=BACKEND_QUEUE_EXCHANGE,
+    queue_async=BACKEND_QUEUE_ASYNC,
     astakos_auth_url=ASTAKOS_AUTH_URL,
     service_token=SERVICE_TOKEN,
     astakosclient_poolsize=ASTAKOSCLIENT_POOLSIZE,
@@ -1040,7 +1306,15 @@ BACKEND_KWARGS = dict(
     archipelago_conf_file=BACKEND_ARCHIPELAGO_CONF,
     xseg_pool_size=BACKEND_XSEG_POOL_SIZE,
     map_check_interval=BACKEND_MAP_CHECK_INTERVAL,
-    mapfile_prefix=BACKEND_MAPFILE_PREFIX)
+    mapfile_prefix=BACKEND_MAPFILE_PREFIX,
+    block_cache_size=BACKEND_BLOCK_CACHE_SIZE,
+    block_cache_disk_path=BACKEND_BLOCK_CACHE_DISK_PATH,
+    block_cache_disk_size=BACKEND_BLOCK_CACHE_DISK_SIZE,
+    db_pool_size=BACKEND_DB_POOL_SIZE,
+    db_pool_max_overflow=BACKEND_DB_POOL_MAX_OVERFLOW,
+    db_pool_timeout=BACKEND_DB_POOL_TIMEOUT,
+    db_pool_pre_ping=BACKEND_DB_POOL_PRE_PING,
+    batch_commissions=BACKEND_BATCH_COMMISSIONS)
 
 _pithos_backend_pool = PithosBackendPool(size=BACKEND_POOL_SIZE,
                                          **BACKEND_KWARGS)
@@ -1056,6 +1330,36 @@ def get_backend():
     return backend
 
 
+_readahead_pool = None
+
+
+def get_readahead_pool():
+    global _readahead_pool
+    if _readahead_pool is None:
+        _readahead_pool = WorkerPool(settings.BACKEND_BLOCK_READAHEAD_WORKERS)
+    return _readahead_pool
+
+
+_upload_pool = None
+
+
+def get_upload_pool():
+    global _upload_pool
+    if _upload_pool is None:
+        _upload_pool = WorkerPool(settings.BACKEND_UPLOAD_WORKERS)
+    return _upload_pool
+
+
+_md5_pool = None
+
+
+def get_md5_pool():
+    global _md5_pool
+    if _md5_pool is None:
+        _md5_pool = WorkerPool(settings.UPDATE_MD5_WORKERS)
+    return _md5_pool
+
+
 def update_request_headers(request):
     # Handle URL-encoded keys and values.
     meta = dict([(
@@ -1103,6 +1407,7 @@ def api_method(http_method=None, token_required=True, user_required=True,
                 raise faults.BadRequest('Object name too large.')
 
             success_status = False
+            request.deferred_tasks = []
             try:
                 # Add a PithosBackend as attribute of the request object
                 request.backend = get_backend()
@@ -1119,8 +1424,18 @@ def api_method(http_method=None, token_required=True, user_required=True,
             finally:
                 # Always close PithosBackend connection
                 if getattr(request, "backend", None) is not None:
-                    request.backend.post_exec(success_status)
-                    request.backend.close()
+                    try:
+                        request.backend.post_exec(success_status)
+                    except QuotaError, e:
+                        # Batched commissions are issued at commit.
+                        raise faults.RequestEntityTooLarge(
+                            'Quota error: %s' % e)
+                    finally:
+                        request.backend.close()
+                # Run any tasks waiting for the request to be committed
+                if success_status:
+                    for task in request.deferred_tasks:
+                        task()
         return wrapper
     return decorator
 
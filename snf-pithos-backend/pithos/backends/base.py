@@ -391,16 +391,23 @@ class BaseBackend(object):
         """
         return []
 
-    def list_object_permissions(self, user, account, container, prefix=''):
+    def list_object_permissions(self, user, account, container, prefix='',
+                                names=None):
         """Return a list of paths enforce permissions under a container.
 
+        If names is not None, consider only the objects with these names.
+
         Raises:
             NotAllowedError: Operation not permitted
         """
         return []
 
-    def list_object_public(self, user, account, container, prefix=''):
-        """Return a mapping of object paths to public ids under a container."""
+    def list_object_public(self, user, account, container, prefix='',
+                           names=None):
+        """Return a mapping of object paths to public ids under a container.
+
+        If names is not None, consider only the objects with these names.
+        """
         return {}
 
     def get_object_meta(self, user, account, container, name, domain=None,
@@ -441,6 +448,21 @@ class BaseBackend(object):
         """
         return {}
 
+    def get_object_meta_bulk(self, user, account, container, names,
+                             domain=None, include_user_defined=True):
+        """Return a list of metadata dicts of the named objects.
+
+        The dicts have the keys returned by get_object_meta for the latest
+        version, in the order of names. Objects that do not exist, or that
+        the user is not allowed to read, are left out.
+
+        Raises:
+            ItemNotExists: Container does not exist
+
+            ValueError: if domain is None and include_user_defined==True
+        """
+        return []
+
     def update_object_meta(self, user, account, container, name, domain, meta,
                            replace=False):
         """Update object metadata for a domain and return the new version.
@@ -529,7 +551,8 @@ class BaseBackend(object):
 
     def update_object_hashmap(self, user, account, container, name, size, type,
                               hashmap, checksum, domain, meta=None,
-                              replace_meta=False, permissions=None):
+                              replace_meta=False, permissions=None,
+                              top_hash=None):
         """Create/update an object's hashmap and return the new version.
 
         Parameters:
@@ -541,6 +564,8 @@ class BaseBackend(object):
 
             'permissions': Updated object permissions
 
+            'top_hash': The (hex) top hash of the hashmap, if already known
+
         Raises:
             NotAllowedError: Operation not permitted
 
@@ -0,0 +1,190 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from threading import Lock
+from tempfile import TemporaryFile
+
+import mmap
+
+
+class DiskBlockCache(object):
+    """A fixed number of block slots in a memory mapped temporary file.
+
+    Slots are reused in least recently used order.
+    The file is removed when the cache is closed or the process exits.
+    """
+
+    def __init__(self, path, block_size, size):
+        self.block_size = block_size
+        self.nslots = size // block_size
+        if self.nslots < 1:
+            raise ValueError("Disk block cache smaller than a block")
+        self._file = TemporaryFile(dir=path)
+        self._file.truncate(self.nslots * block_size)
+        self._map = mmap.mmap(self._file.fileno(), self.nslots * block_size)
+        self._slots = OrderedDict()  # hash -> (slot, length)
+        self._free = range(self.nslots)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def get(self, key):
+        entry = self._slots.pop(key, None)
+        if entry is None:
+            return None
+        self._slots[key] = entry
+        slot, length = entry
+        offset = slot * self.block_size
+        return self._map[offset:offset + length]
+
+    def pop(self, key):
+        """Return the block with the given hash and free its slot."""
+        data = self.get(key)
+        if data is not None:
+            self._free.append(self._slots.pop(key)[0])
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.block_size:
+            return
+        entry = self._slots.pop(key, None)
+        if entry is not None:
+            slot = entry[0]
+        elif self._free:
+            slot = self._free.pop()
+        else:
+            slot = self._slots.popitem(last=False)[1][0]
+        offset = slot * self.block_size
+        self._map[offset:offset + len(data)] = data
+        self._slots[key] = (slot, len(data))
+
+    def close(self):
+        self._slots.clear()
+        self._map.close()
+        self._file.close()
+
+
+class BlockCache(object):
+    """A content addressed cache of blocks, bounded by size in bytes.
+
+    Blocks are keyed by their hash, so cached entries never need to be
+    invalidated. When the cache is full, the least recently used blocks are
+    evicted, to the disk tier if one is configured. Blocks found in the disk
+    tier move back to memory.
+    The cache is safe to use from multiple threads.
+    """
+
+    def __init__(self, size, block_size, disk_path=None, disk_size=0):
+        self.size = size
+        self.block_size = block_size
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._blocks = OrderedDict()
+        self._lock = Lock()
+        self.disk = None
+        if disk_path and disk_size:
+            self.disk = DiskBlockCache(disk_path, block_size, disk_size)
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __contains__(self, key):
+        return key in self._blocks
+
+    def get(self, key):
+        """Return the block with the given hash or None if not cached."""
+
+        with self._lock:
+            data = self._blocks.pop(key, None)
+            if data is not None:
+                self._blocks[key] = data
+                self.hits += 1
+                return data
+            if self.disk is not None:
+                data = self.disk.pop(key)
+                if data is not None:
+                    self.disk_hits += 1
+                    self._put(key, data)
+                    return data
+            self.misses += 1
+            return None
+
+    def put(self, key, data):
+        """Cache the block with the given hash."""
+
+        with self._lock:
+            self._put(key, data)
+
+    def _put(self, key, data):
+        if len(data) > self.size:
+            return
+        old = self._blocks.pop(key, None)
+        if old is not None:
+            self.used -= len(old)
+        self._blocks[key] = data
+        self.used += len(data)
+        while self.used > self.size:
+            k, v = self._blocks.popitem(last=False)
+            self.used -= len(v)
+            if self.disk is not None:
+                self.disk.put(k, v)
+
+    def stats(self):
+        """Return a dictionary with the cache counters."""
+
+        with self._lock:
+            return {'size': self.size,
+                    'used': self.used,
+                    'blocks': len(self._blocks),
+                    'disk_blocks': len(self.disk) if self.disk else 0,
+                    'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.used = 0
+
+    def close(self):
+        self.clear()
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+
+_shared_block_cache = None
+_shared_block_cache_lock = Lock()
+
+
+def get_shared_block_cache(size, block_size, disk_path=None, disk_size=0):
+    """Return the block cache shared by all the backends of the process.
+
+    The cache is created by the first call, with the given parameters.
+    """
+
+    global _shared_block_cache
+    with _shared_block_cache_lock:
+        if _shared_block_cache is None:
+            _shared_block_cache = BlockCache(size, block_size,
+                                             disk_path=disk_path,
+                                             disk_size=disk_size)
+        return _shared_block_cache
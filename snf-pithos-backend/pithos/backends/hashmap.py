@@ -0,0 +1,182 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Merkle tree hashing of object hashmaps.
+
+The top hash of a hashmap is the root of a binary tree, whose leaves are the
+block hashes, padded with zero hashes up to the next power of two. The top
+hash of a single block object is the block hash itself and the top hash of
+an empty object is the hash of the empty string.
+"""
+
+import hashlib
+
+
+class TreeHash(object):
+    """Compute the top hash of a hashmap, as block hashes arrive.
+
+    Only the roots of the complete subtrees seen so far are kept,
+    so memory is logarithmic to the number of blocks.
+    """
+
+    def __init__(self, blockhash):
+        self.blockhash = blockhash
+        self.count = 0
+        self._stack = []  # (level, hash) of complete subtrees
+        self._zeros = []  # hashes of all-zero subtrees, per level
+
+    def _hash_raw(self, v):
+        h = hashlib.new(self.blockhash)
+        h.update(v)
+        return h.digest()
+
+    def _zero(self, level):
+        zeros = self._zeros
+        while len(zeros) <= level:
+            z = zeros[-1]
+            zeros.append(self._hash_raw(z + z))
+        return zeros[level]
+
+    def update(self, block_hash):
+        """Add the hash of the next block."""
+
+        if not self._zeros:
+            self._zeros.append('\x00' * len(block_hash))
+        self.count += 1
+        level = 0
+        stack = self._stack
+        while stack and stack[-1][0] == level:
+            block_hash = self._hash_raw(stack.pop()[1] + block_hash)
+            level += 1
+        stack.append((level, block_hash))
+
+    def extend(self, block_hashes):
+        for block_hash in block_hashes:
+            self.update(block_hash)
+
+    def hash(self):
+        """Return the top hash of the blocks added so far."""
+
+        if self.count == 0:
+            return self._hash_raw('')
+        if self.count == 1:
+            return self._stack[0][1]
+
+        # Pad the rightmost subtrees with zero subtrees and merge them.
+        depth = (self.count - 1).bit_length()
+        stack = list(self._stack)
+        level, h = stack.pop()
+        while level < depth:
+            if stack and stack[-1][0] == level:
+                h = self._hash_raw(stack.pop()[1] + h)
+            else:
+                h = self._hash_raw(h + self._zero(level))
+            level += 1
+        return h
+
+
+class MerkleTree(object):
+    """Keep all the nodes of the tree of a hashmap.
+
+    The top hash can then be recomputed after updating or appending
+    a block, by rehashing only the path from that block to the root.
+    """
+
+    def __init__(self, blockhash, hashes=()):
+        self.blockhash = blockhash
+        self._levels = [list(hashes)]
+        self.count = len(self._levels[0])
+        self._build()
+
+    def _hash_raw(self, v):
+        h = hashlib.new(self.blockhash)
+        h.update(v)
+        return h.digest()
+
+    def _capacity(self):
+        return 1 << (self.count - 1).bit_length() if self.count > 1 else 1
+
+    def _build(self):
+        leaves = self._levels[0]
+        self._levels = [leaves]
+        if self.count < 2:
+            return
+        zero = '\x00' * len(leaves[0])
+        level = leaves + [zero] * (self._capacity() - self.count)
+        while len(level) > 1:
+            level = [self._hash_raw(level[x] + level[x + 1])
+                     for x in xrange(0, len(level), 2)]
+            self._levels.append(level)
+        self._levels[0] = leaves
+
+    def _node(self, depth, index):
+        level = self._levels[depth]
+        if index < len(level):
+            return level[index]
+        # Leaves are not padded in place.
+        return '\x00' * len(level[0])
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self._levels[0][index]
+
+    def update(self, index, block_hash):
+        """Replace the hash of the block at index and update the path."""
+
+        if index < 0 or index >= self.count:
+            raise IndexError('Block index out of range')
+        self._levels[0][index] = block_hash
+        if self.count < 2:
+            return
+        for depth in xrange(1, len(self._levels)):
+            index //= 2
+            self._levels[depth][index] = self._hash_raw(
+                self._node(depth - 1, 2 * index) +
+                self._node(depth - 1, 2 * index + 1))
+
+    def append(self, block_hash):
+        """Add a block at the end of the hashmap."""
+
+        capacity = self._capacity()
+        self._levels[0].append(block_hash)
+        self.count += 1
+        if self.count > capacity:
+            # The tree grows by one level.
+            self._build()
+        else:
+            self.update(self.count - 1, block_hash)
+
+    def hash(self):
+        """Return the top hash."""
+
+        if self.count == 0:
+            return self._hash_raw('')
+        return self._levels[-1][0]
+
+
+class HashMap(list):
+    """A list of block hashes, able to compute its top hash."""
+
+    def __init__(self, blocksize, blockhash):
+        super(HashMap, self).__init__()
+        self.blocksize = blocksize
+        self.blockhash = blockhash
+
+    def hash(self):
+        tree = TreeHash(self.blockhash)
+        tree.extend(self)
+        return tree.hash()
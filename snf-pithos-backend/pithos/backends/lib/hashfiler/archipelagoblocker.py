@@ -15,6 +15,7 @@
 
 from hashlib import new as newhasher
 from binascii import hexlify
+from collections import OrderedDict
 import ConfigParser
 
 from context_archipelago import ArchipelagoObject, file_sync_read_chunks
@@ -32,14 +33,20 @@ from pithos.workers import (
 monkey.patch_Request()
 
 
+DEFAULT_BATCH_SIZE = 128
+
+
 class ArchipelagoBlocker(object):
     """Blocker.
        Required constructor parameters: blocksize, hashtype.
+       Optional batch_size (the maximum number of requests in flight
+       when checking or storing many blocks at once).
     """
 
     blocksize = None
     blockpool = None
     hashtype = None
+    batch_size = DEFAULT_BATCH_SIZE
 
     def __init__(self, **params):
         cfg = ConfigParser.ConfigParser()
@@ -61,6 +68,7 @@ class ArchipelagoBlocker(object):
         self.hashtype = hashtype
         self.hashlen = len(emptyhash)
         self.emptyhash = emptyhash
+        self.batch_size = params.get('batch_size') or DEFAULT_BATCH_SIZE
 
     def _pad(self, block):
         return block + ('\x00' * (self.blocksize - len(block)))
@@ -70,18 +78,60 @@ class ArchipelagoBlocker(object):
         return ArchipelagoObject(name, self.ioctx_pool, self.dst_port, create)
 
     def _check_rear_block(self, blkhash):
-        filename = hexlify(blkhash)
+        return self._check_rear_blocks((blkhash,))[0]
+
+    def _submit_batched(self, get_request, items):
+        """Issue one request per item and return their success status.
+
+        Requests are created by get_request(ioctx, item) and are submitted
+        to a single ioctx in batches of at most batch_size, before waiting
+        for any of them, so that each batch costs a single round-trip.
+        """
+        results = []
         ioctx = self.ioctx_pool.pool_get()
-        req = Request.get_info_request(ioctx, self.dst_port, filename)
-        req.submit()
-        req.wait()
-        ret = req.success()
-        req.put()
-        self.ioctx_pool.pool_put(ioctx)
-        if ret:
-            return True
-        else:
-            return False
+        try:
+            for i in xrange(0, len(items), self.batch_size):
+                submitted = []
+                try:
+                    for item in items[i:i + self.batch_size]:
+                        req = get_request(ioctx, item)
+                        try:
+                            req.submit()
+                        except:
+                            req.put()
+                            raise
+                        submitted.append(req)
+                finally:
+                    for req in submitted:
+                        req.wait()
+                        results.append(req.success())
+                        req.put()
+        finally:
+            self.ioctx_pool.pool_put(ioctx)
+        return results
+
+    def _check_rear_blocks(self, blkhashes):
+        """Return a list with the existence status of each given block."""
+        dst_port = self.dst_port
+
+        def info_request(ioctx, blkhash):
+            return Request.get_info_request(ioctx, dst_port, hexlify(blkhash))
+
+        return self._submit_batched(info_request, blkhashes)
+
+    def _write_rear_blocks(self, blkhashes, blocks):
+        """Store each block under the corresponding hash."""
+        dst_port = self.dst_port
+
+        def write_request(ioctx, item):
+            blkhash, data = item
+            return Request.get_write_request(ioctx, dst_port,
+                                             hexlify(blkhash), data=data,
+                                             offset=0, datalen=len(data))
+
+        results = self._submit_batched(write_request, zip(blkhashes, blocks))
+        if not all(results):
+            raise IOError("archipelago: Write request error")
 
     def block_hash(self, data):
         """Hash a block of data"""
@@ -93,14 +143,9 @@ class ArchipelagoBlocker(object):
         """Check hashes for existence and
            return those missing from block storage.
         """
-        notfound = []
-        append = notfound.append
-
-        for h in hashes:
-            if h not in notfound and not self._check_rear_block(h):
-                append(h)
-
-        return notfound
+        hashes = OrderedDict.fromkeys(hashes).keys()
+        exists = self._check_rear_blocks(hashes)
+        return [h for h, e in zip(hashes, exists) if not e]
 
     def block_retr(self, hashes):
         """Retrieve blocks from storage by their hashes."""
@@ -171,11 +216,15 @@ class ArchipelagoBlocker(object):
         """
         block_hash = self.block_hash
         hashlist = [block_hash(b) for b in blocklist]
-        missing = [i for i, h in enumerate(hashlist) if not
-                   self._check_rear_block(h)]
-        for i in missing:
-            with self._get_rear_block(hashlist[i], 1) as rbl:
-                rbl.sync_write(blocklist[i])  # XXX: verify?
+        # Check and store each distinct block once.
+        unique = OrderedDict()
+        for i, h in enumerate(hashlist):
+            unique.setdefault(h, i)
+        exists = dict(zip(unique, self._check_rear_blocks(unique.keys())))
+        absent = [h for h in unique if not exists[h]]
+        self._write_rear_blocks(absent,
+                                [blocklist[unique[h]] for h in absent])
+        missing = [i for i, h in enumerate(hashlist) if not exists[h]]
 
         return hashlist, missing
 
@@ -13,13 +13,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import atexit
 import json
-from hashlib import sha1
-from random import random
+from threading import Lock
 from time import time
+from uuid import uuid4
 
 from synnefo.lib.amqp import AMQPClient
 
+from pithos.backends.util import BatchQueue
+
+PUBLISH_BATCH_SIZE = 100
+PUBLISH_MAX_BACKLOG = 10000
+PUBLISH_EXIT_TIMEOUT = 5
+
 
 class Message(object):
     def __init__(self, client, user, instance, resource, value, details={}):
@@ -32,34 +39,119 @@ class Message(object):
         self.resource = resource
         self.value = value
         self.details = details
-        hash = sha1()
-        hash.update(json.dumps(
-            [client, user, resource, value, details, random()]))
-        self.id = hash.hexdigest()
+        self.id = uuid4().hex
+
+
+class Publisher(object):
+    """Publish batches of messages to an exchange.
+
+    The connection is opened on the first batch and reopened on the
+    next one after a failure. A failed batch is retried as a whole, so
+    messages published before the failure may be published again; they
+    keep their ids, for consumers to tell the duplicates. Bodies come
+    serialized, so that only broker errors make a batch fail.
+    """
+
+    def __init__(self, hosts, exchange):
+        self.hosts = hosts
+        self.exchange = exchange
+        self.client = None
+
+    def __call__(self, batch):
+        if self.client is None:
+            client = AMQPClient(hosts=self.hosts)
+            client.connect()
+            client.exchange_declare(exchange=self.exchange, type='topic')
+            self.client = client
+        try:
+            for routing_key, body in batch:
+                self.client.basic_publish(exchange=self.exchange,
+                                          routing_key=routing_key,
+                                          body=body)
+            if self.client.confirms:
+                self.client.get_confirms()
+        except:
+            client, self.client = self.client, None
+            try:
+                client.close()
+            except Exception:
+                pass
+            raise
+
+
+_publishers = {}
+_publishers_lock = Lock()
+
+
+def get_publisher(hosts, exchange):
+    """Return the background publisher of the process for the exchange.
+
+    Messages still buffered when the process exits are given a few
+    seconds to go out.
+    """
+
+    key = (tuple(hosts), exchange)
+    with _publishers_lock:
+        publisher = _publishers.get(key)
+        if publisher is None:
+            publisher = BatchQueue(Publisher(hosts, exchange),
+                                   batch_size=PUBLISH_BATCH_SIZE,
+                                   max_backlog=PUBLISH_MAX_BACKLOG)
+            atexit.register(publisher.flush, PUBLISH_EXIT_TIMEOUT)
+            _publishers[key] = publisher
+        return publisher
 
 
 class Queue(object):
     """Queue.
        Required constructor parameters: hosts, exchange, client_id.
+       With async_publish, messages are published in batches by a
+       background thread shared by the queues of the process, instead
+       of synchronously by send.
     """
 
     def __init__(self, **params):
         hosts = params['hosts']
         self.exchange = params['exchange']
         self.client_id = params['client_id']
+        self.async_publish = params.get('async_publish', False)
+
+        if self.async_publish:
+            self.client = None
+            self.publisher = get_publisher(hosts, self.exchange)
+            return
 
+        self.publisher = None
         self.client = AMQPClient(hosts=hosts)
         self.client.connect()
 
         self.client.exchange_declare(exchange=self.exchange,
                                      type='topic')
 
+    @property
+    def backlog(self):
+        """The number of messages sent but not published yet."""
+        if self.publisher is None:
+            return 0
+        return self.publisher.backlog
+
+    @property
+    def dropped(self):
+        """The number of messages dropped because the backlog was full."""
+        if self.publisher is None:
+            return 0
+        return self.publisher.dropped
+
     def send(self, message_key, user, instance, resource, value, details):
-        body = Message(
-            self.client_id, user, instance, resource, value, details)
+        body = json.dumps(Message(
+            self.client_id, user, instance, resource, value, details).__dict__)
+        if self.publisher is not None:
+            self.publisher.put((message_key, body))
+            return
         self.client.basic_publish(exchange=self.exchange,
                                   routing_key=message_key,
-                                  body=json.dumps(body.__dict__))
+                                  body=body)
 
     def close(self):
-        self.client.close()
+        if self.client is not None:
+            self.client.close()
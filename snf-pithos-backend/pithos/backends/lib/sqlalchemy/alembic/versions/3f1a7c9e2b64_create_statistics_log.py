@@ -0,0 +1,45 @@
+"""create statistics_log table
+
+Revision ID: 3f1a7c9e2b64
+Revises: 5c2b5e3f8a1d
+Create Date: 2014-09-22 17:45:12.604219
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f1a7c9e2b64'
+down_revision = '5c2b5e3f8a1d'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'statistics_log',
+        sa.Column('serial', sa.Integer, primary_key=True),
+        sa.Column('node', sa.Integer,
+                  sa.ForeignKey('nodes.node', ondelete='CASCADE',
+                                onupdate='CASCADE'),
+                  nullable=False),
+        sa.Column('cluster', sa.Integer, nullable=False, default=0),
+        sa.Column('mtime', sa.DECIMAL(precision=16, scale=6),
+                  nullable=False),
+        sa.Column('population', sa.Integer, nullable=False, default=0),
+        sa.Column('size', sa.BigInteger, nullable=False, default=0),
+        mysql_engine='InnoDB')
+    op.create_index('idx_statistics_log_node_cluster_mtime',
+                    'statistics_log', ['node', 'cluster', 'mtime'])
+
+    # Start the log with the current statistics of the normal cluster.
+    op.execute("INSERT INTO statistics_log "
+               "(node, cluster, mtime, population, size) "
+               "SELECT node, cluster, mtime, population, size "
+               "FROM statistics "
+               "WHERE cluster = 0 AND mtime IS NOT NULL")
+
+
+def downgrade():
+    op.drop_index('idx_statistics_log_node_cluster_mtime',
+                  tablename='statistics_log')
+    op.drop_table('statistics_log')
@@ -0,0 +1,100 @@
+"""create listing table
+
+Revision ID: 5c2b5e3f8a1d
+Revises: f05c4de8cd7
+Create Date: 2014-09-15 12:03:41.276539
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c2b5e3f8a1d'
+down_revision = 'f05c4de8cd7'
+
+from alembic import op
+from collections import defaultdict
+
+import sqlalchemy as sa
+
+DELIMITER = '/'
+EXCEPT_CLUSTER = 2
+INSERT_BATCH = 10000
+
+
+def _level(path):
+    if path.endswith(DELIMITER):
+        path = path[:-len(DELIMITER)]
+    return path.count(DELIMITER)
+
+
+def _prefixes(parent_path, path):
+    dz = len(DELIMITER)
+    idx = path.find(DELIMITER, len(parent_path) + dz)
+    while idx >= 0 and idx + dz < len(path):
+        yield path[:idx + dz]
+        idx = path.find(DELIMITER, idx + dz)
+
+
+def upgrade():
+    op.create_table(
+        'listing',
+        sa.Column('node', sa.Integer,
+                  sa.ForeignKey('nodes.node', ondelete='CASCADE',
+                                onupdate='CASCADE'),
+                  primary_key=True),
+        sa.Column('path', sa.String(2048), primary_key=True),
+        sa.Column('is_prefix', sa.Boolean, primary_key=True),
+        sa.Column('level', sa.Integer, nullable=False, default=0),
+        sa.Column('population', sa.Integer, nullable=False, default=0),
+        mysql_engine='InnoDB')
+    op.create_index('idx_listing_node_level_path', 'listing',
+                    ['node', 'level', 'path'])
+
+    n = sa.sql.table(
+        'nodes',
+        sa.sql.column('node', sa.Integer),
+        sa.sql.column('parent', sa.Integer),
+        sa.sql.column('path', sa.String(2048)),
+        sa.sql.column('latest_version', sa.Integer))
+    v = sa.sql.table(
+        'versions',
+        sa.sql.column('serial', sa.Integer),
+        sa.sql.column('cluster', sa.Integer))
+    l = sa.sql.table(
+        'listing',
+        sa.sql.column('node', sa.Integer),
+        sa.sql.column('path', sa.String(2048)),
+        sa.sql.column('is_prefix', sa.Boolean),
+        sa.sql.column('level', sa.Integer),
+        sa.sql.column('population', sa.Integer))
+    p = n.alias('p')
+
+    # List the objects, i.e. the nodes under containers.
+    connection = op.get_bind()
+    s = sa.select([n.c.parent, n.c.path, p.c.path])
+    s = s.where(sa.and_(p.c.node == n.c.parent,
+                        p.c.path.like('%' + DELIMITER + '%'),
+                        v.c.serial == n.c.latest_version,
+                        v.c.cluster != EXCEPT_CLUSTER))
+    rows = []
+    populations = defaultdict(int)
+    for parent, path, parent_path in connection.execute(s):
+        rows.append({'node': parent, 'path': path, 'is_prefix': False,
+                     'level': _level(path), 'population': 1})
+        for prefix in _prefixes(parent_path, path):
+            populations[(parent, prefix)] += 1
+        if len(rows) >= INSERT_BATCH:
+            connection.execute(l.insert(), rows)
+            rows = []
+    for (parent, prefix), population in populations.iteritems():
+        rows.append({'node': parent, 'path': prefix, 'is_prefix': True,
+                     'level': _level(prefix), 'population': population})
+        if len(rows) >= INSERT_BATCH:
+            connection.execute(l.insert(), rows)
+            rows = []
+    if rows:
+        connection.execute(l.insert(), rows)
+
+
+def downgrade():
+    op.drop_index('idx_listing_node_level_path', tablename='listing')
+    op.drop_table('listing')
@@ -23,9 +23,13 @@ class DBWorker(object):
         self.params = params
         wrapper = params['wrapper']
         self.wrapper = wrapper
-        self.conn = wrapper.conn
         self.engine = wrapper.engine
 
+    @property
+    def conn(self):
+        # Pooled wrappers check out a different connection per request.
+        return self.wrapper.conn
+
     def escape_like(self, s, escape_char=ESCAPE_CHAR):
         return (s.replace(escape_char, escape_char * 2).
                 replace('%', escape_char + '%').
@@ -13,15 +13,110 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from threading import Lock
+from time import time
+
 from sqlalchemy import create_engine
-from sqlalchemy.pool import NullPool
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.pool import NullPool, QueuePool
 from sqlalchemy.interfaces import PoolListener
 
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Checkouts waiting longer than this (in seconds) are logged.
+SLOW_CHECKOUT = 1.0
+
+# The pool statistics are logged at most once per this many seconds.
+STATS_INTERVAL = 300
+
+
+class PingListener(PoolListener):
+    """Check that a pooled connection is alive before handing it out.
+
+    A dead connection is discarded and the pool retries with a new one.
+    """
+
+    def checkout(self, dbapi_con, con_record, con_proxy):
+        try:
+            cursor = dbapi_con.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except Exception, e:
+            logger.info("Discarding dead database connection: %s", e)
+            raise DisconnectionError()
+
+
+class PoolStats(object):
+    """Counters of the connection checkouts from a pooled engine."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.logged = time()
+        self._lock = Lock()
+
+    def add(self, wait):
+        """Count a checkout and return True if the stats are due to be
+        logged.
+        """
+
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            if wait > self.wait_max:
+                self.wait_max = wait
+            now = time()
+            if now - self.logged < STATS_INTERVAL:
+                return False
+            self.logged = now
+            return True
+
+    def get(self):
+        with self._lock:
+            avg = self.wait_total / self.checkouts if self.checkouts else 0
+            return {'checkouts': self.checkouts,
+                    'wait_total': self.wait_total,
+                    'wait_avg': avg,
+                    'wait_max': self.wait_max}
+
+
+_engines = {}
+_engines_lock = Lock()
+
+
+def _get_pooled_engine(db, pool_size, max_overflow, timeout, pre_ping):
+    """Return the engine (and its stats) shared by all the wrappers of the
+    process using the same connection string and pool parameters.
+    """
+
+    key = (db, pool_size, max_overflow, timeout, pre_ping)
+    with _engines_lock:
+        if key not in _engines:
+            listeners = [PingListener()] if pre_ping else []
+            engine = create_engine(
+                db, poolclass=QueuePool, pool_size=pool_size,
+                max_overflow=max_overflow, pool_timeout=timeout,
+                listeners=listeners, isolation_level='READ COMMITTED')
+            _engines[key] = (engine, PoolStats())
+        return _engines[key]
+
 
 class DBWrapper(object):
-    """Database connection wrapper."""
+    """Database connection wrapper.
 
-    def __init__(self, db):
+    By default the wrapper holds a dedicated connection for its lifetime.
+    If pool_size is set, connections come from a pool shared by the
+    wrappers of the process: a connection is checked out on first use
+    and returned to the pool by release().
+    """
+
+    def __init__(self, db, pool_size=0, pool_max_overflow=10,
+                 pool_timeout=30, pool_pre_ping=True):
+        self.pooled = False
+        self.stats = None
         if db.startswith('sqlite://'):
             class ForeignKeysListener(PoolListener):
                 def connect(self, dbapi_con, con_record):
@@ -34,18 +129,47 @@ class DBWrapper(object):
         #elif db.startswith('mysql://'):
         #    db = '%s?charset=utf8&use_unicode=0' %db
         #    self.engine = create_engine(db, convert_unicode=True)
+        elif pool_size:
+            self.engine, self.stats = _get_pooled_engine(
+                db, pool_size, pool_max_overflow, pool_timeout,
+                pool_pre_ping)
+            self.pooled = True
         else:
-            #self.engine = create_engine(db, pool_size=0, max_overflow=-1)
             self.engine = create_engine(
                 db, poolclass=NullPool, isolation_level='READ COMMITTED')
         self.engine.echo = False
         self.engine.echo_pool = False
-        self.conn = self.engine.connect()
+        self._conn = None
+        if not self.pooled:
+            self._conn = self.engine.connect()
         self.trans = None
 
+    @property
+    def conn(self):
+        if self._conn is None and self.pooled:
+            start = time()
+            self._conn = self.engine.connect()
+            wait = time() - start
+            due = self.stats.add(wait)
+            if wait > SLOW_CHECKOUT:
+                logger.warning("Waited %.3f seconds for a database "
+                               "connection (%s)", wait,
+                               self.engine.pool.status())
+            if due:
+                logger.info("Database pool stats: %s", self.pool_stats())
+        return self._conn
+
+    def release(self):
+        """Return the connection to the pool, if pooled."""
+
+        if self.pooled and self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
     def close(self):
-        self.conn.close()
-        self.conn = None
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
 
     def execute(self):
         self.trans = self.conn.begin()
@@ -57,3 +181,16 @@ class DBWrapper(object):
     def rollback(self):
         self.trans.rollback()
         self.trans = None
+
+    def pool_stats(self):
+        """Return the status of the connection pool, if pooled."""
+
+        if not self.pooled:
+            return None
+        pool = self.engine.pool
+        stats = self.stats.get()
+        stats.update({'size': pool.size(),
+                      'checkedin': pool.checkedin(),
+                      'checkedout': pool.checkedout(),
+                      'overflow': pool.overflow()})
+        return stats
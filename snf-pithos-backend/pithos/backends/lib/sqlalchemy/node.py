@@ -23,7 +23,7 @@ from sqlalchemy import (Table, Integer, BigInteger, DECIMAL, Boolean,
 from sqlalchemy.schema import Index, Sequence
 from sqlalchemy.sql import (func, and_, or_, not_, select, bindparam, exists,
                             functions)
-from sqlalchemy.sql.expression import true, literal
+from sqlalchemy.sql.expression import true, false, literal
 from sqlalchemy.exc import NoSuchTableError, IntegrityError
 
 from dbworker import DBWorker, ESCAPE_CHAR
@@ -37,6 +37,19 @@ ROOTNODE = 0
 
 inf = float('inf')
 
+# The clusters of the latest, of the previous and of the deleted versions.
+(NORMAL_CLUSTER, HISTORY_CLUSTER, DELETED_CLUSTER) = (0, 1, 2)
+
+# Delimited listings of the latest versions that are not deleted
+# are served from the listing table, when it exists.
+LISTING_DELIMITER = '/'
+
+# Point in time statistics are logged for this many seconds. Past it, only
+# the last entry of each node is kept and older times are computed.
+STATISTICS_LOG_RETENTION = 30 * 24 * 3600
+# The log of a node is compacted on one in this many log entries.
+STATISTICS_LOG_COMPACT_EVERY = 100
+
 
 def strnextling(prefix):
     """Return the first unicode string
@@ -74,6 +87,29 @@ def strprevling(prefix):
     return s
 
 
+def listing_level(path, delimiter=LISTING_DELIMITER):
+    """Return the number of delimiters in path, except a trailing one.
+       Paths and common prefixes listed together have the same level.
+    """
+    if path.endswith(delimiter):
+        path = path[:-len(delimiter)]
+    return path.count(delimiter)
+
+
+def listing_prefixes(parent_path, path, delimiter=LISTING_DELIMITER):
+    """Return the common prefixes that path is listed under,
+       below the path of its parent.
+       listing_prefixes('a/c', 'a/c/d/e/f') -> ['a/c/d/', 'a/c/d/e/']
+    """
+    dz = len(delimiter)
+    prefixes = []
+    idx = path.find(delimiter, len(parent_path) + dz)
+    while idx >= 0 and idx + dz < len(path):
+        prefixes.append(path[:idx + dz])
+        idx = path.find(delimiter, idx + dz)
+    return prefixes
+
+
 def create_tables(engine):
     metadata = MetaData()
 
@@ -163,6 +199,38 @@ def create_tables(engine):
     Index('idx_attributes_domain', attributes.c.domain)
     Index('idx_attributes_serial_node', attributes.c.serial, attributes.c.node)
 
+    #create statistics_log table
+    columns = []
+    columns.append(Column('serial', Integer, primary_key=True))
+    columns.append(Column('node', Integer,
+                          ForeignKey('nodes.node',
+                                     ondelete='CASCADE',
+                                     onupdate='CASCADE'),
+                          nullable=False))
+    columns.append(Column('cluster', Integer, nullable=False, default=0))
+    columns.append(Column('mtime', DECIMAL(precision=16, scale=6),
+                          nullable=False))
+    columns.append(Column('population', Integer, nullable=False, default=0))
+    columns.append(Column('size', BigInteger, nullable=False, default=0))
+    statistics_log = Table('statistics_log', metadata, *columns,
+                           mysql_engine='InnoDB')
+    Index('idx_statistics_log_node_cluster_mtime', statistics_log.c.node,
+          statistics_log.c.cluster, statistics_log.c.mtime)
+
+    #create listing table
+    columns = []
+    columns.append(Column('node', Integer,
+                          ForeignKey('nodes.node',
+                                     ondelete='CASCADE',
+                                     onupdate='CASCADE'),
+                          primary_key=True))
+    columns.append(Column('path', String(2048), primary_key=True))
+    columns.append(Column('is_prefix', Boolean, primary_key=True))
+    columns.append(Column('level', Integer, nullable=False, default=0))
+    columns.append(Column('population', Integer, nullable=False, default=0))
+    listing = Table('listing', metadata, *columns, mysql_engine='InnoDB')
+    Index('idx_listing_node_level_path', listing.c.node, listing.c.level,
+          listing.c.path)
 
     # TODO: handle backends not supporting sequences
     mapfile_seq = Sequence('mapfile_seq', metadata=metadata)
@@ -182,6 +250,10 @@ class Node(DBWorker):
     def __init__(self, **params):
         self._props = params.pop('props')
         self.mapfile_prefix = params.pop('mapfile_prefix', 'snf_file_')
+        self.statistics_log_retention = params.pop(
+            'statistics_log_retention', STATISTICS_LOG_RETENTION)
+        self.statistics_log_compact_every = params.pop(
+            'statistics_log_compact_every', STATISTICS_LOG_COMPACT_EVERY)
         DBWorker.__init__(self, **params)
         try:
             metadata = MetaData(self.engine)
@@ -194,6 +266,18 @@ class Node(DBWorker):
         except NoSuchTableError:
             tables = create_tables(self.engine)
             map(lambda t: self.__setattr__(t.name, t), tables)
+        else:
+            try:
+                self.listing = Table('listing', metadata, autoload=True)
+            except NoSuchTableError:
+                # Not migrated yet, delimited listings scan the paths.
+                self.listing = None
+            try:
+                self.statistics_log = Table('statistics_log', metadata,
+                                            autoload=True)
+            except NoSuchTableError:
+                # Not migrated yet, statistics are computed by scanning.
+                self.statistics_log = None
 
         s = self.nodes.select().where(and_(self.nodes.c.node == ROOTNODE,
                                            self.nodes.c.parent == ROOTNODE))
@@ -244,19 +328,24 @@ class Node(DBWorker):
             return row[0]
         return None
 
-    def node_lookup_bulk(self, paths):
+    def node_lookup_bulk(self, paths, with_paths=False):
         """Lookup the current nodes for the given paths.
            Return () if the path is not found.
+           If with_paths is True, return a dictionary of path: node
+           for the paths found instead.
         """
 
         if not paths:
-            return ()
+            return {} if with_paths else ()
         # Use LIKE for comparison to avoid MySQL problems with trailing spaces.
-        s = select([self.nodes.c.node], self.nodes.c.path.in_(paths))
+        s = select([self.nodes.c.path, self.nodes.c.node],
+                   self.nodes.c.path.in_(paths))
         r = self.conn.execute(s)
         rows = r.fetchall()
         r.close()
-        return [row[0] for row in rows]
+        if with_paths:
+            return dict((row[0], row[1]) for row in rows)
+        return [row[1] for row in rows]
 
     def node_get_properties(self, node):
         """Return the node's (parent, path).
@@ -374,6 +463,8 @@ class Node(DBWorker):
         r.close()
 
         #delete versions
+        self.listing_update(self.listing_get_nodes(
+            serials=select([self.versions.c.serial], where_clause)), {})
         s = self.versions.delete().where(where_clause)
         r = self.conn.execute(s)
         r.close()
@@ -431,6 +522,8 @@ class Node(DBWorker):
         r.close()
 
         #delete versions
+        self.listing_update(self.listing_get_nodes(
+            serials=select([self.versions.c.serial], where_clause)), {})
         s = self.versions.delete().where(where_clause)
         r = self.conn.execute(s)
         r.close()
@@ -450,6 +543,84 @@ class Node(DBWorker):
 
         return hashes, size, serials
 
+    def nodes_delete_latest(self, parent, serials, muser, remove=False,
+                            update_statistics_ancestors_depth=None):
+        """Delete the objects with the given latest versions under parent.
+           Each latest version is moved to the history cluster, or removed
+           if remove is True, and an empty version that keeps its mapfile
+           takes its place in the deleted cluster. Versions no longer latest
+           are skipped.
+           Return the hashes and the total size of the previous versions
+           and the serials of the new ones.
+        """
+
+        n = self.nodes
+        v = self.versions
+        s = select([v.c.serial, v.c.node, v.c.hash, v.c.size, v.c.uuid,
+                    v.c.available, v.c.map_check_timestamp,
+                    v.c.mapfile, v.c.is_snapshot])
+        s = s.where(and_(v.c.serial.in_(serials),
+                         v.c.cluster == NORMAL_CLUSTER,
+                         n.c.node == v.c.node,
+                         n.c.parent == parent,
+                         n.c.latest_version == v.c.serial))
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        if not rows:
+            return (), 0, ()
+        serials = [row.serial for row in rows]
+        nodes = [row.node for row in rows]
+        hashes = [row.hash for row in rows]
+        nr = len(rows)
+        size = sum(row.size for row in rows)
+        mtime = time()
+        listed = self.listing_get_nodes(serials=serials)
+
+        self.statistics_update(parent, -nr, -size, mtime, NORMAL_CLUSTER)
+        self.statistics_update_ancestors(parent, -nr, -size, mtime,
+                                         NORMAL_CLUSTER,
+                                         update_statistics_ancestors_depth)
+        if remove:
+            s = v.delete().where(v.c.serial.in_(serials))
+        else:
+            self.statistics_update(parent, nr, size, mtime, HISTORY_CLUSTER)
+            self.statistics_update_ancestors(
+                parent, nr, size, mtime, HISTORY_CLUSTER,
+                update_statistics_ancestors_depth)
+            s = v.update().where(v.c.serial.in_(serials))
+            s = s.values(cluster=HISTORY_CLUSTER)
+        self.conn.execute(s).close()
+
+        self.conn.execute(v.insert(), [
+            {'node': row.node, 'hash': None, 'size': 0, 'type': '',
+             'source': row.serial, 'mtime': mtime, 'muser': muser,
+             'uuid': row.uuid, 'checksum': '', 'cluster': DELETED_CLUSTER,
+             'available': row.available,
+             'map_check_timestamp': row.map_check_timestamp,
+             'mapfile': row.mapfile, 'is_snapshot': row.is_snapshot}
+            for row in rows]).close()
+        self.statistics_update(parent, nr, 0, mtime, DELETED_CLUSTER)
+        self.statistics_update_ancestors(parent, nr, 0, mtime,
+                                         DELETED_CLUSTER,
+                                         update_statistics_ancestors_depth)
+
+        latest = select([func.max(v.c.serial)], v.c.node == n.c.node)
+        s = n.update().where(n.c.node.in_(nodes))
+        s = s.values(latest_version=latest.as_scalar())
+        self.conn.execute(s).close()
+        s = self.attributes.update()
+        s = s.where(self.attributes.c.node.in_(nodes))
+        s = s.values(is_latest=False)
+        self.conn.execute(s).close()
+        self.listing_update(listed, {})
+
+        s = select([n.c.latest_version], n.c.node.in_(nodes))
+        r = self.conn.execute(s)
+        dest_serials = [row[0] for row in r.fetchall()]
+        r.close()
+        return hashes, size, dest_serials
+
     def node_remove(self, node, update_statistics_ancestors_depth=None):
         """Remove the node specified.
            Return false if the node has children or is not found.
@@ -471,6 +642,7 @@ class Node(DBWorker):
                 update_statistics_ancestors_depth)
         r.close()
 
+        self.listing_update(self.listing_get_nodes(node), {})
         s = self.nodes.delete().where(self.nodes.c.node == node)
         self.conn.execute(s).close()
         return True
@@ -637,6 +809,90 @@ class Node(DBWorker):
                              mtime=mtime, cluster=cluster)
             self.conn.execute(ins).close()
 
+        if (self.statistics_log is not None and cluster == NORMAL_CLUSTER and
+                mtime is not None):
+            ins = self.statistics_log.insert()
+            ins = ins.values(node=node, population=population, size=size,
+                             mtime=mtime, cluster=cluster)
+            rp = self.conn.execute(ins)
+            serial = rp.inserted_primary_key[0]
+            rp.close()
+            # Compact on a fraction of the entries, spread over the nodes
+            # in proportion to how often they change.
+            if not serial % self.statistics_log_compact_every:
+                self.statistics_log_compact(
+                    node, mtime - self.statistics_log_retention, cluster)
+
+    def statistics_log_compact(self, node, horizon, cluster=0):
+        """Remove the logged statistics of the node older than the horizon,
+           except for the last one before it.
+           Statistics before the remaining entries are computed.
+        """
+
+        l = self.statistics_log
+        s = select([func.max(l.c.serial)])
+        s = s.where(and_(l.c.node == node,
+                         l.c.cluster == cluster,
+                         l.c.mtime < horizon))
+        r = self.conn.execute(s)
+        serial = r.fetchone()[0]
+        r.close()
+        if serial is None:
+            return
+        d = l.delete().where(and_(l.c.node == node,
+                                  l.c.cluster == cluster,
+                                  l.c.mtime < horizon,
+                                  l.c.serial < serial))
+        self.conn.execute(d).close()
+
+    def statistics_log_get(self, node, before, cluster=0):
+        """Return population, total size and last mtime
+           for all versions under node that belonged to the cluster
+           just before the given time, or None if not logged.
+        """
+
+        l = self.statistics_log
+        s = select([l.c.population, l.c.size, l.c.mtime])
+        s = s.where(and_(l.c.node == node,
+                         l.c.cluster == cluster,
+                         l.c.mtime < before))
+        s = s.order_by(l.c.mtime.desc(), l.c.serial.desc()).limit(1)
+        r = self.conn.execute(s)
+        row = r.fetchone()
+        r.close()
+        return row
+
+    def _statistics_account_latest(self, node, mtime):
+        """Return population, total size and last mtime
+           for all latest versions under an account node
+           that are not deleted, from the statistics of its containers.
+        """
+
+        n = self.nodes.alias('n')
+        v = self.versions.alias('v')
+        s = select([func.count(v.c.serial), func.max(v.c.mtime)])
+        s = s.where(and_(n.c.parent == node,
+                         v.c.serial == n.c.latest_version,
+                         v.c.cluster != DELETED_CLUSTER))
+        r = self.conn.execute(s)
+        count, latest = r.fetchone()
+        r.close()
+        if not count:
+            return (0, 0, mtime)
+        mtime = max(mtime, latest)
+
+        st = self.statistics
+        s = select([func.sum(st.c.size), func.max(st.c.mtime)])
+        s = s.where(and_(st.c.node == n.c.node,
+                         st.c.cluster == NORMAL_CLUSTER,
+                         n.c.parent == node))
+        r = self.conn.execute(s)
+        size, latest = r.fetchone()
+        r.close()
+        if latest is not None:
+            mtime = max(mtime, latest)
+        return (count, size or 0, mtime)
+
     def statistics_update_ancestors(self, node, population, size, mtime,
                                     cluster=0, recursion_depth=None):
         """Update the statistics of the given node's parent.
@@ -704,6 +960,25 @@ class Node(DBWorker):
             return None
         mtime = props.mtime
 
+        # The latest versions not deleted are the normal cluster,
+        # whose statistics are kept up to date and logged.
+        # Object changes only update the statistics of their container,
+        # so those of an account are the sum of its containers.
+        if (self.statistics_log is not None and
+                except_cluster == DELETED_CLUSTER and node != ROOTNODE):
+            if parent != ROOTNODE:
+                if before == inf:
+                    r = self.statistics_get(node, NORMAL_CLUSTER)
+                    if r is None:
+                        return (0, 0, mtime)
+                else:
+                    r = self.statistics_log_get(node, before, NORMAL_CLUSTER)
+                if r is not None:
+                    return (r[0], r[1], max(mtime, r[2]))
+                # Before the first logged change, compute them.
+            elif before == inf:
+                return self._statistics_account_latest(node, mtime)
+
         # First level, just under node (get population).
         v = self.versions.alias('v')
         s = select([func.count(v.c.serial),
@@ -776,6 +1051,80 @@ class Node(DBWorker):
         s = s.values(latest_version=serial)
         self.conn.execute(s).close()
 
+    def listing_get_nodes(self, node=None, serials=None):
+        """Return a dictionary of node: (parent, path, parent path)
+           for the given node, or the nodes with the latest version
+           in serials, if they are listed in the listing table.
+        """
+
+        if self.listing is None:
+            return {}
+        n = self.nodes.alias('ln')
+        p = self.nodes.alias('lp')
+        v = self.versions.alias('lv')
+        s = select([n.c.node, n.c.parent, n.c.path, p.c.path])
+        s = s.where(and_(p.c.node == n.c.parent,
+                         v.c.serial == n.c.latest_version,
+                         v.c.cluster != DELETED_CLUSTER))
+        if node is not None:
+            s = s.where(n.c.node == node)
+        if serials is not None:
+            s = s.where(n.c.latest_version.in_(serials))
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return dict((row[0], row[1:]) for row in rows)
+
+    def listing_update(self, before, after):
+        """Update the listing table, given the listed nodes
+           before and after a change, as returned by listing_get_nodes.
+        """
+
+        if self.listing is None:
+            return
+        for node, props in before.iteritems():
+            if node not in after:
+                self._listing_update_path(-1, *props)
+        for node, props in after.iteritems():
+            if node not in before:
+                self._listing_update_path(1, *props)
+
+    def _listing_update_path(self, delta, parent, path, parent_path):
+        if LISTING_DELIMITER not in parent_path:
+            return  # Accounts and containers are not listed here.
+        l = self.listing
+        s = l.delete().where(and_(l.c.node == parent,
+                                  l.c.path == path,
+                                  l.c.is_prefix == false()))
+        self.conn.execute(s).close()
+        if delta > 0:
+            s = l.insert().values(node=parent, path=path, is_prefix=False,
+                                  level=listing_level(path), population=1)
+            self.conn.execute(s).close()
+
+        prefixes = listing_prefixes(parent_path, path)
+        for prefix in prefixes:
+            #insert or replace
+            #TODO better upsert
+            u = l.update().where(and_(l.c.node == parent,
+                                      l.c.path == prefix,
+                                      l.c.is_prefix == true()))
+            u = u.values(population=l.c.population + delta)
+            rp = self.conn.execute(u)
+            rp.close()
+            if rp.rowcount == 0 and delta > 0:
+                s = l.insert().values(node=parent, path=prefix,
+                                      is_prefix=True,
+                                      level=listing_level(prefix),
+                                      population=delta)
+                self.conn.execute(s).close()
+        if prefixes and delta < 0:
+            s = l.delete().where(and_(l.c.node == parent,
+                                      l.c.path.in_(prefixes),
+                                      l.c.is_prefix == true(),
+                                      l.c.population <= 0))
+            self.conn.execute(s).close()
+
     def version_create(self, node, hash, size, type, source, muser, uuid,
                        checksum, cluster=0,
                        update_statistics_ancestors_depth=None,
@@ -786,13 +1135,16 @@ class Node(DBWorker):
 
            If mapfile is not None, set mapfile to this value.
            Otherwise, assign to the mapfile a new unique identifier.
+           Empty versions have no mapfile, except for the deleted ones,
+           which keep the mapfile of the version they replace.
 
            :raises DatabaseError
         """
 
         mtime = time()
         if size == 0:
-            mapfile = None
+            if cluster != DELETED_CLUSTER:
+                mapfile = None
         elif mapfile is None:
             mapfile = functions.concat(literal(self.mapfile_prefix),
                                        functions.next_value(self.mapfile_seq))
@@ -807,6 +1159,7 @@ class Node(DBWorker):
             map_check_timestamp=map_check_timestamp,
             mapfile=mapfile,
             is_snapshot=is_snapshot)
+        listed = self.listing_get_nodes(node)
         r = self.conn.execute(s)
         serial, mtime, mapfile = r.fetchone()
         r.close()
@@ -814,6 +1167,7 @@ class Node(DBWorker):
                                          update_statistics_ancestors_depth)
 
         self.nodes_set_latest_version(node, serial)
+        self.listing_update(listed, self.listing_get_nodes(node))
 
         return serial, mtime, mapfile
 
@@ -960,10 +1314,12 @@ class Node(DBWorker):
         self.statistics_update_ancestors(node, 1, size, mtime, cluster,
                                          update_statistics_ancestors_depth)
 
+        listed = self.listing_get_nodes(node)
         s = self.versions.update()
         s = s.where(self.versions.c.serial == serial)
         s = s.values(cluster=cluster)
         self.conn.execute(s).close()
+        self.listing_update(listed, self.listing_get_nodes(node))
 
     def version_remove(self, serial, update_statistics_ancestors_depth=None):
         """Remove the serial specified."""
@@ -980,12 +1336,14 @@ class Node(DBWorker):
         self.statistics_update_ancestors(node, -1, -size, mtime, cluster,
                                          update_statistics_ancestors_depth)
 
+        listed = self.listing_get_nodes(node)
         s = self.versions.delete().where(self.versions.c.serial == serial)
         self.conn.execute(s).close()
 
         props = self.version_lookup(node, cluster=cluster, all_props=False)
         if props:
             self.nodes_set_latest_version(node, serial)
+        self.listing_update(listed, self.listing_get_nodes(node))
 
         return hash, size
 
@@ -1012,6 +1370,24 @@ class Node(DBWorker):
         r.close()
         return l
 
+    def attribute_get_bulk(self, serials, domain):
+        """Return a dictionary of serial: list of (key, value) pairs
+           of the specific versions.
+        """
+
+        attributes = defaultdict(list)
+        if not serials:
+            return attributes
+        attrs = self.attributes.alias()
+        s = select([attrs.c.serial, attrs.c.key, attrs.c.value])
+        s = s.where(and_(attrs.c.serial.in_(serials),
+                         attrs.c.domain == domain))
+        r = self.conn.execute(s)
+        for serial, key, value in r.fetchall():
+            attributes[serial].append((key, value))
+        r.close()
+        return attributes
+
     def attribute_set(self, serial, domain, node, items, is_latest=True):
         """Set the attributes of the version specified by serial.
            Receive attributes as an iterable of (key, value) pairs.
@@ -1289,6 +1665,13 @@ class Node(DBWorker):
             rp.close()
             return r, ()
 
+        if (self.listing is not None and delimiter == LISTING_DELIMITER and
+                before == inf and except_cluster == DELETED_CLUSTER and
+                not pathq and not (domain and filterq) and
+                not (sizeq and len(sizeq) == 2 and (sizeq[0] or sizeq[1]))):
+            return self._latest_version_list_indexed(s, parent, prefix,
+                                                     start, limit)
+
         pfz = len(prefix)
         dz = len(delimiter)
         count = 0
@@ -1326,6 +1709,82 @@ class Node(DBWorker):
 
         return matches, prefixes
 
+    def _latest_version_list_indexed(self, s, parent, prefix, start, limit):
+        """Return the results of a delimited latest_version_list
+           from the listing table, instead of scanning the paths.
+
+           The listing table keeps a row for each listed path and each
+           common prefix under parent, so that the paths and prefixes
+           listed together are a range of the same level. The versions
+           of the paths are then fetched with s, the query of the paths.
+        """
+
+        l = self.listing
+        dz = len(LISTING_DELIMITER)
+        matches = []
+        paths = []
+        prefixes = []
+
+        e = select([l.c.path]).where(and_(l.c.node == parent,
+                                          l.c.is_prefix == false()))
+        e = e.limit(1)
+
+        # A common prefix before start is listed,
+        # if there is a path after start under it.
+        idx = start.find(LISTING_DELIMITER, len(prefix))
+        if start.startswith(prefix) and 0 <= idx < len(start) - dz:
+            pf = start[:idx + dz]
+            rp = self.conn.execute(e.where(and_(l.c.path > start,
+                                                l.c.path < strnextling(pf))))
+            if rp.fetchone() is not None:
+                prefixes.append(pf)
+            rp.close()
+
+        # A path equal to the prefix is one level up.
+        if prefix.endswith(LISTING_DELIMITER) and prefix > start:
+            rp = self.conn.execute(e.where(l.c.path == prefix))
+            if rp.fetchone() is not None:
+                paths.append(prefix)
+            rp.close()
+
+        # Fetch the rows in pages, as the limit applies only to the paths.
+        # Pages start from the path of the last row, which has at most
+        # two rows, the path and the prefix, so they overlap by two rows.
+        page = limit + 2
+        q = select([l.c.path, l.c.is_prefix])
+        q = q.where(and_(l.c.node == parent,
+                         l.c.level == prefix.count(LISTING_DELIMITER),
+                         l.c.path >= bindparam('start'),
+                         l.c.path < strnextling(prefix)))
+        q = q.order_by(l.c.path, l.c.is_prefix).limit(page)
+        last = (start, False)
+        while len(paths) < limit:
+            rp = self.conn.execute(q, start=last[0])
+            rows = rp.fetchall()
+            rp.close()
+            for path, is_prefix in rows:
+                if (path, is_prefix) <= last:
+                    continue  # Already seen, or the object at start.
+                if is_prefix:
+                    prefixes.append(path)
+                    continue
+                paths.append(path)
+                if len(paths) >= limit:
+                    break
+            if len(rows) < page:
+                break
+            last = tuple(rows[-1])
+
+        if paths:
+            s = s.where(self.nodes.c.path.in_(paths))
+            rp = self.conn.execute(s, start=start)
+            matches = rp.fetchall()
+            rp.close()
+        if len(paths) >= limit:
+            prefixes = [pf for pf in prefixes if pf < paths[-1]]
+
+        return matches, prefixes
+
     def latest_uuid(self, uuid, cluster):
         """Return the latest version of the given uuid and cluster.
 
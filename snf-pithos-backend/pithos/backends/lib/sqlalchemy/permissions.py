@@ -166,6 +166,27 @@ class Permissions(XFeatures, Groups, Public, Node):
             return access_check_paths
         return None
 
+    def access_list_container(self, path):
+        """Return (path, key, value) for the permissions of the container
+           at path and of everything under it. Paths with a feature but
+           no members are returned with None key and value."""
+
+        xfeatures_xfeaturevals = self.xfeatures.outerjoin(
+            self.xfeaturevals,
+            self.xfeatures.c.feature_id == self.xfeaturevals.c.feature_id)
+        s = select([self.xfeatures.c.path,
+                    self.xfeaturevals.c.key,
+                    self.xfeaturevals.c.value],
+                   from_obj=[xfeatures_xfeaturevals])
+        s = s.where(or_(self.xfeatures.c.path == path,
+                        self.xfeatures.c.path.like(
+                            self.escape_like(path + '/') + '%',
+                            escape=ESCAPE_CHAR)))
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return rows
+
     def access_inherit(self, path):
         """Return the paths influencing the access for path."""
 
@@ -118,6 +118,17 @@ class Public(DBWorker):
         r.close()
         return rows
 
+    def public_get_bulk(self, paths):
+        if not paths:
+            return []
+        s = select([self.public.c.path, self.public.c.url])
+        s = s.where(and_(self.public.c.path.in_(paths),
+                         self.public.c.active == True))
+        r = self.conn.execute(s)
+        rows = r.fetchall()
+        r.close()
+        return rows
+
     def public_path(self, public):
         s = select([self.public.c.path])
         s = s.where(and_(self.public.c.url == public,
@@ -16,6 +16,7 @@
 from time import time
 from operator import itemgetter
 from itertools import groupby
+from collections import defaultdict
 
 from dbworker import DBWorker
 
@@ -28,6 +29,9 @@ ROOTNODE = 0
 
 inf = float('inf')
 
+# The clusters of the latest, of the previous and of the deleted versions.
+(NORMAL_CLUSTER, HISTORY_CLUSTER, DELETED_CLUSTER) = (0, 1, 2)
+
 
 def strnextling(prefix):
     """Return the first unicode string
@@ -201,17 +205,23 @@ class Node(DBWorker):
             return r[0]
         return None
 
-    def node_lookup_bulk(self, paths):
+    def node_lookup_bulk(self, paths, with_paths=False):
         """Lookup the current nodes for the given paths.
            Return () if the path is not found.
+           If with_paths is True, return a dictionary of path: node
+           for the paths found instead.
         """
 
+        if with_paths and not paths:
+            return {}
         placeholders = ','.join('?' for path in paths)
-        q = "select node from nodes where path in (%s)" % placeholders
+        q = "select path, node from nodes where path in (%s)" % placeholders
         self.execute(q, paths)
         r = self.fetchall()
+        if with_paths:
+            return dict(r)
         if r is not None:
-            return [row[0] for row in r]
+            return [row[1] for row in r]
         return None
 
     def node_get_properties(self, node):
@@ -367,6 +377,74 @@ class Node(DBWorker):
         execute(q, (node,))
         return hashes, size, serials
 
+    def nodes_delete_latest(self, parent, serials, muser, remove=False,
+                            update_statistics_ancestors_depth=None):
+        """Delete the objects with the given latest versions under parent.
+           Each latest version is moved to the history cluster, or removed
+           if remove is True, and an empty version that keeps its mapfile
+           takes its place in the deleted cluster. Versions no longer latest
+           are skipped.
+           Return the hashes and the total size of the previous versions
+           and the serials of the new ones.
+        """
+
+        execute = self.execute
+        marks = ','.join('?' for s in serials)
+        q = ("select v.serial, v.node, v.hash, v.size from versions v, "
+             "nodes n where v.serial in (%s) and v.cluster = ? "
+             "and n.node = v.node and n.parent = ? "
+             "and n.latest_version = v.serial" % marks)
+        execute(q, list(serials) + [NORMAL_CLUSTER, parent])
+        rows = self.fetchall()
+        if not rows:
+            return (), 0, ()
+        serials = [r[0] for r in rows]
+        nodes = [r[1] for r in rows]
+        hashes = [r[2] for r in rows]
+        nr = len(rows)
+        size = sum(r[3] for r in rows)
+        mtime = time()
+        marks = ','.join('?' for s in serials)
+
+        self.statistics_update(parent, -nr, -size, mtime, NORMAL_CLUSTER)
+        self.statistics_update_ancestors(parent, -nr, -size, mtime,
+                                         NORMAL_CLUSTER,
+                                         update_statistics_ancestors_depth)
+        q = ("insert into versions (node, hash, size, type, source, mtime, "
+             "muser, uuid, checksum, cluster, available, "
+             "map_check_timestamp, mapfile, is_snapshot) "
+             "select node, null, 0, '', serial, ?, ?, uuid, '', ?, "
+             "available, map_check_timestamp, mapfile, is_snapshot "
+             "from versions where serial in (%s)" % marks)
+        execute(q, [mtime, muser, DELETED_CLUSTER] + serials)
+        self.statistics_update(parent, nr, 0, mtime, DELETED_CLUSTER)
+        self.statistics_update_ancestors(parent, nr, 0, mtime,
+                                         DELETED_CLUSTER,
+                                         update_statistics_ancestors_depth)
+        if remove:
+            q = "delete from versions where serial in (%s)" % marks
+            execute(q, serials)
+        else:
+            self.statistics_update(parent, nr, size, mtime, HISTORY_CLUSTER)
+            self.statistics_update_ancestors(
+                parent, nr, size, mtime, HISTORY_CLUSTER,
+                update_statistics_ancestors_depth)
+            q = ("update versions set cluster = ? "
+                 "where serial in (%s)" % marks)
+            execute(q, [HISTORY_CLUSTER] + serials)
+
+        marks = ','.join('?' for n in nodes)
+        q = ("update nodes set latest_version = (select max(serial) "
+             "from versions where versions.node = nodes.node) "
+             "where node in (%s)" % marks)
+        execute(q, nodes)
+        q = "update attributes set is_latest = 0 where node in (%s)" % marks
+        execute(q, nodes)
+
+        q = "select latest_version from nodes where node in (%s)" % marks
+        execute(q, nodes)
+        return hashes, size, [r[0] for r in self.fetchall()]
+
     def node_remove(self, node, update_statistics_ancestors_depth=None):
         """Remove the node specified.
            Return false if the node has children or is not found.
@@ -580,10 +658,13 @@ class Node(DBWorker):
 
        If mapfile is not None, set mapfile to this value.
        Otherwise, assign to the mapfile a new unique identifier.
+       Empty versions have no mapfile, except for the deleted ones,
+       which keep the mapfile of the version they replace.
         """
 
         if size == 0:
-            mapfile = None
+            if cluster != DELETED_CLUSTER:
+                mapfile = None
         elif mapfile is None:
             q = ("insert into mapfile_seq (dummy) values (?)")
             serial = self.execute(q, (False,)).lastrowid
@@ -775,6 +856,22 @@ class Node(DBWorker):
             execute(q, (serial, domain))
         return self.fetchall()
 
+    def attribute_get_bulk(self, serials, domain):
+        """Return a dictionary of serial: list of (key, value) pairs
+           of the specific versions.
+        """
+
+        attributes = defaultdict(list)
+        if not serials:
+            return attributes
+        marks = ','.join('?' for s in serials)
+        q = ("select serial, key, value from attributes "
+             "where serial in (%s) and domain = ?" % (marks,))
+        self.execute(q, list(serials) + [domain])
+        for serial, key, value in self.fetchall():
+            attributes[serial].append((key, value))
+        return attributes
+
     def attribute_set(self, serial, domain, node, items, is_latest=True):
         """Set the attributes of the version specified by serial.
            Receive attributes as an iterable of (key, value) pairs.
@@ -153,6 +153,18 @@ class Permissions(XFeatures, Groups, Public, Node):
             return access_check_paths
         return None
 
+    def access_list_container(self, path):
+        """Return (path, key, value) for the permissions of the container
+           at path and of everything under it. Paths with a feature but
+           no members are returned with None key and value."""
+
+        q = ("select x.path, xvals.key, xvals.value "
+             "from xfeatures x left join xfeaturevals xvals "
+             "on xvals.feature_id = x.feature_id "
+             "where x.path = ? or x.path like ? escape '\\'")
+        self.execute(q, (path, self.escape_like(path + '/') + '%'))
+        return self.fetchall()
+
     def access_inherit(self, path):
         """Return the paths influencing the access for path."""
 
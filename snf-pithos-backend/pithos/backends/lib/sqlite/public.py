@@ -85,6 +85,15 @@ class Public(DBWorker):
         self.execute(q, (self.escape_like(prefix) + '%',))
         return self.fetchall()
 
+    def public_get_bulk(self, paths):
+        if not paths:
+            return []
+        placeholders = ','.join('?' for path in paths)
+        q = ("select path, url from public where "
+             "path in (%s) and active = 1" % placeholders)
+        self.execute(q, paths)
+        return self.fetchall()
+
     def public_path(self, public):
         q = "select path from public where url = ? and active = 1"
         self.execute(q, (public,))
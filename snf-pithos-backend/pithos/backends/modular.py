@@ -16,11 +16,11 @@
 import sys
 import uuid as uuidlib
 import logging
-import hashlib
 import binascii
 
 from collections import defaultdict, OrderedDict
 from functools import wraps, partial
+from threading import Lock
 from traceback import format_exc
 from time import time
 
@@ -34,6 +34,9 @@ try:
 except ImportError:
     AstakosClient = None
 
+from pithos.backends.blockcache import get_shared_block_cache
+from pithos.backends.hashmap import HashMap, MerkleTree
+from pithos.backends.util import WorkerPool
 from pithos.backends.base import (
     DEFAULT_ACCOUNT_QUOTA, DEFAULT_CONTAINER_QUOTA,
     DEFAULT_CONTAINER_VERSIONING, NotAllowedError, QuotaError,
@@ -53,35 +56,6 @@ class DisabledAstakosClient(object):
         raise AssertionError(m)
 
 
-# Stripped-down version of the HashMap class found in tools.
-
-class HashMap(list):
-
-    def __init__(self, blocksize, blockhash):
-        super(HashMap, self).__init__()
-        self.blocksize = blocksize
-        self.blockhash = blockhash
-
-    def _hash_raw(self, v):
-        h = hashlib.new(self.blockhash)
-        h.update(v)
-        return h.digest()
-
-    def hash(self):
-        if len(self) == 0:
-            return self._hash_raw('')
-        if len(self) == 1:
-            return self.__getitem__(0)
-
-        h = list(self)
-        s = 2
-        while s < len(h):
-            s = s * 2
-        h += [('\x00' * len(h[0]))] * (s - len(h))
-        while len(h) > 1:
-            h = [self._hash_raw(h[x] + h[x + 1]) for x in range(0, len(h), 2)]
-        return h[0]
-
 # Default modules and settings.
 DEFAULT_DB_MODULE = 'pithos.backends.lib.sqlalchemy'
 DEFAULT_DB_CONNECTION = 'sqlite:///backend.db'
@@ -118,8 +92,51 @@ DEFAULT_MAP_CHECK_INTERVAL = 5  # set to 5 secs
 
 DEFAULT_MAPFILE_PREFIX = 'snf_file_'
 
+MERKLE_TREE_CACHE_SIZE = 8
+
 logger = logging.getLogger(__name__)
 
+_map_reaper = None
+_map_reaper_lock = Lock()
+
+_merkle_trees = OrderedDict()  # (algorithm, hex top hash) -> MerkleTree
+_merkle_trees_lock = Lock()
+
+
+def get_map_reaper():
+    """Return the worker deleting the maps of removed versions."""
+
+    global _map_reaper
+    with _map_reaper_lock:
+        if _map_reaper is None:
+            _map_reaper = WorkerPool(1)
+        return _map_reaper
+
+
+def _reap_maps(store, names):
+    for name in names:
+        try:
+            store.map_delete(name)
+        except Exception:
+            logger.exception("Failed to delete map %s", name)
+
+
+def _pop_merkle_tree(key):
+    """Remove and return the cached tree of a hashmap, or None."""
+
+    with _merkle_trees_lock:
+        return _merkle_trees.pop(key, None)
+
+
+def _put_merkle_tree(key, tree):
+    """Cache the tree of a hashmap, evicting the least recently used."""
+
+    with _merkle_trees_lock:
+        _merkle_trees.pop(key, None)
+        _merkle_trees[key] = tree
+        while len(_merkle_trees) > MERKLE_TREE_CACHE_SIZE:
+            _merkle_trees.popitem(last=False)
+
 _propnames = ('serial', 'node',  'hash', 'size', 'type', 'source', 'mtime',
               'muser', 'uuid', 'checksum', 'cluster', 'available',
               'map_check_timestamp', 'mapfile', 'is_snapshot')
@@ -165,6 +182,103 @@ def debug_method(func):
     return wrapper
 
 
+class PermissionResolver(object):
+    """Resolve the object permissions of a request from memory.
+
+    The first check under a container loads the permissions of the whole
+    container and the first check of a user loads the groups the user
+    belongs to. Whether an object is public and the directory status of
+    the paths that objects inherit permissions from are looked up once per
+    path.
+    The resolver must be cleared when any of these change.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.clear()
+
+    def clear(self):
+        self.containers = {}
+        self.groups = {}
+        self.public = {}
+        self.directories = {}
+
+    def _container(self, account, container):
+        prefix = '/'.join((account, container))
+        c = self.containers.get(prefix)
+        if c is None:
+            features = {}
+            for path, key, value in \
+                    self.backend.permissions.access_list_container(prefix):
+                members = features.setdefault(path, defaultdict(set))
+                if key is not None:
+                    members[key].add(value)
+            c = self.containers[prefix] = features
+        return c
+
+    def _groups(self, user):
+        groups = self.groups.get(user)
+        if groups is None:
+            groups = self.groups[user] = set(
+                owner + ':' + group for owner, group in
+                self.backend.permissions.group_parents(user))
+        return groups
+
+    def _is_directory(self, path):
+        r = self.directories.get(path)
+        if r is None:
+            r = False
+            node = self.backend.node.node_lookup(path)
+            if node is not None:
+                props = self.backend.node.version_lookup(node, inf,
+                                                         CLUSTER_NORMAL)
+                if props is not None:
+                    r = props[self.backend.TYPE].split(';', 1)[0].strip() in (
+                        'application/directory', 'application/folder')
+            self.directories[path] = r
+        return r
+
+    def is_public(self, account, container, name):
+        path = '/'.join((account, container, name))
+        r = self.public.get(path)
+        if r is None:
+            r = self.public[path] = \
+                self.backend.permissions.public_get(path) is not None
+        return r
+
+    def permissions_path(self, account, container, name):
+        """Return the path the object gets its permissions from, or None.
+
+        Same as ModularBackend._get_permissions_path.
+        """
+
+        features = self._container(account, container)
+        path = '/'.join((account, container, name))
+        parts = path.rstrip('/').split('/')
+        valid = []
+        for i in range(1, len(parts)):
+            subp = '/'.join(parts[:i + 1])
+            valid.append(subp)
+            if subp != path:
+                valid.append(subp + '/')
+        for p in sorted((x for x in valid if x in features), reverse=True):
+            if p == path:
+                return p
+            if p.count('/') < 2:
+                continue
+            if self._is_directory(p):
+                return p
+        return None
+
+    def access_check(self, account, container, path, access, user):
+        """Same as Permissions.access_check, for a path in the container."""
+
+        members = self._container(account, container)[path][access]
+        if user in members or '*' in members:
+            return True
+        return not members.isdisjoint(self._groups(user))
+
+
 def check_allowed_paths(action):
     """Decorator for backend methods checking path access granted to user.
 
@@ -221,7 +335,7 @@ class ModularBackend(BaseBackend):
     def __init__(self, db_module=None, db_connection=None,
                  block_module=None, block_size=None, hash_algorithm=None,
                  queue_module=None, queue_hosts=None, queue_exchange=None,
-                 astakos_auth_url=None, service_token=None,
+                 queue_async=False, astakos_auth_url=None, service_token=None,
                  astakosclient_poolsize=None,
                  free_versioning=True, block_params=None,
                  public_url_security=None,
@@ -232,7 +346,15 @@ class ModularBackend(BaseBackend):
                  archipelago_conf_file=None,
                  xseg_pool_size=8,
                  map_check_interval=None,
-                 mapfile_prefix=None):
+                 mapfile_prefix=None,
+                 block_cache_size=0,
+                 block_cache_disk_path=None,
+                 block_cache_disk_size=0,
+                 db_pool_size=0,
+                 db_pool_max_overflow=10,
+                 db_pool_timeout=30,
+                 db_pool_pre_ping=True,
+                 batch_commissions=False):
         db_module = db_module or DEFAULT_DB_MODULE
         db_connection = db_connection or DEFAULT_DB_CONNECTION
         block_module = block_module or DEFAULT_BLOCK_MODULE
@@ -277,7 +399,14 @@ class ModularBackend(BaseBackend):
             return sys.modules[m]
 
         self.db_module = load_module(db_module)
-        self.wrapper = self.db_module.DBWrapper(db_connection)
+        if db_pool_size:
+            self.wrapper = self.db_module.DBWrapper(
+                db_connection, pool_size=db_pool_size,
+                pool_max_overflow=db_pool_max_overflow,
+                pool_timeout=db_pool_timeout,
+                pool_pre_ping=db_pool_pre_ping)
+        else:
+            self.wrapper = self.db_module.DBWrapper(db_connection)
         params = {'wrapper': self.wrapper}
         self.config = self.db_module.Config(**params)
         self.commission_serials = self.db_module.QuotaholderSerial(**params)
@@ -307,11 +436,22 @@ class ModularBackend(BaseBackend):
         params.update(self.block_params)
         self.store = self.block_module.Store(**params)
 
+        if block_cache_size:
+            self.block_cache = get_shared_block_cache(
+                block_cache_size, self.block_size,
+                disk_path=block_cache_disk_path,
+                disk_size=block_cache_disk_size)
+        else:
+            self.block_cache = None
+
+        self.queue_async = queue_async
         if queue_module and queue_hosts:
             self.queue_module = load_module(queue_module)
             params = {'hosts': queue_hosts,
                       'exchange': queue_exchange,
                       'client_id': QUEUE_CLIENT_ID}
+            if queue_async:
+                params['async_publish'] = True
             self.queue = self.queue_module.Queue(**params)
         else:
             class NoQueue:
@@ -340,12 +480,21 @@ class ModularBackend(BaseBackend):
         self.serials = []
         self.messages = []
 
+        # Size changes are issued as a single commission at commit.
+        self.batch_commissions = batch_commissions
+        self.provisions = defaultdict(int)
+        self.provision_names = []
+
+        # Maps of removed versions, deleted once the transaction commits.
+        self.removed_maps = []
+
         self._move_object = partial(self._copy_object, is_move=True)
 
         self.lock_container_path = False
 
         self.in_transaction = False
 
+        self.permission_resolver = PermissionResolver(self)
         self._reset_allowed_paths()
 
     @property
@@ -357,14 +506,26 @@ class ModularBackend(BaseBackend):
         self.lock_container_path = lock_container_path
         self.wrapper.execute()
         self.serials = []
+        self.provisions = defaultdict(int)
+        self.provision_names = []
+        self.removed_maps = []
         self._reset_allowed_paths()
         self.in_transaction = True
 
     def post_exec(self, success_status=True):
+        if success_status and self.provisions:
+            try:
+                self._issue_provisions()
+            except QuotaError:
+                self.post_exec(False)
+                raise
+
         if success_status:
-            # send messages produced
-            for m in self.messages:
-                self.queue.send(*m)
+            # send messages produced, unless they are published in the
+            # background once the changes are visible
+            if not self.queue_async:
+                for m in self.messages:
+                    self.queue.send(*m)
 
             # register serials
             if self.serials:
@@ -385,6 +546,14 @@ class ModularBackend(BaseBackend):
                     r['accepted'])
 
             self.wrapper.commit()
+
+            if self.queue_async:
+                for m in self.messages:
+                    self.queue.send(*m)
+
+            if self.removed_maps:
+                get_map_reaper().submit(_reap_maps, self.store,
+                                        self.removed_maps)
         else:
             if self.serials:
                 r = self.astakosclient.resolve_commissions(
@@ -393,8 +562,21 @@ class ModularBackend(BaseBackend):
                 self.commission_serials.delete_many(
                     r['rejected'])
             self.wrapper.rollback()
+        self.provisions.clear()
+        self.removed_maps = []
         self.in_transaction = False
 
+    def _commit_and_continue(self):
+        """Commit the changes made so far and go on in a new transaction.
+
+        Long running operations use it to release their locks in between.
+        """
+
+        lock_container_path = self.lock_container_path
+        self.post_exec(True)
+        self.messages = []
+        self.pre_exec(lock_container_path)
+
     def close(self):
         self.wrapper.close()
         self.queue.close()
@@ -495,6 +677,7 @@ class ModularBackend(BaseBackend):
                 self.permissions.group_delete(account, k)
             if v:
                 self.permissions.group_addmany(account, k, v)
+        self.permission_resolver.clear()
 
     @debug_method
     @backend_method
@@ -732,8 +915,7 @@ class ModularBackend(BaseBackend):
             hashes, size, serials = self.node.node_purge_children(
                 node, until, CLUSTER_HISTORY,
                 update_statistics_ancestors_depth=0)
-            for h in hashes:
-                self.store.map_delete(h)
+            self._delete_maps(hashes)
             self.node.node_purge_children(node, until, CLUSTER_DELETED,
                                           update_statistics_ancestors_depth=0)
             if not self.free_versioning:
@@ -752,8 +934,7 @@ class ModularBackend(BaseBackend):
             hashes, size, serials = self.node.node_purge_children(
                 node, inf, CLUSTER_HISTORY,
                 update_statistics_ancestors_depth=0)
-            for h in hashes:
-                self.store.map_delete(h)
+            self._delete_maps(hashes)
             self.node.node_purge_children(node, inf, CLUSTER_DELETED,
                                           update_statistics_ancestors_depth=0)
             self.node.node_remove(node, update_statistics_ancestors_depth=0)
@@ -766,49 +947,54 @@ class ModularBackend(BaseBackend):
                     }
                 )
         else:
-            # remove only contents
-            src_names = self._list_objects_no_limit(
-                user, account, container, prefix='', delimiter=None,
-                virtual=False, domain=None, keys=[], shared=False, until=None,
-                size_range=None, all_props=True, public=False,
-                listing_limit=listing_limit)
-            paths = []
-            freed_space = 0
-            dest_versions = []
-            for t in src_names:
-                path = '/'.join((account, container, t[0]))
-                node = t[2]
-                if not self._exists(node):
-                    continue
-
-                # keep reference to the mapfile
-                # in case we will want to delete them in the future
-                src_version_id, dest_version_id, _ = \
-                    self._put_version_duplicate(
-                        user, node, size=0, type='', hash=None, checksum='',
-                        cluster=CLUSTER_DELETED,
-                        update_statistics_ancestors_depth=1,
-                        keep_src_mapfile=True)
-                dest_versions.append(dest_version_id)
-                del_size = self._apply_versioning(
-                    account, container, src_version_id,
-                    update_statistics_ancestors_depth=1)
-                freed_space += del_size
-                self._report_object_change(
-                    user, account, path, details={'action': 'object delete'})
-                paths.append(path)
-            self.permissions.access_clear_bulk(paths)
-
-            self._report_size_change(
-                user, account, -freed_space, project, {
-                    'action': 'object delete',
-                    'path': '/'.join((account, container, '')),
-                    'versions': ','.join([str(id_) for id_ in dest_versions])})
+            # Remove only the contents, in batches of listing_limit objects.
+            # Each batch is committed before the next one is listed, so that
+            # large containers are emptied without holding the locks of the
+            # transaction until the end.
+            versioning = self._get_policy(
+                node, is_account_policy=False)[VERSIONING_POLICY]
+            remove = versioning != 'auto'
+            limit = listing_limit or 10000
+            marker = None
+            while True:
+                objects = self._list_object_properties(
+                    node, path, marker=marker, limit=limit, virtual=False)
+                if not objects:
+                    break
+                self._delete_objects(user, account, container, node,
+                                     project, objects, remove)
+                if len(objects) < limit:
+                    break
+                marker = objects[-1][0]
+                self._commit_and_continue()
 
         # remove all the cached allowed paths
         # removing the specific path could be more expensive
         self._reset_allowed_paths()
 
+    def _delete_objects(self, user, account, container, container_node,
+                        project, objects, remove):
+        """Delete the given (name, serial) objects of the container."""
+
+        hashes, size, dest_versions = self.node.nodes_delete_latest(
+            container_node, [serial for _, serial in objects], user,
+            remove=remove, update_statistics_ancestors_depth=0)
+        if remove:
+            self._delete_maps(hashes)
+        freed_space = size if remove or self.free_versioning else 0
+
+        paths = ['/'.join((account, container, name)) for name, _ in objects]
+        for path in paths:
+            self._report_object_change(
+                user, account, path, details={'action': 'object delete'})
+        self.permissions.access_clear_bulk(paths)
+
+        self._report_size_change(
+            user, account, -freed_space, project, {
+                'action': 'object delete',
+                'path': '/'.join((account, container, '')),
+                'versions': ','.join([str(id_) for id_ in dest_versions])})
+
     def _list_objects(self, user, account, container, prefix, delimiter,
                       marker, limit, virtual, domain, keys, shared, until,
                       size_range, all_props, public):
@@ -948,21 +1134,46 @@ class ModularBackend(BaseBackend):
 
     @debug_method
     @backend_method
-    def list_object_permissions(self, user, account, container, prefix=''):
+    def list_object_permissions(self, user, account, container, prefix='',
+                                names=None):
         """Return a list of paths enforce permissions under a container."""
 
+        if names is not None:
+            return self._list_object_permissions_bulk(user, account,
+                                                      container, names)
         return self._list_object_permissions(user, account, container, prefix,
                                              True, False)
 
+    def _list_object_permissions_bulk(self, user, account, container, names):
+        cpath = '/'.join((account, container, ''))
+        paths = [cpath + name for name in names]
+        rows = self.permissions.xfeature_get_bulk(paths) if paths else None
+        allowed = []
+        for feature, path in rows or ():
+            if user != account:
+                try:
+                    self._can_read_object(user, account, container,
+                                          path[len(cpath):])
+                except NotAllowedError:
+                    continue
+            allowed.append(path)
+        return allowed
+
     @debug_method
     @backend_method
-    def list_object_public(self, user, account, container, prefix=''):
+    def list_object_public(self, user, account, container, prefix='',
+                           names=None):
         """Return a mapping of object paths to public ids under a container."""
 
+        if names is not None:
+            cpath = '/'.join((account, container, ''))
+            rows = self.permissions.public_get_bulk(
+                [cpath + name for name in names])
+        else:
+            rows = self.permissions.public_list('/'.join((account, container,
+                                                          prefix)))
         public = {}
-        for path, p in self.permissions.public_list('/'.join((account,
-                                                              container,
-                                                              prefix))):
+        for path, p in rows:
             public[path] = p
         return public
 
@@ -1004,22 +1215,72 @@ class ModularBackend(BaseBackend):
                     'user defined metadata')
             meta.update(
                 dict(self.node.attribute_get(props[self.SERIAL], domain)))
-        meta.update({'name': name,
-                     'bytes': props[self.SIZE],
-                     'type': props[self.TYPE],
-                     'hash': props[self.HASH],
-                     'version': props[self.SERIAL],
-                     'version_timestamp': props[self.MTIME],
-                     'modified': modified,
-                     'modified_by': props[self.MUSER],
-                     'uuid': props[self.UUID],
-                     'checksum': props[self.CHECKSUM],
-                     'available': props[self.AVAILABLE],
-                     'map_check_timestamp': props[self.MAP_CHECK_TIMESTAMP],
-                     'mapfile': props[self.MAPFILE],
-                     'is_snapshot': props[self.IS_SNAPSHOT]})
+        meta.update(self._object_meta(name, props, modified))
         return meta
 
+    @debug_method
+    @backend_method
+    def get_object_meta_bulk(self, user, account, container, names,
+                             domain=None, include_user_defined=True):
+        """Return a list of metadata dicts of the named objects."""
+
+        if include_user_defined and domain is None:
+            raise ValueError(
+                'Domain argument is obligatory for getting '
+                'user defined metadata')
+        self._lookup_container(account, container)
+        prefix = '/'.join((account, container, ''))
+        paths = []
+        for name in names:
+            try:
+                self._can_read_object(user, account, container, name)
+            except NotAllowedError:
+                continue
+            paths.append(prefix + name)
+        nodes = self.node.node_lookup_bulk(paths, with_paths=True)
+        versions = dict((props[self.NODE], props) for props in
+                        self._get_versions(list(nodes.values())))
+        for node, props in versions.items():
+            if not props[self.AVAILABLE]:
+                try:
+                    self._update_available(props)
+                except IllegalOperationError:
+                    pass  # just update the database
+                finally:
+                    versions[node] = self._get_version(node)
+
+        attributes = {}
+        if include_user_defined:
+            attributes = self.node.attribute_get_bulk(
+                [props[self.SERIAL] for props in versions.itervalues()],
+                domain)
+        objects = []
+        for path in paths:
+            props = versions.get(nodes.get(path))
+            if props is None:
+                continue
+            meta = dict(attributes.get(props[self.SERIAL], ()))
+            meta.update(self._object_meta(path[len(prefix):], props,
+                                          props[self.MTIME]))
+            objects.append(meta)
+        return objects
+
+    def _object_meta(self, name, props, modified):
+        return {'name': name,
+                'bytes': props[self.SIZE],
+                'type': props[self.TYPE],
+                'hash': props[self.HASH],
+                'version': props[self.SERIAL],
+                'version_timestamp': props[self.MTIME],
+                'modified': modified,
+                'modified_by': props[self.MUSER],
+                'uuid': props[self.UUID],
+                'checksum': props[self.CHECKSUM],
+                'available': props[self.AVAILABLE],
+                'map_check_timestamp': props[self.MAP_CHECK_TIMESTAMP],
+                'mapfile': props[self.MAPFILE],
+                'is_snapshot': props[self.IS_SNAPSHOT]}
+
     @debug_method
     @backend_method
     def update_object_meta(self, user, account, container, name, domain, meta,
@@ -1136,6 +1397,7 @@ class ModularBackend(BaseBackend):
         else:
             self.permissions.public_set(
                 path, self.public_url_security, self.public_url_alphabet)
+        self.permission_resolver.clear()
 
     def _update_available(self, props):
         """Checks if the object map exists and updates the database"""
@@ -1323,7 +1585,8 @@ class ModularBackend(BaseBackend):
     @debug_method
     def update_object_hashmap(self, user, account, container, name, size, type,
                               hashmap, checksum, domain, meta=None,
-                              replace_meta=False, permissions=None):
+                              replace_meta=False, permissions=None,
+                              top_hash=None):
         """Create/update an object's hashmap and return the new version."""
 
         if not self._size_is_consistent(size, hashmap):
@@ -1331,6 +1594,7 @@ class ModularBackend(BaseBackend):
                 'The object\'s size does not match '
                 'with the object\'s hashmap length')
 
+        prev_hash = None
         try:
             path, node = self._lookup_object(account, container, name,
                                              lock_container=True)
@@ -1345,19 +1609,25 @@ class ModularBackend(BaseBackend):
                 if props[self.IS_SNAPSHOT]:
                     raise IllegalOperationError(
                         'Cannot update Archipelago volume hashmap.')
+                prev_hash = props[self.HASH]
         meta = meta or {}
         if size == 0:  # No such thing as an empty hashmap.
             hashmap = [self.put_block('')]
+            top_hash = None
         map_ = HashMap(self.block_size, self.hash_algorithm)
-        map_.extend([self._unhexlify_hash(x) for x in hashmap])
+        map_.extend(self._unhexlify_hash(x) for x in hashmap)
         missing = self.store.block_search(map_)
         if missing:
             ie = IndexError()
             ie.data = [binascii.hexlify(x) for x in missing]
             raise ie
 
-        hash_ = map_.hash()
-        hexlified = binascii.hexlify(hash_)
+        if top_hash is not None:
+            hexlified = top_hash
+        elif prev_hash is not None:
+            hexlified = self._update_merkle_tree(prev_hash, map_)
+        else:
+            hexlified = binascii.hexlify(map_.hash())
         # _update_object_hash() locks destination path
         dest_version_id, _, mapfile = self._update_object_hash(
             user, account, container, name, size, type, hexlified, checksum,
@@ -1366,6 +1636,28 @@ class ModularBackend(BaseBackend):
             self.store.map_put(mapfile, map_, size, self.block_size)
         return dest_version_id, hexlified
 
+    def _update_merkle_tree(self, prev_hash, map_):
+        """Return the (hex) top hash of map_, an update of the hashmap
+        whose top hash is prev_hash.
+
+        If the tree of the previous hashmap is cached, only the paths from
+        the changed blocks to the root are rehashed. The tree of map_ is
+        cached in turn.
+        """
+
+        tree = _pop_merkle_tree((self.hash_algorithm, prev_hash))
+        if tree is None or len(tree) > len(map_):
+            tree = MerkleTree(self.hash_algorithm, map_)
+        else:
+            for index, block_hash in enumerate(map_):
+                if index == len(tree):
+                    tree.append(block_hash)
+                elif tree[index] != block_hash:
+                    tree.update(index, block_hash)
+        hexlified = binascii.hexlify(tree.hash())
+        _put_merkle_tree((self.hash_algorithm, hexlified), tree)
+        return hexlified
+
     @debug_method
     @backend_method
     def update_object_checksum(self, user, account, container, name, version,
@@ -1615,14 +1907,14 @@ class ModularBackend(BaseBackend):
             if not self.free_versioning:
                 size += s
             serials += v
-            for h in hashes:
-                self.store.map_delete(h)
+            self._delete_maps(hashes)
             self.node.node_purge(node, until, CLUSTER_DELETED,
                                  update_statistics_ancestors_depth=1)
             try:
                 self._get_version(node)
             except NameError:
                 self.permissions.access_clear(path)
+                self.permission_resolver.clear()
             self._report_size_change(
                 user, account, -size, project, {
                     'action': 'object purge',
@@ -1771,9 +2063,15 @@ class ModularBackend(BaseBackend):
         """Return a block's data."""
 
         logger.debug("get_block: %s", hash)
+        if self.block_cache is not None:
+            block = self.block_cache.get(hash)
+            if block is not None:
+                return block
         block = self.store.block_get_archipelago(hash)
         if not block:
             raise ItemNotExists('Block does not exist')
+        if self.block_cache is not None:
+            self.block_cache.put(hash, block)
         return block
 
     def put_block(self, data):
@@ -2079,8 +2377,13 @@ class ModularBackend(BaseBackend):
         if not self.using_external_quotaholder:
             return
 
+        name = details['path'] if 'path' in details else ''
+        if self.batch_commissions and self.in_transaction:
+            self.provisions[(account, source)] += size
+            self.provision_names.append(name)
+            return
+
         try:
-            name = details['path'] if 'path' in details else ''
             serial = self.astakosclient.issue_one_commission(
                 holder=account,
                 provisions={(source, 'pithos.diskspace'): size},
@@ -2090,9 +2393,53 @@ class ModularBackend(BaseBackend):
         else:
             self.serials.append(serial)
 
+    def _issue_provisions(self):
+        """Issue the size changes of the transaction as one commission."""
+
+        provisions = dict((k, v) for k, v in self.provisions.iteritems()
+                          if v != 0)
+        names = self.provision_names
+        self.provisions = defaultdict(int)
+        self.provision_names = []
+        if not provisions:
+            return
+
+        name = names[0] if names else ''
+        if len(names) > 1:
+            name = '%s (and %d more)' % (name, len(names) - 1)
+        holders = set(holder for holder, source in provisions)
+        issue_generic = getattr(self.astakosclient,
+                                'issue_commission_generic', None)
+        try:
+            if len(holders) == 1 or issue_generic is None:
+                # The per holder call of older clients.
+                for holder in holders:
+                    serial = self.astakosclient.issue_one_commission(
+                        holder=holder,
+                        provisions=dict(
+                            ((source, 'pithos.diskspace'), size) for
+                            (h, source), size in provisions.iteritems()
+                            if h == holder),
+                        name=name)
+                    self.serials.append(serial)
+            else:
+                user_provisions = {}
+                project_provisions = defaultdict(int)
+                for (holder, source), size in provisions.iteritems():
+                    user_provisions[(holder, source, 'pithos.diskspace')] = \
+                        size
+                    project_provisions[(source, 'pithos.diskspace')] += size
+                serial = issue_generic(user_provisions,
+                                       dict(project_provisions), name=name)
+                self.serials.append(serial)
+        except BaseException, e:
+            raise QuotaError(e)
+
     @debug_method
     @backend_method
     def _report_object_change(self, user, account, path, details=None):
+        # The object may be a directory others inherit permissions from.
+        self.permission_resolver.clear()
         details = details or {}
         details.update({'user': user})
         self.messages.append((QUEUE_MESSAGE_KEY_PREFIX % ('object',),
@@ -2102,6 +2449,7 @@ class ModularBackend(BaseBackend):
     @debug_method
     @backend_method
     def _report_sharing_change(self, user, account, path, details=None):
+        self.permission_resolver.clear()
         details = details or {}
         details.update({'user': user})
         self.messages.append((QUEUE_MESSAGE_KEY_PREFIX % ('sharing',),
@@ -2182,13 +2530,22 @@ class ModularBackend(BaseBackend):
         if versioning != 'auto':
             hash, size = self.node.version_remove(
                 version_id, update_statistics_ancestors_depth)
-            self.store.map_delete(hash)
+            self._delete_maps([hash])
             return size
         elif self.free_versioning:
             return self.node.version_get_properties(
                 version_id, keys=('size',))[0]
         return 0
 
+    def _delete_maps(self, names):
+        """Delete the maps, in the background once the transaction commits.
+        """
+
+        if self.in_transaction:
+            self.removed_maps.extend(names)
+        else:
+            _reap_maps(self.store, names)
+
     # Access control functions.
 
     def _check_groups(self, groups):
@@ -2269,6 +2626,7 @@ class ModularBackend(BaseBackend):
     def _reset_allowed_paths(self):
         self.read_allowed_paths = defaultdict(set)
         self.write_allowed_paths = defaultdict(set)
+        self.permission_resolver.clear()
 
     @check_allowed_paths(action=0)
     def _can_read_account(self, user, account):
@@ -2299,25 +2657,28 @@ class ModularBackend(BaseBackend):
     def _can_read_object(self, user, account, container, name):
         if user == account:
             return True
-        path = '/'.join((account, container, name))
-        if self.permissions.public_get(path) is not None:
+        resolver = self.permission_resolver
+        if resolver.is_public(account, container, name):
             return True
-        path = self._get_permissions_path(account, container, name)
+        path = resolver.permissions_path(account, container, name)
         if not path:
             raise NotAllowedError
-        if (not self.permissions.access_check(path, self.READ, user) and not
-                self.permissions.access_check(path, self.WRITE, user)):
+        if (not resolver.access_check(account, container, path, self.READ,
+                                      user) and
+                not resolver.access_check(account, container, path,
+                                          self.WRITE, user)):
             raise NotAllowedError
 
     @check_allowed_paths(action=1)
     def _can_write_object(self, user, account, container, name):
         if user == account:
             return True
-        path = '/'.join((account, container, name))
-        path = self._get_permissions_path(account, container, name)
+        resolver = self.permission_resolver
+        path = resolver.permissions_path(account, container, name)
         if not path:
             raise NotAllowedError
-        if not self.permissions.access_check(path, self.WRITE, user):
+        if not resolver.access_check(account, container, path, self.WRITE,
+                                     user):
             raise NotAllowedError
 
     def _allowed_accounts(self, user):
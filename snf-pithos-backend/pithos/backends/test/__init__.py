@@ -17,6 +17,12 @@ from .common import CommonMixin
 from .quota import TestQuotaMixin
 from .delete_by_uuid import TestDeleteByUUIDMixin
 from .snapshots import TestSnapshotsMixin
+from .listing import TestListingMixin
+from .statistics import TestStatisticsMixin, TestStatisticsLogMixin
+from .permissions import TestPermissionsMixin
+from .blockcache import TestBlockCache
+from .hashmap import TestHashMap, TestObjectHashmapMixin
+from .batchqueue import TestBatchQueue
 
 from sqlalchemy import create_engine
 
@@ -24,7 +30,10 @@ import os
 import time
 
 class TestSQLAlchemyBackend(CommonMixin, TestDeleteByUUIDMixin,
-                            TestQuotaMixin, TestSnapshotsMixin):
+                            TestQuotaMixin, TestSnapshotsMixin,
+                            TestListingMixin, TestStatisticsMixin,
+                            TestStatisticsLogMixin, TestPermissionsMixin,
+                            TestObjectHashmapMixin):
     db_module = 'pithos.backends.lib.sqlalchemy'
     db_connection_str = '%(scheme)s://%(user)s:%(pwd)s@%(host)s:%(port)s/%(name)s'
     scheme = os.environ.get('DB_SCHEME', 'postgres')
@@ -59,7 +68,9 @@ class TestSQLAlchemyBackend(CommonMixin, TestDeleteByUUIDMixin,
         c.connection.connection.set_isolation_level(1)
 
 class TestSQLiteBackend(CommonMixin, TestDeleteByUUIDMixin, TestQuotaMixin,
-                        TestSnapshotsMixin):
+                        TestSnapshotsMixin, TestListingMixin,
+                        TestStatisticsMixin, TestPermissionsMixin,
+                        TestObjectHashmapMixin):
     db_module = 'pithos.backends.lib.sqlite'
     db_connection = location = '/tmp/test_pithos_backend.db'
     mapfile_prefix ='snf_test_pithos_backend_sqlite_%s_' % time.time()
@@ -0,0 +1,91 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Event
+
+from pithos.backends.util import BatchQueue
+
+import unittest
+
+
+class TestBatchQueue(unittest.TestCase):
+    def test_batches(self):
+        batches = []
+        queue = BatchQueue(batches.append, batch_size=3)
+        for i in range(7):
+            self.assertTrue(queue.put(i))
+        self.assertTrue(queue.flush(5))
+        self.assertEqual(queue.backlog, 0)
+        self.assertEqual(sum(batches, []), range(7))
+        self.assertTrue(all(len(b) <= 3 for b in batches))
+
+    def test_full_backlog(self):
+        started = Event()
+        release = Event()
+        processed = []
+
+        def process(batch):
+            started.set()
+            release.wait()
+            processed.extend(batch)
+
+        queue = BatchQueue(process, batch_size=1, max_backlog=2)
+        self.assertTrue(queue.put(0))
+        started.wait(5)
+        self.assertTrue(queue.put(1))
+        self.assertFalse(queue.put(2))
+        self.assertEqual(queue.backlog, 2)
+        self.assertEqual(queue.dropped, 1)
+        self.assertFalse(queue.flush(0.1))
+
+        release.set()
+        self.assertTrue(queue.flush(5))
+        self.assertEqual(processed, [0, 1])
+
+    def test_failed_batch(self):
+        processed = []
+        failures = []
+
+        def process(batch):
+            if 0 in batch and len(failures) < 2:
+                failures.append(batch)
+                raise Exception('Broker down')
+            processed.extend(batch)
+
+        queue = BatchQueue(process, batch_size=1, retry_backoff=0.01)
+        queue.put(0)
+        queue.put(1)
+        self.assertTrue(queue.flush(5))
+        self.assertEqual(failures, [[0], [0]])
+        self.assertEqual(processed, [0, 1])
+        self.assertEqual((queue.backlog, queue.processed, queue.dropped),
+                         (0, 2, 0))
+
+    def test_permanently_failed_batch(self):
+        processed = []
+
+        def process(batch):
+            if 0 in batch:
+                raise Exception('Not serializable')
+            processed.extend(batch)
+
+        queue = BatchQueue(process, batch_size=1, retry_backoff=0.01,
+                           max_retries=2)
+        queue.put(0)
+        queue.put(1)
+        self.assertTrue(queue.flush(5))
+        self.assertEqual(processed, [1])
+        self.assertEqual((queue.backlog, queue.processed, queue.dropped),
+                         (0, 1, 1))
@@ -0,0 +1,78 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pithos.backends.blockcache import BlockCache
+
+from .util import get_random_data
+
+import tempfile
+import shutil
+import unittest
+
+
+class TestBlockCache(unittest.TestCase):
+    block_size = 16
+
+    def setUp(self):
+        self.cache = BlockCache(4 * self.block_size, self.block_size)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_get_put(self):
+        data = get_random_data(self.block_size)
+        self.assertEqual(self.cache.get('a'), None)
+        self.cache.put('a', data)
+        self.assertEqual(self.cache.get('a'), data)
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['used'], self.block_size)
+
+    def test_lru_eviction(self):
+        for key in 'abcd':
+            self.cache.put(key, get_random_data(self.block_size))
+        # Access 'a', so that 'b' becomes the least recently used.
+        self.assertTrue(self.cache.get('a') is not None)
+        self.cache.put('e', get_random_data(self.block_size))
+        self.assertTrue('b' not in self.cache)
+        for key in 'acde':
+            self.assertTrue(key in self.cache)
+        self.assertEqual(self.cache.used, 4 * self.block_size)
+
+    def test_oversized_block(self):
+        self.cache.put('a', get_random_data(5 * self.block_size))
+        self.assertTrue('a' not in self.cache)
+        self.assertEqual(self.cache.used, 0)
+
+    def test_disk_tier(self):
+        path = tempfile.mkdtemp()
+        try:
+            cache = BlockCache(self.block_size, self.block_size,
+                               disk_path=path, disk_size=2 * self.block_size)
+            blocks = dict((key, get_random_data(self.block_size))
+                          for key in 'abc')
+            for key in 'abc':
+                cache.put(key, blocks[key])
+            # 'c' is in memory, 'a' and 'b' are on disk.
+            self.assertEqual(cache.get('a'), blocks['a'])
+            self.assertEqual(cache.get('b'), blocks['b'])
+            self.assertEqual(cache.get('c'), blocks['c'])
+            stats = cache.stats()
+            self.assertEqual(stats['disk_hits'], 3)
+            self.assertEqual(stats['misses'], 0)
+            cache.close()
+        finally:
+            shutil.rmtree(path)
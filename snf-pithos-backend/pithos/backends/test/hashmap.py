@@ -0,0 +1,127 @@
+# Copyright (C) 2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pithos.backends import modular
+from pithos.backends.hashmap import HashMap, TreeHash, MerkleTree
+
+from .util import get_random_data, get_random_name
+
+from mock import patch
+
+import binascii
+import hashlib
+import random
+import unittest
+
+
+def _hash(v, blockhash='sha256'):
+    h = hashlib.new(blockhash)
+    h.update(v)
+    return h.digest()
+
+
+def merkle(hashes, blockhash='sha256'):
+    """Compute the top hash by building the whole padded tree."""
+
+    if len(hashes) == 0:
+        return _hash('', blockhash)
+    if len(hashes) == 1:
+        return hashes[0]
+    h = list(hashes)
+    s = 2
+    while s < len(h):
+        s = s * 2
+    h += [('\x00' * len(h[0]))] * (s - len(h))
+    while len(h) > 1:
+        h = [_hash(h[x] + h[x + 1], blockhash) for x in range(0, len(h), 2)]
+    return h[0]
+
+
+class TestHashMap(unittest.TestCase):
+    blockhash = 'sha256'
+
+    def random_hashes(self, n):
+        return [_hash(str(random.random()), self.blockhash)
+                for i in xrange(n)]
+
+    def test_hashmap(self):
+        for n in range(20) + [31, 32, 33, 100]:
+            hashes = self.random_hashes(n)
+            m = HashMap(1024, self.blockhash)
+            m.extend(hashes)
+            self.assertEqual(m.hash(), merkle(hashes, self.blockhash))
+
+    def test_tree_hash_streaming(self):
+        hashes = self.random_hashes(70)
+        tree = TreeHash(self.blockhash)
+        self.assertEqual(tree.hash(), merkle([], self.blockhash))
+        for i, h in enumerate(hashes):
+            tree.update(h)
+            self.assertEqual(tree.hash(),
+                             merkle(hashes[:i + 1], self.blockhash))
+
+    def test_merkle_tree_append(self):
+        hashes = self.random_hashes(40)
+        tree = MerkleTree(self.blockhash)
+        self.assertEqual(tree.hash(), merkle([], self.blockhash))
+        for i, h in enumerate(hashes):
+            tree.append(h)
+            self.assertEqual(tree.hash(),
+                             merkle(hashes[:i + 1], self.blockhash))
+
+    def test_merkle_tree_update(self):
+        for n in (1, 2, 3, 8, 13):
+            hashes = self.random_hashes(n)
+            tree = MerkleTree(self.blockhash, hashes)
+            self.assertEqual(tree.hash(), merkle(hashes, self.blockhash))
+            for i in xrange(n):
+                h = self.random_hashes(1)[0]
+                hashes[i] = h
+                tree.update(i, h)
+                self.assertEqual(tree.hash(), merkle(hashes, self.blockhash))
+            self.assertRaises(IndexError, tree.update, n, h)
+
+
+class TestObjectHashmapMixin(object):
+    def _update(self, container, name, blocks):
+        hashmap = [self.b.put_block(data) for data in blocks]
+        size = sum(len(data) for data in blocks)
+        _, top_hash = self.b.update_object_hashmap(
+            self.account, self.account, container, name, size,
+            'application/octet-stream', hashmap, '', 'pithos')
+        hashes = [binascii.unhexlify(x) for x in hashmap]
+        self.assertEqual(top_hash, binascii.hexlify(
+            merkle(hashes, self.hash_algorithm)))
+        return top_hash
+
+    def test_update_object_hashmap_incremental(self):
+        container, name = get_random_name(), get_random_name()
+        self.b.put_container(self.account, self.account, container)
+        blocks = [get_random_data(self.block_size) for _ in xrange(5)]
+        self._update(container, name, blocks)
+        # The first update of the object builds and caches its tree.
+        blocks[2] = get_random_data(self.block_size)
+        self._update(container, name, blocks)
+
+        with patch.object(modular, 'MerkleTree') as tree_class:
+            blocks[4] = get_random_data(self.block_size)
+            self._update(container, name, blocks)
+            blocks.append(get_random_data(self.block_size))
+            blocks[0] = get_random_data(self.block_size)
+            self._update(container, name, blocks)
+            self.assertFalse(tree_class.called)
+
+        # Truncated hashmaps are rehashed.
+        self._update(container, name, blocks[:3])
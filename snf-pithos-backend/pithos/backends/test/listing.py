@@ -0,0 +1,122 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import partial
+
+from pithos.backends.random_word import get_random_word
+
+get_random_name = partial(get_random_word, length=8)
+
+
+class TestListingMixin(object):
+    def _list(self, container, prefix='', delimiter='/', marker=None,
+              limit=10000):
+        return [o[0] for o in self.b.list_objects(
+            self.account, self.account, container, prefix=prefix,
+            delimiter=delimiter, marker=marker, limit=limit)]
+
+    def test_list_delimiter(self):
+        container = get_random_name()
+        self.b.put_container(self.account, self.account, container)
+        for name in ('a', 'b/', 'b/c', 'b/d/e', 'f/g/h', 'f/i', 'j'):
+            self.upload_object(self.account, self.account, container, name)
+
+        self.assertEqual(self._list(container),
+                         ['a', 'b/', 'b/', 'f/', 'j'])
+        self.assertEqual(self._list(container, prefix='b/'),
+                         ['b/', 'b/c', 'b/d/'])
+        self.assertEqual(self._list(container, prefix='f/'),
+                         ['f/g/', 'f/i'])
+        self.assertEqual(self._list(container, prefix='f/g/'),
+                         ['f/g/h'])
+        self.assertEqual(self._list(container, prefix='b/d'),
+                         ['b/d/'])
+
+        # Markers and limits.
+        self.assertEqual(self._list(container, limit=2), ['a', 'b/'])
+        self.assertEqual(self._list(container, marker='b/d/e'),
+                         ['f/', 'j'])
+        self.assertEqual(self._list(container, marker='b/c'),
+                         ['b/', 'f/', 'j'])
+
+        # Virtual directories go away with their last object.
+        self.b.delete_object(self.account, self.account, container, 'f/i')
+        self.assertEqual(self._list(container, prefix='f/'), ['f/g/'])
+        self.b.delete_object(self.account, self.account, container, 'f/g/h')
+        self.assertEqual(self._list(container), ['a', 'b/', 'b/', 'j'])
+
+        # And come back with a new one.
+        self.upload_object(self.account, self.account, container, 'f/g/k')
+        self.assertEqual(self._list(container), ['a', 'b/', 'b/', 'f/', 'j'])
+        self.b.move_object(self.account, self.account, container, 'f/g/k',
+                           self.account, container, 'l/m',
+                           'application/octet-stream', 'pithos')
+        self.assertEqual(self._list(container), ['a', 'b/', 'b/', 'j', 'l/'])
+
+    def test_get_object_meta_bulk(self):
+        container = get_random_name()
+        self.b.put_container(self.account, self.account, container)
+        for name in ('a', 'b', 'c/d'):
+            self.upload_object(self.account, self.account, container, name)
+        self.b.update_object_meta(self.account, self.account, container, 'b',
+                                  'pithos', {'X-Object-Meta-Color': 'blue'})
+
+        objects = self.b.get_object_meta_bulk(
+            self.account, self.account, container, ['c/d', 'missing', 'b'],
+            'pithos')
+        self.assertEqual([o['name'] for o in objects], ['c/d', 'b'])
+        for o in objects:
+            meta = self.b.get_object_meta(self.account, self.account,
+                                          container, o['name'], 'pithos')
+            self.assertEqual(o, meta)
+        self.assertEqual(objects[1]['X-Object-Meta-Color'], 'blue')
+
+        # Others see only the objects shared with them.
+        other = get_random_name()
+        self.assertEqual(self.b.get_object_meta_bulk(
+            other, self.account, container, ['a', 'b'], 'pithos'), [])
+        self.b.update_object_permissions(self.account, self.account,
+                                         container, 'a', {'read': [other]})
+        objects = self.b.get_object_meta_bulk(
+            other, self.account, container, ['a', 'b'], 'pithos')
+        self.assertEqual([o['name'] for o in objects], ['a'])
+
+    def test_list_object_sharing_names(self):
+        container = get_random_name()
+        self.b.put_container(self.account, self.account, container)
+        for name in ('a', 'b', 'c'):
+            self.upload_object(self.account, self.account, container, name)
+        other = get_random_name()
+        for name in ('a', 'c'):
+            self.b.update_object_permissions(self.account, self.account,
+                                             container, name,
+                                             {'read': [other]})
+            self.b.update_object_public(self.account, self.account,
+                                        container, name, True)
+
+        cpath = '/'.join((self.account, container, ''))
+        self.assertEqual(self.b.list_object_permissions(
+            self.account, self.account, container, names=['b', 'c']),
+            [cpath + 'c'])
+        self.assertEqual(self.b.list_object_public(
+            self.account, self.account, container, names=['b', 'c']).keys(),
+            [cpath + 'c'])
+        self.assertEqual(self.b.list_object_permissions(
+            other, self.account, container, names=['a', 'b']),
+            [cpath + 'a'])
+        self.assertEqual(self.b.list_object_permissions(
+            self.account, self.account, container, names=[]), [])
+        self.assertEqual(self.b.list_object_public(
+            self.account, self.account, container, names=[]), {})
@@ -0,0 +1,115 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import partial
+
+from mock import patch
+
+from pithos.backends.base import NotAllowedError
+from pithos.backends.random_word import get_random_word
+
+get_random_name = partial(get_random_word, length=8)
+
+
+class TestPermissionsMixin(object):
+    def _can(self, user, container, name, access):
+        self.b._reset_allowed_paths()
+        if access == self.b.READ:
+            check = self.b._can_read_object
+        else:
+            check = self.b._can_write_object
+        try:
+            check(user, self.account, container, name)
+        except NotAllowedError:
+            return False
+        return True
+
+    def _can_unresolved(self, user, container, name, access):
+        """Check access the way it was done before the resolver."""
+
+        b = self.b
+        path = '/'.join((self.account, container, name))
+        if access == b.READ and b.permissions.public_get(path) is not None:
+            return True
+        path = b._get_permissions_path(self.account, container, name)
+        if not path:
+            return False
+        if access == b.READ:
+            return (b.permissions.access_check(path, b.READ, user) or
+                    b.permissions.access_check(path, b.WRITE, user))
+        return b.permissions.access_check(path, b.WRITE, user)
+
+    def test_permission_resolver(self):
+        account = self.account
+        container = get_random_name()
+        self.b.put_container(account, account, container)
+        self.b.update_account_groups(account, account, {'g': ['u2']})
+
+        upload = partial(self.upload_object, account, account, container)
+        share = partial(self.b.update_object_permissions, account, account,
+                        container)
+        for name in ('a', 'd/x', 'd/s/y', 'o/z', 'pub', 'all'):
+            upload(name, length=10)
+        upload('d', data='', length=0, type_='application/directory')
+        upload('o', length=10)
+        share('a', {'read': ['u1']})
+        share('d', {'write': [account + ':g'], 'read': ['u3']})
+        share('d/s/y', {'read': ['u1']})
+        share('o', {'write': ['u1']})
+        share('all', {'read': ['*']})
+        self.b.update_object_public(account, account, container, 'pub', True)
+
+        names = ('a', 'd', 'd/x', 'd/s/y', 'o', 'o/z', 'pub', 'all')
+        for user in ('u1', 'u2', 'u3', 'u4'):
+            for name in names:
+                for access in (self.b.READ, self.b.WRITE):
+                    self.assertEqual(
+                        self._can(user, container, name, access),
+                        self._can_unresolved(user, container, name, access),
+                        (user, name, access))
+
+        self.assertTrue(self._can('u2', container, 'd/x', self.b.WRITE))
+        self.assertFalse(self._can('u2', container, 'd/s/y', self.b.WRITE))
+        self.assertTrue(self._can('u1', container, 'd/s/y', self.b.READ))
+        self.assertFalse(self._can('u3', container, 'd/s/y', self.b.READ))
+        self.assertFalse(self._can('u1', container, 'o/z', self.b.READ))
+        self.assertTrue(self._can('u4', container, 'pub', self.b.READ))
+        self.assertFalse(self._can('u4', container, 'pub', self.b.WRITE))
+
+        # The container is loaded once per request, while the public
+        # status is looked up per object.
+        self.b._reset_allowed_paths()
+        with patch.object(self.b.permissions, 'access_list_container',
+                          wraps=self.b.permissions.access_list_container) \
+                as m:
+            with patch.object(self.b.permissions, 'public_list') as pl:
+                for name in names:
+                    try:
+                        self.b._can_read_object('u2', account, container,
+                                                name)
+                    except NotAllowedError:
+                        pass
+            self.assertEqual(m.call_count, 1)
+            self.assertFalse(pl.called)
+
+        # Changes are seen by the checks that follow in the same request.
+        self.b.pre_exec()
+        try:
+            self.assertRaises(NotAllowedError, self.b._can_read_object,
+                              'u4', account, container, 'a')
+            share('a', {'read': ['u4']})
+            self.b._can_read_object('u4', account, container, 'a')
+        finally:
+            self.b.post_exec()
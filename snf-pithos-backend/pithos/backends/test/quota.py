@@ -13,11 +13,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from mock import call
+from mock import call, patch, ANY
 from functools import wraps, partial
 
 import uuid as uuidlib
 
+from pithos.backends.base import QuotaError
+from pithos.backends.modular import get_map_reaper
 from pithos.backends.random_word import get_random_word
 
 
@@ -741,6 +743,60 @@ class TestQuotaMixin(object):
                 provisions={(project, 'pithos.diskspace'): -len(data)},
                 name='/'.join([account, container, '']))]
 
+    def test_delete_container_contents_batches(self):
+        account = self.account
+        container = get_random_name()
+        self.b.put_container(account, account, container,
+                             policy={'versioning': 'none'})
+        _, container_node = self.b._lookup_container(account, container)
+        project = self.b._get_project(container_node)
+        data = [self.upload_object(account, account, container,
+                                   get_random_name()) for i in range(5)]
+        # Single block objects, whose hash is the block hash.
+        hashes = [self.b.put_block(d) for d in data]
+
+        self.b.astakosclient.reset_mock()
+        commit = self.b._commit_and_continue
+        with patch.object(self.b.store, 'map_delete') as map_delete:
+            with patch.object(self.b, '_commit_and_continue',
+                              wraps=commit) as commit:
+                self.b.delete_container(account, account, container,
+                                        delimiter='/', listing_limit=2)
+            get_map_reaper().submit(lambda: None).get()
+
+        self.assertEqual(commit.call_count, 2)
+        self.assertEqual(sorted(c[0][0] for c in map_delete.call_args_list),
+                         sorted(hashes))
+        self.assertEqual(
+            self.b.list_objects(account, account, container), [])
+        meta = self.b.get_container_meta(account, account, container,
+                                         'pithos')
+        self.assertEqual((meta['count'], meta['bytes']), (0, 0))
+        provisions = [
+            c[2]['provisions'][(project, 'pithos.diskspace')] for c in
+            self.b.astakosclient.issue_one_commission.mock_calls]
+        self.assertEqual(len(provisions), 3)
+        self.assertEqual(sum(provisions), -len(''.join(data)))
+
+    def test_delete_container_contents_mapfiles(self):
+        account = self.account
+        container = get_random_name()
+        self.b.put_container(account, account, container)
+        names = [get_random_name() for i in range(3)]
+        for name in names:
+            self.upload_object(account, account, container, name)
+        self.b.delete_object(account, account, container, names[0])
+        self.b.delete_container(account, account, container, delimiter='/')
+
+        # Both delete paths keep the mapfile of the deleted version.
+        for name in names:
+            _, node = self.b._lookup_object(account, container, name)
+            versions = self.b.node.node_get_versions(
+                node, keys=('cluster', 'mapfile'))
+            self.assertEqual([c for c, m in versions], [1, 2])
+            self.assertEqual(versions[1][1], versions[0][1])
+            self.assertTrue(versions[1][1])
+
     @assert_issue_commission_calls
     def test_delete_object(self):
         account = self.account
@@ -785,3 +841,65 @@ class TestQuotaMixin(object):
                 holder=account,
                 provisions={(project, 'pithos.diskspace'): -len(data)},
                 name='/'.join([account, container, folder, '']))]
+
+    def test_batch_commissions(self):
+        self.expected_issue_commission_calls = []
+        account = self.account
+        container = get_random_name()
+        self.b.put_container(account, account, container)
+        _, container_node = self.b._lookup_container(account, container)
+        project = self.b._get_project(container_node)
+
+        folder = get_random_name()
+        self.create_folder(account, account, container, folder)
+        data1 = self.upload_object(account, account, container,
+                                   '/'.join([folder, get_random_name()]))
+        data2 = self.upload_object(account, account, container,
+                                   '/'.join([folder, get_random_name()]))
+
+        self.b.batch_commissions = True
+        self.b.astakosclient.reset_mock()
+        self.b.copy_object(account, account, container, folder,
+                           account, container, get_random_name(),
+                           'application/directory',
+                           domain='pithos',
+                           delimiter='/')
+        self.assertEqual(
+            self.b.astakosclient.issue_one_commission.mock_calls,
+            [call(holder=account,
+                  provisions={(project, 'pithos.diskspace'):
+                              len(data1) + len(data2)},
+                  name=ANY)])
+
+    def test_batch_commissions_holders(self):
+        self.b.batch_commissions = True
+        self.b.pre_exec()
+        self.b.provisions[('a', 'p1')] += 10
+        self.b.provisions[('b', 'p1')] += 5
+        self.b.provisions[('a', 'p2')] -= 3
+        self.b.provisions[('b', 'p2')] += 0
+        self.b.provision_names = ['x', 'y', 'z']
+        self.b.post_exec()
+        self.b.astakosclient.issue_commission_generic.assert_called_once_with(
+            {('a', 'p1', 'pithos.diskspace'): 10,
+             ('b', 'p1', 'pithos.diskspace'): 5,
+             ('a', 'p2', 'pithos.diskspace'): -3},
+            {('p1', 'pithos.diskspace'): 15,
+             ('p2', 'pithos.diskspace'): -3},
+            name='x (and 2 more)')
+        self.assertFalse(self.b.astakosclient.issue_one_commission.called)
+
+    def test_batch_commissions_quota_error(self):
+        account = self.account
+        container = get_random_name()
+        obj = get_random_name()
+        self.b.put_container(account, account, container)
+
+        self.b.batch_commissions = True
+        self.b.astakosclient.issue_one_commission.side_effect = \
+            Exception('Quota limit')
+        self.b.pre_exec()
+        self.upload_object(account, account, container, obj)
+        self.assertRaises(QuotaError, self.b.post_exec)
+        self.assertFalse(self.b.in_transaction)
+        self.assertObjectNotExist(account, container, obj)
@@ -0,0 +1,105 @@
+# Copyright (C) 2010-2014 GRNET S.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import partial
+
+from pithos.backends.random_word import get_random_word
+
+from sqlalchemy.sql import func, select
+
+import time
+
+get_random_name = partial(get_random_word, length=8)
+
+
+class TestStatisticsMixin(object):
+    def test_statistics(self):
+        account = self.account
+        account_node = self.b._lookup_account(account, True)[1]
+        statistics = partial(self.b._get_statistics, account_node,
+                             compute=True)
+        initial = statistics()
+        c1 = get_random_name()
+        c2 = get_random_name()
+        self.b.put_container(account, account, c1)
+        self.b.put_container(account, account, c2)
+        self.upload_object(account, account, c1, 'a', length=10)
+        self.upload_object(account, account, c2, 'b', length=20)
+        time.sleep(0.1)
+        until = time.time()
+        time.sleep(0.1)
+        self.upload_object(account, account, c1, 'a', length=30)
+        self.upload_object(account, account, c2, 'c', length=40)
+        self.b.delete_object(account, account, c2, 'b')
+
+        count, bytes, _ = statistics()
+        self.assertEqual(count, initial[0] + 2)
+        self.assertEqual(bytes, initial[1] + 70)
+        meta = self.b.get_container_meta(account, account, c2, 'pithos')
+        self.assertEqual((meta['count'], meta['bytes']), (1, 40))
+
+        # Point in time statistics.
+        count, bytes, _ = statistics(until=until)
+        self.assertEqual(count, initial[0] + 2)
+        self.assertEqual(bytes, initial[1] + 30)
+        meta = self.b.get_container_meta(account, account, c2, 'pithos',
+                                         until=until)
+        self.assertEqual((meta['count'], meta['bytes']), (1, 20))
+
+    def test_report_size_change_total(self):
+        account = self.account
+        c = get_random_name()
+        self.b.put_container(account, account, c)
+        self.upload_object(account, account, c, 'a', length=10)
+        self.upload_object(account, account, c, 'b', length=20)
+        self.b.delete_object(account, account, c, 'a')
+
+        details = [m[-1] for m in self.b.messages if m[3] == 'diskspace']
+        self.assertEqual([d['total'] for d in details[-3:]], [10, 30, 20])
+
+
+class TestStatisticsLogMixin(object):
+    def test_statistics_log_compaction(self):
+        account = self.account
+        c = get_random_name()
+        self.b.put_container(account, account, c)
+        node = self.b._lookup_container(account, c)[1]
+        log = self.b.node.statistics_log
+        retention = self.b.node.statistics_log_retention
+        every = self.b.node.statistics_log_compact_every
+        self.b.node.statistics_log_retention = 0
+        self.b.node.statistics_log_compact_every = 1
+        try:
+            self.upload_object(account, account, c, 'a', length=10)
+            time.sleep(0.1)
+            first = time.time()
+            time.sleep(0.1)
+            self.upload_object(account, account, c, 'b', length=20)
+            time.sleep(0.1)
+            second = time.time()
+            time.sleep(0.1)
+            self.upload_object(account, account, c, 'c', length=30)
+        finally:
+            self.b.node.statistics_log_retention = retention
+            self.b.node.statistics_log_compact_every = every
+
+        s = select([func.count(log.c.serial)], log.c.node == node)
+        self.assertEqual(self.b.node.conn.execute(s).scalar(), 2)
+
+        # Point in time statistics are still correct after compaction.
+        for until, size in ((first, 10), (second, 30)):
+            meta = self.b.get_container_meta(account, account, c, 'pithos',
+                                             until=until)
+            self.assertEqual(meta['bytes'], size)
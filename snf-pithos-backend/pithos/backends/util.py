@@ -17,8 +17,17 @@ from objpool import ObjectPool
 from new import instancemethod
 from select import select
 from traceback import print_exc
+from threading import Thread, Event, Lock, Condition
+from Queue import Queue
+from collections import deque
+from time import time, sleep
 from pithos.backends import connect_backend
 
+import sys
+import logging
+
+logger = logging.getLogger(__name__)
+
 USAGE_LIMIT = 500
 
 
@@ -26,7 +35,8 @@ class PithosBackendPool(ObjectPool):
     def __init__(self, size=None, db_module=None, db_connection=None,
                  block_module=None, block_size=None, hash_algorithm=None,
                  queue_module=None, queue_hosts=None,
-                 queue_exchange=None, free_versioning=True,
+                 queue_exchange=None, queue_async=False,
+                 free_versioning=True,
                  astakos_auth_url=None, service_token=None,
                  astakosclient_poolsize=None,
                  block_params=None,
@@ -38,7 +48,15 @@ class PithosBackendPool(ObjectPool):
                  archipelago_conf_file=None,
                  xseg_pool_size=8,
                  map_check_interval=None,
-                 mapfile_prefix=None):
+                 mapfile_prefix=None,
+                 block_cache_size=0,
+                 block_cache_disk_path=None,
+                 block_cache_disk_size=0,
+                 db_pool_size=0,
+                 db_pool_max_overflow=10,
+                 db_pool_timeout=30,
+                 db_pool_pre_ping=True,
+                 batch_commissions=False):
         super(PithosBackendPool, self).__init__(size=size)
         self.db_module = db_module
         self.db_connection = db_connection
@@ -49,6 +67,7 @@ class PithosBackendPool(ObjectPool):
         self.block_params = block_params
         self.queue_hosts = queue_hosts
         self.queue_exchange = queue_exchange
+        self.queue_async = queue_async
         self.astakos_auth_url = astakos_auth_url
         self.service_token = service_token
         self.astakosclient_poolsize = astakosclient_poolsize
@@ -62,6 +81,14 @@ class PithosBackendPool(ObjectPool):
         self.xseg_pool_size = xseg_pool_size
         self.map_check_interval = map_check_interval
         self.mapfile_prefix = mapfile_prefix
+        self.block_cache_size = block_cache_size
+        self.block_cache_disk_path = block_cache_disk_path
+        self.block_cache_disk_size = block_cache_disk_size
+        self.db_pool_size = db_pool_size
+        self.db_pool_max_overflow = db_pool_max_overflow
+        self.db_pool_timeout = db_pool_timeout
+        self.db_pool_pre_ping = db_pool_pre_ping
+        self.batch_commissions = batch_commissions
 
     def _pool_create(self):
         backend = connect_backend(
@@ -74,6 +101,7 @@ class PithosBackendPool(ObjectPool):
             block_params=self.block_params,
             queue_hosts=self.queue_hosts,
             queue_exchange=self.queue_exchange,
+            queue_async=self.queue_async,
             astakos_auth_url=self.astakos_auth_url,
             service_token=self.service_token,
             astakosclient_poolsize=self.astakosclient_poolsize,
@@ -86,7 +114,15 @@ class PithosBackendPool(ObjectPool):
             archipelago_conf_file=self.archipelago_conf_file,
             xseg_pool_size=self.xseg_pool_size,
             map_check_interval=self.map_check_interval,
-            mapfile_prefix=self.mapfile_prefix)
+            mapfile_prefix=self.mapfile_prefix,
+            block_cache_size=self.block_cache_size,
+            block_cache_disk_path=self.block_cache_disk_path,
+            block_cache_disk_size=self.block_cache_disk_size,
+            db_pool_size=self.db_pool_size,
+            db_pool_max_overflow=self.db_pool_max_overflow,
+            db_pool_timeout=self.db_pool_timeout,
+            db_pool_pre_ping=self.db_pool_pre_ping,
+            batch_commissions=self.batch_commissions)
 
         backend._real_close = backend.close
         backend.close = instancemethod(_pooled_backend_close, backend,
@@ -98,6 +134,9 @@ class PithosBackendPool(ObjectPool):
 
     def _pool_verify(self, backend):
         wrapper = backend.wrapper
+        if getattr(wrapper, 'pooled', False):
+            # Connections are checked out per request and pinged then.
+            return True
         conn = wrapper.conn
         if conn.closed:
             return False
@@ -137,6 +176,8 @@ class PithosBackendPool(ObjectPool):
                 wrapper.trans = None
             else:
                 wrapper.rollback()
+        if getattr(wrapper, 'pooled', False):
+            wrapper.release()
         backend.messages = []
         return False
 
@@ -151,3 +192,194 @@ class PithosBackendPool(ObjectPool):
 
 def _pooled_backend_close(backend):
     backend._pool.pool_put(backend)
+
+
+class AsyncResult(object):
+    """The result of a callable submitted to a WorkerPool."""
+
+    def __init__(self):
+        self._event = Event()
+        self._value = None
+        self._exc_info = None
+
+    def ready(self):
+        return self._event.is_set()
+
+    def set(self, value):
+        self._value = value
+        self._event.set()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._event.set()
+
+    def get(self):
+        """Wait for the result and return it.
+
+        If the callable raised, the exception is re-raised in the caller.
+        """
+        self._event.wait()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+
+class WorkerPool(object):
+    """A fixed size pool of daemon threads running submitted callables.
+
+    Threads are started on the first submission, so that a pool created
+    at import time does not spawn threads before the server forks.
+    Under a monkey patched (gevent) worker the threads are greenlets.
+    """
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("Invalid worker pool size: %s" % size)
+        self.size = size
+        self._queue = Queue()
+        self._workers = []
+        self._lock = Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule func(*args, **kwargs) and return an AsyncResult."""
+        if len(self._workers) < self.size:
+            self._start_workers()
+        result = AsyncResult()
+        self._queue.put((result, func, args, kwargs))
+        return result
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._workers) < self.size:
+                worker = Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            result, func, args, kwargs = self._queue.get()
+            try:
+                result.set(func(*args, **kwargs))
+            except:
+                result.set_exception(sys.exc_info())
+
+
+class BatchQueue(object):
+    """Hand items over to a daemon thread, which processes them in batches.
+
+    At most max_backlog items are kept waiting. Items put while the backlog
+    is full are dropped and counted, so that producers never block on a
+    slow consumer. A batch that fails to be processed stays at the head of
+    the backlog and is retried, waiting retry_backoff seconds, doubled on
+    each consecutive failure up to max_retry_backoff. A batch that still
+    fails after max_retries retries is dropped. The number of items
+    processed, waiting and dropped is logged at most once every
+    stats_interval seconds. As in WorkerPool, the thread is started on the
+    first put.
+    """
+
+    def __init__(self, process, batch_size=100, max_backlog=10000,
+                 retry_backoff=1, max_retry_backoff=60, max_retries=10,
+                 stats_interval=300):
+        if batch_size < 1:
+            raise ValueError("Invalid batch size: %s" % batch_size)
+        self.process = process
+        self.batch_size = batch_size
+        self.max_backlog = max_backlog
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.max_retries = max_retries
+        self.stats_interval = stats_interval
+        self.processed = 0
+        self.dropped = 0
+        self._buffer = deque()
+        self._pending = 0  # items buffered or being processed
+        self._cond = Condition()
+        self._worker = None
+        self._logged = time()
+
+    @property
+    def backlog(self):
+        """The number of items not processed yet."""
+        return self._pending
+
+    def put(self, item):
+        """Queue item for processing and return whether it was accepted."""
+        with self._cond:
+            if self._pending >= self.max_backlog:
+                if not self.dropped % self.max_backlog:
+                    logger.warning("Backlog of %d items is full, dropped %d "
+                                   "items so far", self._pending,
+                                   self.dropped + 1)
+                self.dropped += 1
+                return False
+            self._buffer.append(item)
+            self._pending += 1
+            if self._worker is None:
+                self._worker = Thread(target=self._work)
+                self._worker.daemon = True
+                self._worker.start()
+            self._cond.notify_all()
+            return True
+
+    def flush(self, timeout=None):
+        """Wait until the items put so far are processed.
+
+        Return False if they are not processed within timeout seconds.
+        """
+        deadline = None if timeout is None else time() + timeout
+        with self._cond:
+            while self._pending:
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def _work(self):
+        retries = 0
+        backoff = self.retry_backoff
+        while True:
+            with self._cond:
+                while not self._buffer:
+                    self._cond.wait()
+                batch = [self._buffer.popleft() for _ in
+                         xrange(min(self.batch_size, len(self._buffer)))]
+            try:
+                self.process(batch)
+            except Exception:
+                if retries < self.max_retries:
+                    logger.exception("Failed to process a batch of %d "
+                                     "items, retrying in %s seconds",
+                                     len(batch), backoff)
+                    with self._cond:
+                        self._buffer.extendleft(reversed(batch))
+                    sleep(backoff)
+                    retries += 1
+                    backoff = min(backoff * 2, self.max_retry_backoff)
+                    continue
+                logger.exception("Failed to process a batch of %d items "
+                                 "after %d retries, dropping it",
+                                 len(batch), retries)
+                failed = True
+            else:
+                failed = False
+            retries = 0
+            backoff = self.retry_backoff
+            with self._cond:
+                if failed:
+                    self.dropped += len(batch)
+                else:
+                    self.processed += len(batch)
+                self._pending -= len(batch)
+                self._cond.notify_all()
+                now = time()
+                if now - self._logged >= self.stats_interval:
+                    self._logged = now
+                    logger.info("Processed %d items, %d in backlog, "
+                                "dropped %d", self.processed,
+                                self._pending, self.dropped)